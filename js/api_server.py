@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+API REST BotIA (FastAPI) avec micro-batching des requêtes
+
+Les requêtes concurrentes sont regroupées pendant quelques millisecondes puis
+notées ensemble par diagnose_many, hors de la boucle asyncio (executor).
+
+Usage: python js/api_server.py [--port 8000] [--max-batch 32] [--max-latency-ms 5]
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer le moteur
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from js.diagnostic_engine import BotIADiagnosticEngine, SUGGEST_LIMIT
+
+try:
+    from fastapi import Body, FastAPI, HTTPException, Query
+    from fastapi.responses import PlainTextResponse, Response
+    from pydantic import BaseModel, Field
+except ImportError:  # fastapi est optionnel (voir requirements.txt)
+    FastAPI = None
+
+class MicroBatcher:
+    """
+    Regroupe les requêtes concurrentes en lots : un lot part dès qu'il atteint
+    max_batch_size requêtes ou que la plus ancienne attend depuis max_latency_ms.
+    Un seul lot est noté à la fois ; les requêtes arrivées entre-temps forment le suivant.
+    """
+    
+    def __init__(self, engine, max_batch_size=32, max_latency_ms=5.0, executor=None):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix='botia-batch')
+        self.queue = None
+        self.task = None
+        self.batches = 0
+        self.requests = 0
+        self.largest_batch = 0
+    
+    async def start(self):
+        """Démarre la boucle de regroupement (dans la boucle asyncio courante)"""
+        self.queue = asyncio.Queue()
+        self.task = asyncio.create_task(self._run())
+    
+    async def stop(self):
+        """Arrête la boucle ; les requêtes en attente reçoivent une erreur"""
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        while self.queue is not None and not self.queue.empty():
+            _, _, future = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(Exception("❌ Service arrêté"))
+    
+    async def submit(self, user_input, top_n=3):
+        """Ajoute une requête au prochain lot et attend son résultat"""
+        if self.task is None:
+            raise Exception("❌ MicroBatcher non démarré")
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((user_input, top_n, future))
+        return await future
+    
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_latency
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Requêtes abandonnées par le client pendant l'attente
+            batch = [item for item in batch if not item[2].done()]
+            if not batch:
+                continue
+            
+            self.batches += 1
+            self.requests += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            
+            try:
+                results = await loop.run_in_executor(self.executor, self.score_batch, batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            for (_, _, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+    
+    def score_batch(self, batch):
+        """Note un lot (dans l'executor) : un appel diagnose_many par valeur de top_n"""
+        by_top_n = {}
+        for position, (user_input, top_n, _) in enumerate(batch):
+            by_top_n.setdefault(top_n, []).append(position)
+        
+        results = [None] * len(batch)
+        for top_n, positions in by_top_n.items():
+            diagnoses = self.engine.diagnose_many([batch[position][0] for position in positions], top_n)
+            for position, diagnosis in zip(positions, diagnoses):
+                results[position] = diagnosis
+        return results
+    
+    def stats(self):
+        """Compteurs de regroupement"""
+        return {
+            'batches': self.batches,
+            'requests': self.requests,
+            'largest_batch': self.largest_batch,
+            'mean_batch': round(self.requests / self.batches, 2) if self.batches else 0
+        }
+
+def create_app(engine=None, max_batch_size=32, max_latency_ms=5.0, **engine_options):
+    """
+    Construit l'application FastAPI (/diagnose, /suggest, /diagnostics, /health, /metrics)
+    autour d'un moteur unique
+    """
+    if FastAPI is None:
+        raise Exception("❌ FastAPI non installé : pip install fastapi uvicorn")
+    
+    from contextlib import asynccontextmanager
+    
+    engine = engine or BotIADiagnosticEngine(**engine_options)
+    batcher = MicroBatcher(engine, max_batch_size, max_latency_ms)
+    started_at = time.time()
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        await batcher.start()
+        yield
+        await batcher.stop()
+    
+    app = FastAPI(title="BotIA - Diagnostic Automobile", lifespan=lifespan)
+    app.state.engine = engine
+    app.state.batcher = batcher
+    
+    class DiagnoseRequest(BaseModel):
+        query: str = Field(..., min_length=1, max_length=2000, description="Description du problème")
+        top: int = Field(3, ge=1, le=20, description="Nombre de résultats")
+        text: bool = Field(False, description="Ajouter la réponse formatée (format_response)")
+        session: Optional[str] = Field(None, max_length=128, description="Conversation à raffiner (voir refine)")
+        deadline_ms: Optional[float] = Field(None, gt=0, le=60000, description="Budget de temps (résultat partiel au-delà)")
+    
+    @app.post("/diagnose")
+    async def diagnose(request: DiagnoseRequest):
+        try:
+            if request.session is not None:
+                # Raffinement : peu de candidats, hors lots, dans l'executor du moteur
+                result = await asyncio.get_running_loop().run_in_executor(
+                    batcher.executor, engine.refine, request.session, request.query, request.top)
+            elif request.deadline_ms is not None:
+                # Budget propre à la requête : hors lots, l'attente d'un lot compterait dans le budget
+                result = await asyncio.get_running_loop().run_in_executor(
+                    None, engine.diagnose, request.query, request.top, request.deadline_ms)
+            else:
+                result = await batcher.submit(request.query, request.top)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        # JSON assemblé depuis les fragments pré-rendus, sans réencodage par FastAPI
+        suffix = {'response': engine.format_response(result)} if request.text else None
+        return Response(engine.format_json(result, suffix=suffix), media_type="application/json")
+    
+    class DiagnosticPayload(BaseModel):
+        keywords: List[str] = Field(..., min_length=1, description="Mots-clés du diagnostic")
+        titre: str = Field(..., min_length=1)
+        urgence: str = Field(..., description="critique, elevee, moyenne ou faible")
+        causes: List[str] = Field(default_factory=list)
+        solutions: List[str] = Field(default_factory=list)
+        cout_estime: str = "N/A"
+        contributeur: str = "inconnu"
+    
+    @app.put("/diagnostics/{diag_id}")
+    async def put_diagnostic(diag_id: str, diagnostic: DiagnosticPayload = Body(...)):
+        # Contribution en service en quelques millisecondes (journal + index du seul diagnostic)
+        try:
+            generation = await asyncio.get_running_loop().run_in_executor(
+                None, engine.put_diagnostic, diag_id, diagnostic.model_dump())
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+        return {'id': diag_id, 'generation': generation, 'pending_changes': engine.pending_changes}
+    
+    @app.delete("/diagnostics/{diag_id}")
+    async def delete_diagnostic(diag_id: str):
+        try:
+            generation = await asyncio.get_running_loop().run_in_executor(None, engine.remove_diagnostic, diag_id)
+        except LookupError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {'id': diag_id, 'generation': generation, 'pending_changes': engine.pending_changes}
+    
+    @app.get("/suggest")
+    async def suggest(q: str = Query(..., max_length=200, description="Début de saisie"),
+                      limit: int = Query(SUGGEST_LIMIT, ge=1, le=50, description="Nombre de suggestions")):
+        # Quelques microsecondes : exécuté directement, sans passer par les lots
+        return engine.suggest(q, limit)
+    
+    @app.get("/health")
+    async def health():
+        snapshot = engine.snapshot
+        return {
+            'status': 'ok' if snapshot is not None and snapshot.compiled else 'degraded',
+            'diagnostics': len(snapshot.compiled) if snapshot is not None else 0,
+            'database_version': snapshot.data.get('version', 'inconnue') if snapshot is not None else None,
+            'uptime_s': round(time.time() - started_at, 1),
+            'batching': batcher.stats(),
+            'sessions': engine.sessions.stats(),
+            'pending_changes': engine.pending_changes
+        }
+    
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        # Vide si le moteur n'a pas été créé avec metrics=True (--profile)
+        return engine.metrics_text()
+    
+    return app
+
+def main():
+    """Lance le service HTTP (uvicorn)"""
+    
+    parser = argparse.ArgumentParser(description='API REST BotIA avec micro-batching')
+    parser.add_argument('--host', default='127.0.0.1', help='Adresse d\'écoute (défaut: 127.0.0.1)')
+    parser.add_argument('--port', '-p', type=int, default=8000, help='Port (défaut: 8000)')
+    parser.add_argument('--database', '-d', help='Chemin vers la base de données JSON')
+    parser.add_argument('--max-batch', type=int, default=32, help='Taille maximale d\'un lot (défaut: 32)')
+    parser.add_argument('--max-latency-ms', type=float, default=5.0,
+                        help='Attente maximale pour compléter un lot, en ms (défaut: 5)')
+    parser.add_argument('--scoring', metavar='FICHIER',
+                        help='Poids du score, seuil et écart d\'ambiguïté (JSON de scripts/tune_weights.py --save)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Instrumentation par étape, exposée sur /metrics (format Prometheus)')
+    args = parser.parse_args()
+    
+    try:
+        import uvicorn
+        app = create_app(max_batch_size=args.max_batch, max_latency_ms=args.max_latency_ms,
+                         database_path=args.database, metrics=args.profile, scoring=args.scoring)
+    except ImportError:
+        print("❌ uvicorn non installé : pip install fastapi uvicorn")
+        sys.exit(1)
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        sys.exit(1)
+    
+    uvicorn.run(app, host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
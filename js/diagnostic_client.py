@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Client léger BotIA : transmet une requête au serveur lancé par
+`python js/diagnostic_engine.py --serve` et affiche sa réponse.
+
+N'importe que la bibliothèque standard pour démarrer en quelques millisecondes.
+
+Usage: python js/diagnostic_client.py "voyant moteur allumé" [--top 5] [--debug]
+"""
+
+import json
+import os
+import socket
+import sys
+import argparse
+import tempfile
+
+# Même valeur par défaut que DEFAULT_SOCKET_PATH dans diagnostic_engine.py
+DEFAULT_SOCKET_PATH = os.environ.get('BOTIA_SOCKET') or os.path.join(tempfile.gettempdir(), 'botia-diagnostic.sock')
+
+def request_diagnosis(query, top_n=3, socket_path=None, with_result=False, timeout=30.0):
+    """Envoie une requête au serveur et retourne sa réponse JSON décodée"""
+    request = {'query': query, 'top': top_n}
+    if with_result:
+        request['result'] = True
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(socket_path or DEFAULT_SOCKET_PATH)
+        client.sendall(json.dumps(request, ensure_ascii=False).encode('utf-8') + b"\n")
+        client.shutdown(socket.SHUT_WR)
+        
+        chunks = []
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    
+    return json.loads(b"".join(chunks).decode('utf-8'))
+
+def main():
+    """Client en ligne de commande"""
+    
+    parser = argparse.ArgumentParser(description='Client du serveur BotIA (diagnostic_engine.py --serve)')
+    parser.add_argument('query', help='Description du problème automobile')
+    parser.add_argument('--top', '-t', type=int, default=3, help='Nombre de résultats (défaut: 3)')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Socket du serveur (défaut: $BOTIA_SOCKET)')
+    parser.add_argument('--debug', action='store_true', help='Afficher aussi le résultat JSON complet')
+    args = parser.parse_args()
+    
+    try:
+        reply = request_diagnosis(args.query, args.top, args.socket, with_result=args.debug)
+    except OSError as e:
+        print(f"❌ Serveur BotIA indisponible sur {args.socket} ({e})", file=sys.stderr)
+        print("💡 Lancez-le avec: python js/diagnostic_engine.py --serve", file=sys.stderr)
+        sys.exit(2)
+    
+    if 'error' in reply:
+        print(reply['error'], file=sys.stderr)
+        sys.exit(1)
+    
+    print(reply['response'])
+    if args.debug:
+        print("\n🔧 DEBUG - Détails techniques:")
+        print(json.dumps(reply['result'], indent=2, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
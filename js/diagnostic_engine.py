@@ -9,308 +9,3951 @@ Usage:
 """
 
 import json
+import array
+import copy
+import re
+import mmap
+import multiprocessing
 import os
+import struct
 import sys
+import time
+import signal
+import socket
+import socketserver
+import tempfile
 import argparse
+import atexit
+import heapq
+import threading
 import unicodedata
+import uuid
+from bisect import bisect_left
+from collections import ChainMap, Counter, OrderedDict, deque
+from collections.abc import Mapping, MutableMapping
+from datetime import date
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import islice
 from difflib import SequenceMatcher
 from pathlib import Path
 
+try:
+    import numpy as np
+except ImportError:  # numpy est optionnel : diagnose_many retombe sur diagnose
+    np = None
+
 # Configuration
 URGENCY_SCORE = {"critique": 9, "elevee": 7, "moyenne": 4, "faible": 1}
 URGENCY_ICONS = {"critique": "🚨", "elevee": "⚠️", "moyenne": "🔧", "faible": "ℹ️"}
+RELEVANCE_THRESHOLD = 0.1  # Score minimum pour qu'un diagnostic soit retenu
+SCORING_WEIGHTS = {"exact": 0.4, "partial": 0.2, "overlap": 0.2, "urgency": 0.1, "fuzzy": 0.1}  # Score composite
+AMBIGUITY_DELTA = 0.15  # Écart maximal entre les deux meilleurs scores pour demander une clarification
+AMBIGUITY_MIN_SCORE = 0.4  # Score minimal du meilleur diagnostic pour demander une clarification
+FUZZY_MODES = ("fast", "reference")
+FUZZY_KEYWORD_THRESHOLD = 0.6  # Similarité minimale pour retenir un mot-clé par le fuzzy
+FUZZY_CANDIDATE_LIMIT = 256  # Candidats sans token commun (urgence et fuzzy seuls) par requête ; 0 = tous
+FUZZY_NGRAM_SIZE = 3  # Taille des n-grammes de caractères qui classent ces candidats au-delà du plafond
+SESSION_MAX_TURNS = 5  # Messages d'une conversation cumulés pour le raffinement (les plus récents)
+SUGGEST_LIMIT = 8  # Suggestions d'autocomplétion par défaut (mots-clés et diagnostics)
+ANYTIME_CHECK_INTERVAL = 64  # Candidats entre deux lectures de l'horloge (critères lexicaux de diagnose_anytime)
+SPELLING_MIN_LENGTH = 4  # Tokens plus courts jamais corrigés (articles, prépositions)
+SPELLING_CACHE_SIZE = 65536  # Corrections de tokens gardées en mémoire (vidé une fois plein)
+SPELLING_MIN_SIMILARITY = 0.75  # Similarité minimale (sans lettres doublées) entre un token et sa correction
+# Mots courants des messages (normalisés) qui ne sont pas des fautes de frappe des mots-clés
+SPELLING_COMMON_WORDS = frozenset("""
+    avant arriere gauche droite droit haut dessous dessus cote interieur exterieur milieu
+    roule rouler roulent roulant tourne tourner tournant freine freiner freinant accelere accelerer
+    demarre demarrer demarrage cale caler calee claque claquer claquent vibre vibrer vibrent
+    grince grincer grincent siffle siffler sifflent fume fumer fuit fuir allume allumer allumee
+    eteint eteindre marche marcher arrete arreter bloque bloquer coince coincer passe passer
+    change changer charge charger chauffe chauffer sent sentir entend entendre vois voir
+    depuis quand pendant toujours souvent parfois jamais encore apres matin soir nuit hier
+    froid chaud chaude vite lent lente fort forte petit grand gros bizarre etrange
+    voiture vehicule auto bagnole avec dans pour sans sous mais plus moins tres trop aussi
+    comme quoi quel quelle cette leur leurs notre votre elle elles nous vous
+""".split())
+DELTA_COMPACT_EVERY = 1000  # Modifications du journal avant compaction automatique dans la base JSON
+INDEX_OVERLAY_LIMIT = 64  # Diagnostics modifiés gardés en overlay des index de diagnose_many et suggest
+OUTPUT_FORMATS = ("text", "json", "ndjson")
+URGENT_SOLUTION_WORDS = ('arrêt', 'immédiat', 'urgence')  # Solutions signalées 🚨 dans format_response
+RESULT_KEYS = ('id', 'titre', 'score', 'urgence', 'urgence_score', 'matched_keyword', 'causes', 'solutions',
+               'cout_estime', 'contributeur', 'details')  # Clés d'un résultat de top_matches, dans l'ordre
+DETAIL_KEYS = ('score', 'matched_keyword', 'exact_match', 'partial_matches', 'token_overlap',
+               'fuzzy')  # Clés de 'details' d'un résultat, dans l'ordre
+# Socket du mode --serve (même valeur par défaut que js/diagnostic_client.py)
+DEFAULT_SOCKET_PATH = os.environ.get('BOTIA_SOCKET') or os.path.join(tempfile.gettempdir(), 'botia-diagnostic.sock')
+# Bornes (secondes) des histogrammes de durée par étape de --profile / StageMetrics
+METRICS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+METRICS_STAGES = ("normalize", "spelling", "tokens", "exact", "candidates", "lexical", "fuzzy", "top_k", "anytime",
+                  "refine", "ranking", "batch", "format")
+SNAPSHOT_MAGIC = b"BOTIASNP"
+SNAPSHOT_FORMAT = 3  # À incrémenter à chaque changement des structures précompilées
+SNAPSHOT_INDEX_FIELDS = ('token_index', 'length_index', 'always_candidates', 'max_token_length',
+                         'exact_index', 'automaton')
+
+def keyword_b2j(keyword):
+    """Table caractère -> positions de SequenceMatcher pour b=keyword (calculée une fois)"""
+    return SequenceMatcher(None, '', keyword).b2j
+
+def sequence_ratio(a, b, b2j):
+    """
+    Équivalent exact de SequenceMatcher(None, a, b).ratio() qui réutilise la
+    table b2j précalculée de b au lieu de la reconstruire à chaque appel.
+    Reprend l'algorithme de difflib (sans fonction junk) bloc par bloc.
+    """
+    la, lb = len(a), len(b)
+    if not la + lb:
+        return 1.0
+    
+    matches = 0
+    nothing = []
+    queue = [(0, la, 0, lb)]
+    while queue:
+        alo, ahi, blo, bhi = queue.pop()
+        
+        # Plus long bloc commun dans a[alo:ahi] et b[blo:bhi]
+        besti, bestj, bestsize = alo, blo, 0
+        j2len = {}
+        for i in range(alo, ahi):
+            j2lenget = j2len.get
+            newj2len = {}
+            for j in b2j.get(a[i], nothing):
+                if j < blo:
+                    continue
+                if j >= bhi:
+                    break
+                k = newj2len[j] = j2lenget(j - 1, 0) + 1
+                if k > bestsize:
+                    besti, bestj, bestsize = i - k + 1, j - k + 1, k
+            j2len = newj2len
+        
+        # Extension sur les caractères "populaires" absents de b2j
+        while besti > alo and bestj > blo and a[besti - 1] == b[bestj - 1]:
+            besti, bestj, bestsize = besti - 1, bestj - 1, bestsize + 1
+        while besti + bestsize < ahi and bestj + bestsize < bhi and a[besti + bestsize] == b[bestj + bestsize]:
+            bestsize += 1
+        
+        if bestsize:
+            matches += bestsize
+            if alo < besti and blo < bestj:
+                queue.append((alo, besti, blo, bestj))
+            if besti + bestsize < ahi and bestj + bestsize < bhi:
+                queue.append((besti + bestsize, ahi, bestj + bestsize, bhi))
+    
+    return 2.0 * matches / (la + lb)
+
+def length_bound(input_length, kw_length):
+    """Borne supérieure de ratio() connaissant seulement les longueurs"""
+    total = input_length + kw_length
+    return 2 * min(input_length, kw_length) / total if total else 1.0
+
+def char_bound(input_counts, input_length, kw_counts, kw_length):
+    """Borne supérieure de ratio() par les caractères communs (comme quick_ratio)"""
+    total = input_length + kw_length
+    if not total:
+        return 1.0
+    common = 0
+    for ch, count in kw_counts.items():
+        available = input_counts.get(ch)
+        if available:
+            common += count if count < available else available
+    return 2 * common / total
+
+def lexical_criteria(query, record):
+    """
+    Critères lexicaux d'un diagnostic : (index du mot-clé exact ou None,
+    correspondances partielles, index du premier mot-clé partiel, overlap de tokens).
+    Comme dans compute_match_score, seuls les mots-clés précédant la
+    correspondance exacte comptent pour les autres critères.
+    """
+    input_tokens = query['tokens']
+    present = query['present']
+    exact_hits = query['exact']
+    
+    exact_index = None
+    token_overlap = 0
+    partial_matches = 0
+    first_partial = None
+    
+    for i, (kw_norm, kw_tokens) in enumerate(zip(record.keywords_norm, record.keyword_tokens)):
+        # 1. Correspondance exacte (détectée par l'automate en un seul passage)
+        if not kw_norm or kw_norm in exact_hits:
+            exact_index = i
+            break
+        
+        # 2. Correspondance partielle (un token du keyword est présent dans l'input)
+        if not kw_tokens.isdisjoint(present):
+            partial_matches += 1
+            if first_partial is None:
+                first_partial = i
+        
+        # 3. Overlap de tokens
+        intersection = input_tokens.intersection(kw_tokens)
+        union = input_tokens.union(kw_tokens)
+        
+        if union:
+            overlap_ratio = len(intersection) / len(union)
+            token_overlap = max(token_overlap, overlap_ratio)
+    
+    return exact_index, partial_matches, first_partial, token_overlap
+
+def char_ngrams(text, size=FUZZY_NGRAM_SIZE):
+    """N-grammes de caractères distincts d'un texte normalisé (le texte lui-même s'il est plus court)"""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+def normalize_text(text):
+    """Normalise le texte (supprime accents, met en minuscules)"""
+    text = text.lower()
+    text = unicodedata.normalize('NFD', text)
+    text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+    return text.strip()
+
+class ScoringConfig:
+    """
+    Pondération du score composite (exact, partiel, overlap, urgence, fuzzy), seuil
+    de pertinence et détection d'ambiguïté. Les valeurs par défaut sont celles du
+    scoring historique ; scripts/tune_weights.py en évalue d'autres et enregistre
+    la meilleure configuration au format JSON lu par load.
+    """
+    
+    __slots__ = tuple(SCORING_WEIGHTS) + ('threshold', 'ambiguity_delta', 'ambiguity_min_score')
+    
+    def __init__(self, weights=None, threshold=RELEVANCE_THRESHOLD, ambiguity_delta=AMBIGUITY_DELTA,
+                 ambiguity_min_score=AMBIGUITY_MIN_SCORE):
+        weights = dict(SCORING_WEIGHTS, **(weights or {}))
+        unknown = set(weights) - set(SCORING_WEIGHTS)
+        if unknown:
+            raise ValueError(f"❌ Critères de score inconnus: {', '.join(sorted(unknown))} "
+                             f"(attendu: {', '.join(SCORING_WEIGHTS)})")
+        for name, weight in weights.items():
+            # Les bornes de find_candidates et score_upper_bound supposent des poids positifs
+            if weight < 0:
+                raise ValueError(f"❌ Poids négatif pour le critère {name}: {weight}")
+            setattr(self, name, float(weight))
+        self.threshold = float(threshold)
+        self.ambiguity_delta = float(ambiguity_delta)
+        self.ambiguity_min_score = float(ambiguity_min_score)
+    
+    @classmethod
+    def load(cls, path):
+        """Configuration enregistrée par scripts/tune_weights.py (--save)"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            raise Exception(f"❌ Configuration de score non trouvée: {path}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"❌ Erreur de format JSON: {e}")
+        return cls.coerce(config.get('scoring', config))
+    
+    @classmethod
+    def coerce(cls, value):
+        """ScoringConfig depuis None (historique), un dictionnaire ou un chemin de fichier JSON"""
+        if value is None:
+            return cls()
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, (str, Path)):
+            return cls.load(value)
+        value = dict(value)
+        return cls(value.pop('weights', None), **value)
+    
+    def weights(self):
+        """Poids dans l'ordre de SCORING_WEIGHTS"""
+        return tuple(getattr(self, name) for name in SCORING_WEIGHTS)
+    
+    def as_dict(self):
+        return {
+            'weights': dict(zip(SCORING_WEIGHTS, self.weights())),
+            'threshold': self.threshold,
+            'ambiguity_delta': self.ambiguity_delta,
+            'ambiguity_min_score': self.ambiguity_min_score
+        }
+    
+    def clarification(self, first_title, first_score, second_title, second_score):
+        """ambiguity_clarification avec l'écart et le score minimal de cette configuration"""
+        return ambiguity_clarification(first_title, first_score, second_title, second_score,
+                                       self.ambiguity_delta, self.ambiguity_min_score)
+
+def ambiguity_clarification(first_title, first_score, second_title, second_score,
+                            delta=AMBIGUITY_DELTA, min_score=AMBIGUITY_MIN_SCORE):
+    """Question de clarification si les deux meilleurs diagnostics sont trop proches (None sinon)"""
+    delta_score = first_score - second_score
+    if delta_score < delta and first_score > min_score:
+        return (
+            f"🤔 Symptômes ambigus entre '{first_title}' et '{second_title}'. "
+            f"Pouvez-vous préciser : s'agit-il plutôt de {first_title.lower()} "
+            f"ou de {second_title.lower()} ?"
+        )
+    return None
+
+DEFAULT_SCORING = ScoringConfig()
+
+class AhoCorasickMatcher:
+    """
+    Automate de Aho-Corasick : détecte en un seul passage linéaire sur le texte
+    toutes les occurrences d'un ensemble de mots-clés normalisés
+    """
+    
+    def __init__(self, patterns=()):
+        # Représentation compacte : une seule table d'arêtes indexée par
+        # (nœud << 21) | code du caractère et des arrays d'entiers par nœud
+        self.edges = {}
+        self.fail = array.array('I', [0])
+        self.terminal = array.array('I', [0])  # nœud -> 1 + identifiant du motif qui s'y termine (0 : aucun)
+        self.output_link = array.array('I', [0])  # plus proche suffixe terminal
+        self.patterns = []
+        self.pattern_ids = {}
+        self.parent = array.array('I', [0])  # tables de construction, libérées par build
+        self.chars = array.array('I', [0])
+        self.depth = array.array('I', [0])
+        for pattern in patterns:
+            self.add(pattern)
+        self.build()
+    
+    @classmethod
+    def restore(cls, edges, fail, terminal, output_link, patterns):
+        """Automate déjà construit à partir de ses tables (snapshot compilé, voir FlatEdges)"""
+        matcher = cls.__new__(cls)
+        matcher.edges = edges
+        matcher.fail = fail
+        matcher.terminal = terminal
+        matcher.output_link = output_link
+        matcher.patterns = patterns
+        matcher.pattern_ids = {pattern: index for index, pattern in enumerate(patterns)}
+        matcher.parent = matcher.chars = matcher.depth = None
+        return matcher
+    
+    def add(self, pattern):
+        """Ajoute un motif non vide à l'automate (à appeler avant build)"""
+        if not pattern or pattern in self.pattern_ids:
+            return
+        
+        node = 0
+        for ch in pattern:
+            key = (node << 21) | ord(ch)
+            next_node = self.edges.get(key)
+            if next_node is None:
+                next_node = len(self.fail)
+                self.edges[key] = next_node
+                self.fail.append(0)
+                self.terminal.append(0)
+                self.output_link.append(0)
+                self.parent.append(node)
+                self.chars.append(ord(ch))
+                self.depth.append(self.depth[node] + 1)
+            node = next_node
+        
+        self.pattern_ids[pattern] = len(self.patterns)
+        self.terminal[node] = len(self.patterns) + 1
+        self.patterns.append(pattern)
+    
+    def build(self):
+        """Calcule les liens d'échec et de sortie, nœuds parcourus par profondeur croissante"""
+        edges = self.edges
+        fail = self.fail
+        for node in sorted(range(1, len(fail)), key=self.depth.__getitem__):
+            parent = self.parent[node]
+            if parent:
+                code = self.chars[node]
+                state = fail[parent]
+                while state and (state << 21) | code not in edges:
+                    state = fail[state]
+                fallback = edges.get((state << 21) | code, 0)
+                fail[node] = fallback if fallback != node else 0
+            suffix = fail[node]
+            self.output_link[node] = suffix if self.terminal[suffix] else self.output_link[suffix]
+        
+        self.parent = self.chars = self.depth = None
+    
+    def find_all(self, text):
+        """Retourne l'ensemble des motifs présents dans le texte"""
+        edges = self.edges
+        fail = self.fail
+        terminal = self.terminal
+        output_link = self.output_link
+        found = set()
+        node = 0
+        
+        for ch in text:
+            code = ord(ch)
+            child = edges.get((node << 21) | code)
+            while child is None and node:
+                node = fail[node]
+                child = edges.get((node << 21) | code)
+            node = child or 0
+            
+            state = node if terminal[node] else output_link[node]
+            while state:
+                found.add(terminal[state])
+                state = output_link[state]
+        
+        return {self.patterns[pattern_id - 1] for pattern_id in found}
+
+class DiagnosisCache:
+    """
+    Cache LRU borné (avec expiration optionnelle) des résultats de diagnose,
+    indexé sur l'input normalisé et top_n. Il est vidé dès que la signature
+    de la base (version, lastUpdate, rechargement) change.
+    """
+    
+    def __init__(self, max_size=1024, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.signature = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+    
+    def get(self, key):
+        """Retourne le résultat en cache ou None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value):
+        """Ajoute un résultat, en évinçant le moins récemment utilisé si le cache est plein"""
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+    
+    def invalidate(self, signature):
+        """Vide le cache si la signature de la base a changé"""
+        with self.lock:
+            if signature != self.signature:
+                if self.entries:
+                    self.invalidations += 1
+                self.entries.clear()
+                self.signature = signature
+    
+    def stats(self):
+        """Compteurs du cache"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations
+            }
+
+class RefinementSession:
+    """
+    Conversation en cours : messages cumulés, base utilisée et diagnostics
+    retenus au tour précédent avec leur score (positions en array)
+    """
+    
+    __slots__ = ('turns', 'generation', 'positions', 'scores', 'used_at')
+    
+    def __init__(self, turns, generation, positions, scores):
+        self.turns = turns
+        self.generation = generation
+        self.positions = array.array('I', positions)
+        self.scores = array.array('d', scores)
+        self.used_at = time.monotonic()
+
+class SessionStore:
+    """
+    Sessions de raffinement bornées : au plus max_sessions conversations
+    (la moins récemment utilisée est évincée) et expiration après ttl
+    secondes d'inactivité.
+    """
+    
+    def __init__(self, max_sessions=1024, ttl=900.0):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sessions = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, session_id):
+        """Retourne la session active ou None (session inconnue ou expirée)"""
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            if self.ttl is not None and time.monotonic() - session.used_at > self.ttl:
+                del self.sessions[session_id]
+                self.expirations += 1
+                return None
+            self.sessions.move_to_end(session_id)
+            return session
+    
+    def put(self, session_id, session):
+        """Enregistre l'état d'une session, en évinçant la moins récemment utilisée si besoin"""
+        with self.lock:
+            self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            while len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evictions += 1
+    
+    def discard(self, session_id):
+        """Termine une session"""
+        with self.lock:
+            self.sessions.pop(session_id, None)
+    
+    def purge(self):
+        """Supprime les sessions expirées ; retourne leur nombre"""
+        if self.ttl is None:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            expired = [session_id for session_id, session in self.sessions.items() if now - session.used_at > self.ttl]
+            for session_id in expired:
+                del self.sessions[session_id]
+            self.expirations += len(expired)
+            return len(expired)
+    
+    def stats(self):
+        """Compteurs des sessions"""
+        with self.lock:
+            return {
+                'size': len(self.sessions),
+                'max_sessions': self.max_sessions,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+class Stopwatch:
+    """Chronomètre d'une requête : chaque lap() enregistre la durée écoulée depuis le précédent"""
+    
+    __slots__ = ('metrics', 'last')
+    
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self.last = time.perf_counter()
+    
+    def lap(self, stage):
+        now = time.perf_counter()
+        self.metrics.observe(stage, now - self.last)
+        self.last = now
+
+class StageMetrics:
+    """
+    Instrumentation de diagnose : histogramme de durée par étape et compteurs.
+    Étapes : normalize, tokens (sous-chaînes indexées), exact (automate),
+    candidates, lexical (exact/partiel/overlap par mot-clé), fuzzy (similarité et
+    score final), top_k, anytime, refine (scoring d'un tour de conversation),
+    ranking (tri, clarification), batch (diagnose_many), format.
+    """
+    
+    COUNTERS = ("queries", "cache_hits", "candidates_scored", "results_above_threshold", "clarifications")
+    
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        """Remet à zéro histogrammes et compteurs"""
+        with self.lock:
+            self.histograms = {}
+            self.counters = dict.fromkeys(self.COUNTERS, 0)
+    
+    def stopwatch(self):
+        """Nouveau chronomètre pour une requête"""
+        return Stopwatch(self)
+    
+    def observe(self, stage, seconds):
+        """Ajoute une durée à l'histogramme d'une étape"""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0,
+                                                      'count': 0, 'max': 0.0}
+            histogram['counts'][bisect_left(self.buckets, seconds)] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+            histogram['max'] = max(histogram['max'], seconds)
+    
+    def increment(self, counter, value=1):
+        """Incrémente un compteur"""
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+    
+    def record_diagnosis(self, diagnosis, candidates):
+        """Compteurs d'une requête diagnostiquée (hors cache)"""
+        with self.lock:
+            self.counters['queries'] += 1
+            self.counters['candidates_scored'] += candidates
+            self.counters['results_above_threshold'] += diagnosis['total_matches']
+            self.counters['clarifications'] += diagnosis['clarification'] is not None
+    
+    def quantile(self, stage, fraction):
+        """Quantile approché (borne supérieure du bucket) de la durée d'une étape"""
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if not histogram:
+                return 0.0
+            target = fraction * histogram['count']
+            seen = 0
+            for bound, count in zip(self.buckets + (histogram['max'],), histogram['counts']):
+                seen += count
+                if seen >= target:
+                    return min(bound, histogram['max'])
+            return histogram['max']
+    
+    def snapshot(self):
+        """Copie des mesures : {'stages': {étape: {...}}, 'counters': {...}}"""
+        with self.lock:
+            names = list(self.histograms)
+        stages = {}
+        for stage in sorted(names, key=lambda name: (METRICS_STAGES + (name,)).index(name)):
+            with self.lock:
+                histogram = dict(self.histograms[stage])
+            stages[stage] = {
+                'count': histogram['count'],
+                'total_s': histogram['sum'],
+                'mean_ms': histogram['sum'] / histogram['count'] * 1000 if histogram['count'] else 0.0,
+                'p50_ms': self.quantile(stage, 0.5) * 1000,
+                'p99_ms': self.quantile(stage, 0.99) * 1000,
+                'max_ms': histogram['max'] * 1000
+            }
+        with self.lock:
+            counters = dict(self.counters)
+        return {'stages': stages, 'counters': counters}
+    
+    def report(self):
+        """Tableau lisible des mesures (--profile)"""
+        data = self.snapshot()
+        total = sum(stage['total_s'] for stage in data['stages'].values()) or 1.0
+        lines = [f"{'Étape':<12} {'Appels':>7} {'Moy.':>10} {'p50≤':>10} {'p99≤':>10} {'Max':>10} {'Part':>6}"]
+        for name, stage in data['stages'].items():
+            lines.append(f"{name:<12} {stage['count']:>7} {stage['mean_ms']:>8.3f}ms {stage['p50_ms']:>8.3f}ms "
+                         f"{stage['p99_ms']:>8.3f}ms {stage['max_ms']:>8.3f}ms {stage['total_s'] / total:>6.1%}")
+        lines.append("")
+        lines.extend(f"{name}: {value}" for name, value in data['counters'].items())
+        return "\n".join(lines)
+    
+    def prometheus_text(self, prefix="botia"):
+        """Export au format texte Prometheus (histogramme par étape + compteurs)"""
+        lines = [f"# HELP {prefix}_stage_seconds Durée des étapes de diagnose",
+                 f"# TYPE {prefix}_stage_seconds histogram"]
+        with self.lock:
+            histograms = {stage: dict(h, counts=list(h['counts'])) for stage, h in self.histograms.items()}
+            counters = dict(self.counters)
+        for stage, histogram in histograms.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, histogram['counts']):
+                cumulative += count
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.9f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        for name, value in counters.items():
+            lines.append(f"# TYPE {prefix}_{name}_total counter")
+            lines.append(f"{prefix}_{name}_total {value}")
+        return "\n".join(lines) + "\n"
+
+def edit_distance(a, b, limit):
+    """
+    Distance de Damerau-Levenshtein restreinte (transposition de deux lettres
+    voisines comptée 1) ; retourne limit + 1 dès qu'elle dépasse limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+def spelling_key(word):
+    """Forme d'un token comparée par le correcteur : lettres doublées réduites ("batterie" -> "baterie")"""
+    return re.sub(r'(.)\1+', r'\1', word)
+
+def spelling_lexicon(data):
+    """Mots normalisés des titres, causes et solutions d'une base : mots connus du correcteur"""
+    words = set()
+    for diagnostic in data.get('diagnostics', {}).values():
+        for text in [diagnostic.get('titre', '')] + list(diagnostic.get('causes', [])) + list(diagnostic.get('solutions', [])):
+            words.update(normalize_text(text).split())
+    return words
+
+class SpellingCorrector:
+    """
+    Correction des tokens de requête par dictionnaire de suppressions symétriques
+    (SymSpell) : chaque mot cible (tokens des mots-clés et lexique) est indexé
+    sous toutes ses variantes à max_distance lettres supprimées (sur les
+    prefix_length premières lettres de sa forme sans lettres doublées, voir
+    spelling_key), un token inconnu est corrigé en cherchant ses propres
+    variantes, puis en vérifiant la distance d'édition et la similarité des
+    quelques mots trouvés. Les tokens courts ne sont pas corrigés et ceux de
+    5 lettres au plus seulement d'une substitution ou transposition
+    ("frain" -> "frein", "batery" -> "batterie").
+    
+    Un token connu n'est jamais corrigé : token de mot-clé, mot du lexique
+    (titres, causes et solutions de la base, voir spelling_lexicon) ou mot
+    courant de SPELLING_COMMON_WORDS ("roule" n'est pas un "rouge" mal écrit).
+    À distance égale, les tokens de mots-clés passent avant les mots du lexique.
+    Les résultats sont gardés en cache, les mots courants hors vocabulaire
+    revenant à chaque requête.
+    
+    Les modifications de la base (with_tokens) ne touchent pas ces tables :
+    overlay donne la fréquence à jour des tokens concernés (0 : disparu) et
+    overlay_deletes les variantes des nouveaux tokens. Le lexique est celui du
+    chargement jusqu'à la prochaine reconstruction.
+    """
+    
+    def __init__(self, token_index, max_distance=2, prefix_length=7, min_length=SPELLING_MIN_LENGTH, lexicon=()):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.min_length = min_length
+        self.vocabulary = {token: len(positions) for token, positions in token_index.items()}
+        self.lexicon = frozenset(lexicon) | SPELLING_COMMON_WORDS
+        self.overlay = {}
+        self.overlay_deletes = {}
+        self.cache = {}
+        
+        # Variante -> mot (ou liste de mots si plusieurs partagent la variante)
+        self.deletes = {}
+        for token in self.vocabulary.keys() | self.lexicon:
+            self.index_token(token)
+    
+    def index_token(self, token):
+        if len(token) < self.min_length - self.max_distance:
+            return
+        for variant in self.variants(spelling_key(token)[:self.prefix_length]):
+            existing = self.deletes.get(variant)
+            if existing is None:
+                self.deletes[variant] = token
+            elif isinstance(existing, str):
+                self.deletes[variant] = [existing, token]
+            else:
+                existing.append(token)
+    
+    def with_tokens(self, token_index, tokens):
+        """
+        Nouveau correcteur où la fréquence des tokens d'un diagnostic ajouté,
+        modifié ou supprimé suit token_index (voir DatabaseSnapshot.with_change) ;
+        ce correcteur reste inchangé, son cache n'est pas repris
+        """
+        corrector = copy.copy(self)
+        corrector.overlay = dict(self.overlay)
+        corrector.overlay_deletes = dict(self.overlay_deletes)
+        corrector.cache = {}
+        for token in tokens:
+            if token not in self.vocabulary and token not in self.lexicon and token not in self.overlay and \
+                    len(token) >= self.min_length - self.max_distance:
+                for variant in self.variants(spelling_key(token)[:self.prefix_length]):
+                    corrector.overlay_deletes[variant] = corrector.overlay_deletes.get(variant, ()) + (token,)
+            corrector.overlay[token] = len(token_index.get(token, ()))
+        return corrector
+    
+    def frequency(self, token):
+        """Nombre de diagnostics contenant le token (0 s'il n'est pas dans le vocabulaire)"""
+        count = self.overlay.get(token)
+        return self.vocabulary.get(token, 0) if count is None else count
+    
+    def known(self, token):
+        """Token de mot-clé ou mot du lexique (jamais corrigé, cible possible d'une correction)"""
+        return token in self.lexicon or self.frequency(token) > 0
+    
+    def variants(self, word, distance=None):
+        """word et toutes ses variantes à distance lettres supprimées au plus"""
+        distance = self.max_distance if distance is None else distance
+        found = {word}
+        frontier = {word}
+        for _ in range(distance):
+            frontier = {candidate[:i] + candidate[i + 1:] for candidate in frontier for i in range(len(candidate))}
+            frontier -= found
+            found |= frontier
+        return found
+    
+    def lookup(self, token):
+        """
+        Mot connu le plus proche (distance, tokens de mots-clés d'abord, fréquence,
+        ordre alphabétique) ou None ; distance et similarité (au moins
+        SPELLING_MIN_SIMILARITY) sont mesurées sur les formes sans lettres doublées
+        """
+        short = len(token) <= 5
+        limit = min(self.max_distance, 1) if short else self.max_distance
+        key = spelling_key(token)
+        best = None
+        seen = set()
+        for variant in self.variants(key[:self.prefix_length], limit):
+            candidates = self.deletes.get(variant, ())
+            if isinstance(candidates, str):
+                candidates = (candidates,)
+            if self.overlay_deletes:
+                candidates = tuple(candidates) + self.overlay_deletes.get(variant, ())
+            for candidate in candidates:
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if short and len(candidate) != len(token):
+                    continue
+                count = self.frequency(candidate)
+                if not count and candidate not in self.lexicon:
+                    continue
+                candidate_key = spelling_key(candidate)
+                distance = edit_distance(key, candidate_key, limit)
+                if distance > limit or \
+                        sequence_ratio(key, candidate_key, keyword_b2j(candidate_key)) < SPELLING_MIN_SIMILARITY:
+                    continue
+                rank = (distance, not count, -count, candidate)
+                if best is None or rank < best:
+                    best = rank
+        return best[-1] if best is not None else None
+    
+    def correct(self, text):
+        """Texte normalisé avec ses tokens inconnus corrigés, et {token: correction}"""
+        corrections = {}
+        words = text.split(' ')
+        for i, word in enumerate(words):
+            if len(word) < self.min_length or self.known(word):
+                continue
+            correction = self.cache.get(word, False)
+            if correction is False:
+                if len(self.cache) >= SPELLING_CACHE_SIZE:
+                    self.cache.clear()
+                correction = self.cache[word] = self.lookup(word)
+            if correction is not None:
+                corrections[word] = correction
+                words[i] = correction
+        return (' '.join(words) if corrections else text), corrections
+
+class KeywordTable:
+    """
+    Mots-clés normalisés distincts de la base, identifiés par un entier : texte
+    interné et tokens partagés par tous les diagnostics qui les utilisent ;
+    b2j (SequenceMatcher) et compte des caractères calculés à la première utilisation
+    """
+    
+    __slots__ = ('ids', 'norms', 'tokens', 'b2j_cache', 'chars_cache')
+    
+    def __init__(self, norms=(), tokens=()):
+        self.norms = list(norms)
+        self.tokens = list(tokens)
+        self.ids = {kw_norm: kid for kid, kw_norm in enumerate(self.norms)}
+        self.b2j_cache = [None] * len(self.norms)
+        self.chars_cache = [None] * len(self.norms)
+    
+    def add(self, kw_norm):
+        """Identifiant du mot-clé normalisé (ajouté s'il est nouveau)"""
+        kid = self.ids.get(kw_norm)
+        if kid is None:
+            kw_norm = sys.intern(kw_norm)
+            kid = self.ids[kw_norm] = len(self.norms)
+            self.norms.append(kw_norm)
+            self.tokens.append(frozenset(sys.intern(token) for token in kw_norm.split()))
+            self.b2j_cache.append(None)
+            self.chars_cache.append(None)
+        return kid
+    
+    def b2j(self, kid):
+        b2j = self.b2j_cache[kid]
+        if b2j is None:
+            b2j = self.b2j_cache[kid] = keyword_b2j(self.norms[kid])
+        return b2j
+    
+    def chars(self, kid):
+        chars = self.chars_cache[kid]
+        if chars is None:
+            chars = self.chars_cache[kid] = Counter(self.norms[kid])
+        return chars
+
+class DiagnosticRecord:
+    """
+    Diagnostic précompilé : identifiant entier (position), mots-clés normalisés et
+    tokens partagés via la KeywordTable, longueurs en array, données JSON d'origine
+    """
+    
+    __slots__ = ('id', 'position', 'keywords', 'keywords_norm', 'keyword_tokens', 'keyword_ids',
+                 'length_order', 'sorted_lengths', 'urgency_score', 'confidence', 'fragments', 'data', 'table')
+    
+    def __init__(self, diag_id, diagnostic, table, position=0):
+        keywords = diagnostic.get('keywords', [])
+        keyword_ids = [table.add(normalize_text(keyword)) for keyword in keywords]
+        keywords_norm = tuple(table.norms[kid] for kid in keyword_ids)
+        length_order = sorted(range(len(keywords_norm)), key=lambda i: len(keywords_norm[i]))
+        
+        self.id = sys.intern(diag_id)
+        self.position = position
+        self.keywords = keywords
+        self.keywords_norm = keywords_norm
+        self.keyword_tokens = tuple(table.tokens[kid] for kid in keyword_ids)
+        self.keyword_ids = array.array('I', keyword_ids)
+        self.length_order = array.array('I', length_order)
+        self.sorted_lengths = array.array('I', [len(keywords_norm[i]) for i in length_order])
+        self.urgency_score = URGENCY_SCORE.get(diagnostic.get('urgence', 'faible'), 1)
+        self.confidence = 0.7 if diagnostic.get('contributeur') == 'système' else 0.85
+        self.fragments = None
+        self.data = diagnostic
+        self.table = table
+    
+    def keyword_b2j(self, i):
+        """b2j SequenceMatcher du i-ème mot-clé"""
+        return self.table.b2j(self.keyword_ids[i])
+    
+    def keyword_chars(self, i):
+        """Compte des caractères du i-ème mot-clé"""
+        return self.table.chars(self.keyword_ids[i])
+    
+    def response_fragments(self):
+        """Parties fixes de la réponse (texte et JSON), rendues au premier résultat qui les utilise"""
+        fragments = self.fragments
+        if fragments is None:
+            fragments = self.fragments = ResponseFragments(self.data)
+        return fragments
+    
+    @classmethod
+    def restore(cls, diag_id, position, keywords, keyword_ids, length_order, sorted_lengths,
+                urgency_score, confidence, table, data):
+        """Enregistrement déjà compilé à partir des tables d'un snapshot binaire"""
+        record = cls.__new__(cls)
+        record.id = diag_id
+        record.position = position
+        record.keywords = keywords
+        record.keywords_norm = tuple(table.norms[kid] for kid in keyword_ids)
+        record.keyword_tokens = tuple(table.tokens[kid] for kid in keyword_ids)
+        record.keyword_ids = keyword_ids
+        record.length_order = length_order
+        record.sorted_lengths = sorted_lengths
+        record.urgency_score = urgency_score
+        record.confidence = confidence
+        record.fragments = None
+        record.data = data
+        record.table = table
+        return record
+
+class SuggestState:
+    """
+    État d'une saisie en cours pour suggest : préfixe cherché et intervalle
+    correspondant dans l'index trié. Un caractère de plus ne cherche que dans
+    cet intervalle.
+    """
+    
+    __slots__ = ('generation', 'prefix', 'low', 'high')
+    
+    def __init__(self):
+        self.generation = None
+        self.prefix = None
+        self.low = 0
+        self.high = 0
+
+class SuggestionIndex:
+    """
+    Index trié des mots-clés normalisés pour l'autocomplétion : chaque mot-clé
+    y figure sous sa forme complète et à partir de chacun de ses mots suivants
+    ("voyant moteur" est trouvé par "voy" et par "mot"). Le rang de chaque
+    entrée est précalculé : mot-clé commençant par le préfixe d'abord, puis
+    nombre de diagnostics, urgence maximale, longueur et ordre alphabétique.
+    
+    Les mots-clés des diagnostics modifiés depuis la construction (with_change)
+    sont écartés de l'index trié et cherchés dans un petit index à part
+    (overlay), trié au même ordre.
+    """
+    
+    def __init__(self, snapshot):
+        table = snapshot.keyword_table
+        self.generation = snapshot.generation
+        
+        # Forme affichée (accents d'origine) et diagnostics de chaque mot-clé
+        self.display = {}
+        self.urgency = {}
+        for record in snapshot.records:
+            if record is None:
+                continue
+            for keyword, kid in zip(record.keywords, record.keyword_ids):
+                self.display.setdefault(kid, keyword.strip())
+                self.urgency[kid] = max(self.urgency.get(kid, 0), record.urgency_score)
+        self.counts = {kid: len(snapshot.exact_index.get(table.norms[kid], ())) for kid in self.display}
+        
+        entries = []
+        for kid in self.display:
+            entries.extend(self.entries(kid, table.norms[kid]))
+        entries.sort()
+        
+        order = sorted(range(len(entries)), key=lambda i: (
+            entries[i][2], -self.counts[entries[i][1]], -self.urgency[entries[i][1]],
+            len(table.norms[entries[i][1]]), table.norms[entries[i][1]]))
+        ranks = array.array('I', bytes(4 * len(entries)))
+        for rank, i in enumerate(order):
+            ranks[i] = rank
+        
+        self.keys = [key for key, _, _ in entries]
+        self.ranks = ranks
+        self.by_rank = array.array('I', [entries[i][1] for i in order])
+        self.norms = table.norms
+        self.changes = 0  # diagnostics modifiés depuis la construction
+        self.stale = frozenset()  # mots-clés de ces diagnostics (hors index trié)
+        self.overlay = []  # entrées (clé, mot-clé) des mots-clés stale encore présents, triées
+    
+    @staticmethod
+    def entries(kid, kw_norm):
+        """Entrées (clé, mot-clé, suffixe) d'un mot-clé : forme complète puis chaque mot suivant"""
+        entries = []
+        if not kw_norm:
+            return entries
+        offset = 0
+        for word in kw_norm.split(' '):
+            if word:
+                entries.append((kw_norm[offset:], kid, offset > 0))
+            offset += len(word) + 1
+        return entries
+    
+    def with_change(self, snapshot, kids):
+        """
+        Index de snapshot après la modification d'un diagnostic dont les mots-clés
+        (ancienne et nouvelle version) sont kids : index trié partagé, seuls ces
+        mots-clés sont recalculés dans l'overlay
+        """
+        index = copy.copy(self)
+        index.generation = snapshot.generation
+        index.changes = self.changes + 1
+        index.stale = self.stale | kids
+        index.display, index.counts, index.urgency = (
+            ChainMap(dict(mapping.maps[0]), mapping.maps[1]) if isinstance(mapping, ChainMap) else ChainMap({}, mapping)
+            for mapping in (self.display, self.counts, self.urgency))
+        for kid in kids:
+            positions = snapshot.exact_index.get(snapshot.keyword_table.norms[kid], ())
+            if positions:
+                record = snapshot.records[positions[0]]
+                index.display[kid] = next(keyword.strip() for keyword, record_kid
+                                          in zip(record.keywords, record.keyword_ids) if record_kid == kid)
+                index.counts[kid] = len(positions)
+                index.urgency[kid] = max(snapshot.records[position].urgency_score for position in positions)
+            else:
+                index.counts[kid] = 0
+        index.overlay = sorted((key, kid) for kid in index.stale if index.counts.get(kid)
+                               for key, _, _ in self.entries(kid, self.norms[kid]))
+        return index
+    
+    def prefix_range(self, prefix, low=0, high=None):
+        """Intervalle [low, high) des clés commençant par prefix (recherche dans [low, high))"""
+        high = len(self.keys) if high is None else high
+        low = bisect_left(self.keys, prefix, low, high)
+        return low, bisect_left(self.keys, prefix + "\uffff", low, high)
+    
+    def overlay_keywords(self, prefix):
+        """Mots-clés de l'overlay ayant une clé qui commence par prefix"""
+        low = bisect_left(self.overlay, (prefix,))
+        high = bisect_left(self.overlay, (prefix + "\uffff",), low)
+        return {kid for _, kid in self.overlay[low:high]}
+    
+    def top_keywords(self, low, high, limit, prefix=None):
+        """
+        Identifiants des limit meilleurs mots-clés distincts de l'intervalle, par rang
+        (plus ceux de l'overlay commençant par prefix)
+        """
+        size = limit + len(self.stale)
+        while True:
+            ranks = heapq.nsmallest(size, self.ranks[low:high]) if high - low > size else sorted(self.ranks[low:high])
+            kids = [kid for kid in dict.fromkeys(self.by_rank[rank] for rank in ranks) if kid not in self.stale]
+            if len(kids) >= limit or len(ranks) == high - low:
+                break
+            size *= 2
+        if not self.stale or prefix is None:
+            return kids[:limit]
+        
+        # Fusion avec l'overlay selon le même ordre que les rangs
+        kids = set(kids[:limit]) | self.overlay_keywords(prefix)
+        return sorted(kids, key=lambda kid: (not self.norms[kid].startswith(prefix), -self.counts[kid],
+                                             -self.urgency[kid], len(self.norms[kid]), self.norms[kid]))[:limit]
+
+class DatabaseSnapshot:
+    """
+    État complet et immuable d'une base chargée : données JSON, diagnostics
+    précompilés et index de correspondance. Le moteur remplace son snapshot
+    d'un seul coup lors d'un rechargement, une requête en cours garde donc
+    toujours une vue cohérente (l'ancienne ou la nouvelle base).
+    """
+    
+    def __init__(self, data, generation=0, source_mtime=None, source_size=None):
+        self.data = data
+        self.generation = generation
+        self.source_mtime = source_mtime
+        self.source_size = source_size
+        
+        # Précompilation de chaque diagnostic (mots-clés normalisés, tokens, urgence)
+        self.keyword_table = KeywordTable()
+        self.compiled = {
+            diag_id: self.compile_diagnostic(diag_id, diag_data)
+            for diag_id, diag_data in data.get('diagnostics', {}).items()
+        }
+        self.records = list(self.compiled.values())
+        self.build_candidate_index()
+    
+    @classmethod
+    def restore(cls, data, records, keyword_table, index_state, generation=0, source_mtime=None, source_size=None):
+        """Reconstruit un snapshot à partir de structures déjà compilées (snapshot binaire)"""
+        snapshot = cls.__new__(cls)
+        snapshot.data = data
+        snapshot.generation = generation
+        snapshot.source_mtime = source_mtime
+        snapshot.source_size = source_size
+        snapshot.keyword_table = keyword_table
+        snapshot.records = records
+        snapshot.compiled = {record.id: record for record in records}
+        for field in SNAPSHOT_INDEX_FIELDS:
+            setattr(snapshot, field, index_state[field])
+        snapshot.batch_index = None
+        snapshot.suggestion_index = None
+        snapshot.ngram_index = None
+        snapshot.spelling = None
+        snapshot.pending_patterns = frozenset()
+        snapshot.removed = 0
+        return snapshot
+    
+    def build_candidate_index(self):
+        """
+        Construit l'index inversé utilisé pour présélectionner les candidats.
+        
+        - token_index : token de mot-clé -> positions des diagnostics qui le contiennent
+        - length_index : urgence -> longueur de mot-clé -> positions, pour retrouver
+          les diagnostics qui ne peuvent dépasser le seuil que par la similarité fuzzy
+        - always_candidates : diagnostics avec un mot-clé vide (toujours en correspondance exacte)
+        - automaton : None ; l'automate Aho-Corasick des mots-clés normalisés n'est
+          construit que par write_compiled_snapshot et repris à l'ouverture d'un
+          snapshot compilé. Sans lui, prepare_query cherche les mots-clés exacts par
+          sous-chaîne dans exact_index (find_exact), un peu plus lent par requête
+          mais sans le coût de construction au chargement de grandes bases
+        
+        with_change met ensuite ces index à jour diagnostic par diagnostic, sans
+        reconstruire l'automate (pending_patterns) ; compact les reconstruit.
+        """
+        token_index = {}
+        length_index = {}
+        exact_index = {}
+        self.always_candidates = set()
+        self.max_token_length = 0
+        self.batch_index = None  # construit à la demande par diagnose_many
+        self.suggestion_index = None  # construit à la demande par suggest
+        self.ngram_index = None  # construit à la demande par find_candidates (fuzzy_limit)
+        self.spelling = None  # SpellingCorrector, attaché par le moteur si la correction est activée
+        self.pending_patterns = frozenset()  # mots-clés ajoutés par with_change, absents de l'automate
+        self.removed = 0  # positions libérées par with_change (None dans records)
+        
+        def post(postings, key, position):
+            # Positions croissantes : un doublon ne peut être que le dernier élément
+            positions = postings.setdefault(key, [])
+            if not positions or positions[-1] != position:
+                positions.append(position)
+        
+        for position, record in enumerate(self.records):
+            record.position = position
+            
+            for kw_norm, kw_tokens in zip(record.keywords_norm, record.keyword_tokens):
+                if not kw_norm:
+                    self.always_candidates.add(position)
+                else:
+                    post(exact_index, kw_norm, position)
+                
+                for kw_word in kw_tokens:
+                    post(token_index, kw_word, position)
+                    self.max_token_length = max(self.max_token_length, len(kw_word))
+                
+                post(length_index.setdefault(record.urgency_score, {}), len(kw_norm), position)
+        
+        # Listes de positions stockées en array d'entiers (4 octets par position)
+        self.token_index = {token: array.array('I', positions) for token, positions in token_index.items()}
+        self.exact_index = {kw_norm: array.array('I', positions) for kw_norm, positions in exact_index.items()}
+        self.length_index = {
+            urgency_score: {length: array.array('I', positions) for length, positions in lengths.items()}
+            for urgency_score, lengths in length_index.items()
+        }
+        self.automaton = None  # voir write_compiled_snapshot
+    
+    def compile_diagnostic(self, diag_id, diagnostic):
+        """Construit l'enregistrement précompilé d'un diagnostic (urgence internée)"""
+        if isinstance(diagnostic.get('urgence'), str):
+            diagnostic['urgence'] = sys.intern(diagnostic['urgence'])
+        return DiagnosticRecord(diag_id, diagnostic, self.keyword_table)
+    
+    def with_change(self, diag_id, diagnostic, generation):
+        """
+        Nouveau snapshot où le diagnostic diag_id est ajouté, remplacé, ou supprimé
+        (diagnostic None), sans toucher à ce snapshot ni réindexer la base : seules
+        les listes de positions de ses mots-clés, tokens et longueurs sont recopiées.
+        
+        Un diagnostic remplacé garde sa position (ordre de la base), un ajout prend
+        la suivante et une suppression laisse None à sa place dans records. Les
+        nouveaux mots-clés ne sont pas ajoutés à l'automate : prepare_query les
+        cherche à part (pending_patterns) jusqu'à la reconstruction complète.
+        Les index de diagnose_many et de suggest et le correcteur orthographique
+        sont repris avec le diagnostic en overlay ; au-delà de INDEX_OVERLAY_LIMIT
+        diagnostics modifiés, les index sont reconstruits à leur prochain usage.
+        """
+        snapshot = copy.copy(self)
+        snapshot.generation = generation
+        snapshot.records = list(self.records)
+        snapshot.compiled = dict(self.compiled)
+        snapshot.token_index = self.token_index.copy()
+        snapshot.exact_index = self.exact_index.copy()
+        snapshot.length_index = dict(self.length_index)
+        snapshot.always_candidates = set(self.always_candidates)
+        if self.ngram_index is not None:
+            snapshot.ngram_index = dict(self.ngram_index)
+        diagnostics = dict(self.data.get('diagnostics', {}))
+        snapshot.data = dict(self.data, diagnostics=diagnostics)
+        
+        def update(postings, key, position, add):
+            # Copie triée de la liste de positions ; une clé sans position disparaît
+            positions = array.array('I', postings.get(key, ()))
+            index = bisect_left(positions, position)
+            present = index < len(positions) and positions[index] == position
+            if add and not present:
+                positions.insert(index, position)
+            elif not add and present:
+                del positions[index]
+            if positions:
+                postings[key] = positions
+            else:
+                postings.pop(key, None)
+        
+        def index_record(record, add):
+            lengths = snapshot.length_index.get(record.urgency_score, {}).copy()
+            for kw_norm, kw_tokens in zip(record.keywords_norm, record.keyword_tokens):
+                if not kw_norm and add:
+                    snapshot.always_candidates.add(record.position)
+                elif not kw_norm:
+                    snapshot.always_candidates.discard(record.position)
+                else:
+                    update(snapshot.exact_index, kw_norm, record.position, add)
+                for kw_word in kw_tokens:
+                    update(snapshot.token_index, kw_word, record.position, add)
+                update(lengths, len(kw_norm), record.position, add)
+            snapshot.length_index[record.urgency_score] = lengths
+        
+        old = self.compiled.get(diag_id)
+        if old is not None:
+            index_record(old, add=False)
+        record = None
+        
+        if diagnostic is None:
+            if old is not None:
+                del snapshot.compiled[diag_id]
+                del diagnostics[diag_id]
+                snapshot.records[old.position] = None
+                snapshot.removed += 1
+        else:
+            record = self.compile_diagnostic(diag_id, diagnostic)
+            if old is not None:
+                record.position = old.position
+                snapshot.records[record.position] = record
+            else:
+                record.position = len(snapshot.records)
+                snapshot.records.append(record)
+            snapshot.compiled[diag_id] = record
+            diagnostics[diag_id] = diagnostic
+            index_record(record, add=True)
+            
+            tokens = {kw_word for kw_tokens in record.keyword_tokens for kw_word in kw_tokens}
+            snapshot.max_token_length = max([self.max_token_length] + [len(kw_word) for kw_word in tokens])
+            if self.automaton is not None:
+                new_patterns = {kw_norm for kw_norm in record.keywords_norm
+                                if kw_norm and kw_norm not in self.automaton.pattern_ids}
+                if new_patterns:
+                    snapshot.pending_patterns = self.pending_patterns | new_patterns
+            if snapshot.ngram_index is not None:
+                # Nouveaux tokens (un token supprimé puis rajouté y figure encore)
+                for kw_word in (kw_word for kw_word in tokens if kw_word not in self.token_index):
+                    for gram in char_ngrams(f" {kw_word} "):
+                        known = snapshot.ngram_index.get(gram, ())
+                        if kw_word not in known:
+                            snapshot.ngram_index[gram] = known + (kw_word,)
+        
+        # Index dérivés : ancienne et nouvelle version du diagnostic en overlay
+        changed = [version for version in (old, record) if version is not None]
+        if self.spelling is not None:
+            snapshot.spelling = self.spelling.with_tokens(snapshot.token_index, {
+                kw_word for version in changed for kw_tokens in version.keyword_tokens for kw_word in kw_tokens})
+        if self.batch_index is not None and changed and len(self.batch_index['stale']) < INDEX_OVERLAY_LIMIT:
+            snapshot.batch_index = dict(self.batch_index, stale=self.batch_index['stale'] | {changed[0].position})
+        else:
+            snapshot.batch_index = None
+        if self.suggestion_index is not None and changed and self.suggestion_index.changes < INDEX_OVERLAY_LIMIT:
+            snapshot.suggestion_index = self.suggestion_index.with_change(
+                snapshot, {kid for version in changed for kid in version.keyword_ids})
+        else:
+            snapshot.suggestion_index = None
+        return snapshot
+    
+    def find_exact(self, input_norm):
+        """
+        Mots-clés normalisés présents tels quels dans l'input, sans automate : une
+        recherche dans exact_index par sous-chaîne de chaque longueur de mot-clé
+        de la base (quelques dizaines de longueurs distinctes, voir length_index)
+        """
+        lengths = {kw_length for lengths in self.length_index.values() for kw_length in lengths
+                   if 0 < kw_length <= len(input_norm)}
+        exact_index = self.exact_index
+        return {input_norm[start:start + kw_length] for kw_length in lengths
+                for start in range(len(input_norm) - kw_length + 1)
+                if input_norm[start:start + kw_length] in exact_index}
+    
+    def prepare_query(self, user_input, input_norm=None, stopwatch=None):
+        """
+        Normalise l'input utilisateur une seule fois pour toute la requête
+        (stopwatch optionnel : étapes spelling, tokens et exact de StageMetrics).
+        Avec la correction orthographique, les tokens inconnus sont remplacés
+        avant tout calcul et 'corrections' les liste.
+        """
+        if input_norm is None:
+            input_norm = normalize_text(user_input)
+        corrections = {}
+        if self.spelling is not None:
+            input_norm, corrections = self.spelling.correct(input_norm)
+            if stopwatch is not None:
+                stopwatch.lap('spelling')
+        input_tokens = set(input_norm.split())
+        
+        # Tokens de mots-clés présents comme sous-chaîne de l'input : un token sans
+        # espace ne peut apparaître qu'à l'intérieur d'un seul token de l'input
+        present = set()
+        for token in input_tokens:
+            for start in range(len(token)):
+                end_max = min(len(token), start + self.max_token_length)
+                for end in range(start + 1, end_max + 1):
+                    if token[start:end] in self.token_index:
+                        present.add(token[start:end])
+        if stopwatch is not None:
+            stopwatch.lap('tokens')
+        
+        if self.automaton is not None:
+            exact = self.automaton.find_all(input_norm)
+            if self.pending_patterns:
+                exact.update(kw_norm for kw_norm in self.pending_patterns if kw_norm in input_norm)
+        else:
+            exact = self.find_exact(input_norm)
+        if stopwatch is not None:
+            stopwatch.lap('exact')
+        
+        return {
+            'input': user_input,
+            'norm': input_norm,
+            'tokens': input_tokens,
+            'present': present,
+            'exact': exact,
+            'chars': Counter(input_norm),
+            'corrections': corrections
+        }
+    
+    def exact_matches(self, user_input):
+        """
+        Retourne {id du diagnostic: mot-clé} pour chaque diagnostic dont un
+        mot-clé apparaît tel quel dans l'input (premier mot-clé dans l'ordre de la base)
+        """
+        query = user_input if isinstance(user_input, dict) else self.prepare_query(user_input)
+        
+        positions = set(self.always_candidates)
+        for kw_norm in query['exact']:
+            positions.update(self.exact_index.get(kw_norm, ()))
+        
+        matches = {}
+        for position in sorted(positions):
+            record = self.records[position]
+            for keyword, kw_norm in zip(record.keywords, record.keywords_norm):
+                if not kw_norm or kw_norm in query['exact']:
+                    matches[record.id] = keyword
+                    break
+        
+        return matches
+    
+    def find_candidates(self, query, scoring=None, fuzzy_limit=None):
+        """
+        Retourne, dans l'ordre de la base, les diagnostics qui peuvent dépasser
+        le seuil de pertinence pour cette requête (pondération scoring, par
+        défaut celle du scoring historique).
+        
+        Un diagnostic absent de l'index n'a ni correspondance exacte, ni partielle,
+        ni overlap : son score se limite à l'urgence et au fuzzy. Il n'est retenu
+        que si l'un de ses mots-clés peut atteindre la similarité nécessaire, bornée
+        d'abord par les longueurs (length_index), puis par les caractères communs
+        (char_bound, calculé une fois par mot-clé distinct), ce qui garantit un
+        classement identique.
+        
+        Sur une grande base, presque tous les diagnostics passent ces bornes. Avec
+        fuzzy_limit, s'il reste plus de fuzzy_limit diagnostics hors de l'index, seuls
+        les fuzzy_limit dont les tokens partagent le plus de n-grammes de caractères
+        avec l'input (ngram_index) et passent les bornes sont retenus, sans parcourir
+        la base : le classement des diagnostics à faible similarité et total_matches
+        ne sont plus exacts.
+        """
+        candidates = set(self.always_candidates)
+        for kw_word in query['present']:
+            candidates.update(self.token_index[kw_word])
+        
+        scoring = scoring or DEFAULT_SCORING
+        input_norm = query['norm']
+        input_chars = query['chars']
+        input_length = len(input_norm)
+        table = self.keyword_table
+        records = self.records
+        bounds = {}
+        
+        # Similarité fuzzy nécessaire pour dépasser le seuil, par urgence (absente : impossible)
+        thresholds = {}
+        for urgency_score in self.length_index:
+            urgency_part = scoring.urgency * (urgency_score / 10)
+            if urgency_part > scoring.threshold - 1e-9:
+                thresholds[urgency_score] = -1.0
+            elif scoring.fuzzy:
+                thresholds[urgency_score] = (scoring.threshold - 1e-9 - urgency_part) / scoring.fuzzy
+        
+        def reachable(record, needed):
+            # Un mot-clé peut-il atteindre la similarité nécessaire (longueurs, puis caractères communs) ?
+            for kid in record.keyword_ids:
+                kw_length = len(table.norms[kid])
+                if length_bound(input_length, kw_length) <= needed:
+                    continue
+                bound = bounds.get(kid)
+                if bound is None:
+                    bound = bounds[kid] = char_bound(input_chars, input_length, table.chars(kid), kw_length)
+                if bound > needed:
+                    return True
+            return False
+        
+        if fuzzy_limit and len(records) - self.removed - len(candidates) > fuzzy_limit:
+            ngram_index = self.ngram_index if self.ngram_index is not None else self.build_ngram_index()
+            shared = Counter()
+            for gram in char_ngrams(f" {input_norm} "):
+                for kw_word in ngram_index.get(gram, ()):
+                    shared.update(self.token_index.get(kw_word, ()))
+            admitted = 0
+            for position, _ in sorted(shared.items(), key=lambda item: (-item[1], item[0])):
+                if admitted == fuzzy_limit:
+                    break
+                needed = thresholds.get(records[position].urgency_score)
+                if position not in candidates and needed is not None and reachable(records[position], needed):
+                    candidates.add(position)
+                    admitted += 1
+            return [records[position] for position in sorted(candidates)]
+        
+        for urgency_score, lengths in self.length_index.items():
+            needed = thresholds.get(urgency_score)
+            if needed is None:
+                continue
+            checked = set()
+            for kw_length, positions in lengths.items():
+                if length_bound(input_length, kw_length) <= needed:
+                    continue
+                for position in positions:
+                    if position in candidates or position in checked:
+                        continue
+                    checked.add(position)
+                    if reachable(records[position], needed):
+                        candidates.add(position)
+        
+        return [records[position] for position in sorted(candidates)]
+    
+    def build_ngram_index(self):
+        """
+        Index n-gramme de caractères -> tokens de mots-clés qui le contiennent
+        (bornés par des espaces), pour find_candidates avec fuzzy_limit : les
+        positions viennent de token_index, with_change n'ajoute que les nouveaux tokens
+        """
+        ngram_index = {}
+        for kw_word in self.token_index:
+            for gram in char_ngrams(f" {kw_word} "):
+                ngram_index.setdefault(gram, []).append(kw_word)
+        self.ngram_index = {gram: tuple(tokens) for gram, tokens in ngram_index.items()}
+        return self.ngram_index
+    
+    def build_batch_index(self):
+        """
+        Tables numpy utilisées par diagnose_many : une ligne par mot-clé de la base
+        (diagnostic, rang dans le diagnostic, nombre de tokens) et une matrice creuse
+        token -> mots-clés au format CSR
+        """
+        vocabulary = {token: token_id for token_id, token in enumerate(self.token_index)}
+        postings = [[] for _ in vocabulary]
+        kw_diag, kw_rank, kw_size = [], [], []
+        exact_rows = {}
+        empty_rows = []
+        
+        for record in self.records:
+            if record is None:
+                continue
+            for i, (kw_norm, kw_tokens) in enumerate(zip(record.keywords_norm, record.keyword_tokens)):
+                row = len(kw_diag)
+                kw_diag.append(record.position)
+                kw_rank.append(i)
+                kw_size.append(len(kw_tokens))
+                for kw_word in kw_tokens:
+                    postings[vocabulary[kw_word]].append(row)
+                if kw_norm:
+                    exact_rows.setdefault(kw_norm, []).append(row)
+                else:
+                    empty_rows.append(row)
+        
+        indptr = np.zeros(len(postings) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(rows) for rows in postings])
+        
+        self.batch_index = {
+            'stale': frozenset(),  # positions modifiées depuis la construction (voir with_change)
+            'vocabulary': vocabulary,
+            'indptr': indptr,
+            'indices': np.array([row for rows in postings for row in rows], dtype=np.int64),
+            'kw_diag': np.array(kw_diag, dtype=np.int64),
+            'kw_rank': np.array(kw_rank, dtype=np.int64),
+            'kw_size': np.array(kw_size, dtype=np.int64),
+            'exact_rows': {kw_norm: np.array(rows, dtype=np.int64) for kw_norm, rows in exact_rows.items()},
+            'empty_rows': np.array(empty_rows, dtype=np.int64)
+        }
+        return self.batch_index
+    
+    def _expand_postings(self, query_rows, token_ids):
+        """Produit creux (requête x token) . (token x mot-clé) : couples (requête, mot-clé) non nuls"""
+        index = self.batch_index
+        query_rows = np.asarray(query_rows, dtype=np.int64)
+        token_ids = np.asarray(token_ids, dtype=np.int64)
+        starts = index['indptr'][token_ids]
+        counts = index['indptr'][token_ids + 1] - starts
+        total = int(counts.sum())
+        
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(query_rows, counts), index['indices'][np.repeat(starts, counts) + offsets]
+    
+    def batch_lexical_matches(self, queries):
+        """
+        Calcule en une passe numpy les critères lexicaux (exact, partiels, overlap)
+        de toutes les requêtes préparées d'un lot. Les diagnostics modifiés depuis
+        la construction de l'index (stale) sont écartés du calcul numpy et notés
+        un par un (lexical_criteria).
+        
+        Returns:
+            dict: (rang de la requête, position du diagnostic) -> tuple au format de lexical_match
+        """
+        index = self.batch_index
+        vocabulary = index['vocabulary']
+        kw_diag, kw_rank, kw_size = index['kw_diag'], index['kw_rank'], index['kw_size']
+        n_diagnostics = len(self.records)
+        
+        token_rows, token_ids, present_rows, present_ids, exact_q, exact_kw = [], [], [], [], [], []
+        for q, query in enumerate(queries):
+            for token in query['tokens']:
+                if token in vocabulary:
+                    token_rows.append(q)
+                    token_ids.append(vocabulary[token])
+            for kw_word in query['present']:
+                if kw_word in vocabulary:  # sinon token apparu depuis la construction (stale)
+                    present_rows.append(q)
+                    present_ids.append(vocabulary[kw_word])
+            for kw_norm in query['exact']:
+                rows = index['exact_rows'].get(kw_norm)
+                if rows is None:
+                    continue  # mot-clé supprimé depuis la construction de l'automate
+                exact_q.append(np.full(len(rows), q, dtype=np.int64))
+                exact_kw.append(rows)
+            if len(index['empty_rows']):
+                exact_q.append(np.full(len(index['empty_rows']), q, dtype=np.int64))
+                exact_kw.append(index['empty_rows'])
+        
+        # 1. Correspondance exacte : premier mot-clé exact de chaque (requête, diagnostic)
+        exact_q = np.concatenate(exact_q) if exact_q else np.zeros(0, dtype=np.int64)
+        exact_kw = np.concatenate(exact_kw) if exact_kw else np.zeros(0, dtype=np.int64)
+        exact_keys = exact_q * n_diagnostics + kw_diag[exact_kw]
+        order = np.lexsort((kw_rank[exact_kw], exact_keys))
+        exact_keys, first = np.unique(exact_keys[order], return_index=True)
+        exact_limit = kw_rank[exact_kw][order][first]
+        
+        def before_exact(pair_q, pair_kw):
+            """Masque des mots-clés situés avant la correspondance exacte de leur diagnostic"""
+            keys = pair_q * n_diagnostics + kw_diag[pair_kw]
+            slot = np.minimum(np.searchsorted(exact_keys, keys), max(len(exact_keys) - 1, 0))
+            has_exact = (exact_keys[slot] == keys) if len(exact_keys) else np.zeros(len(keys), dtype=bool)
+            return ~has_exact | (kw_rank[pair_kw] < exact_limit[slot] if len(exact_keys) else True), keys
+        
+        lexical = {}
+        for key, limit in zip(exact_keys.tolist(), exact_limit.tolist()):
+            lexical[divmod(key, n_diagnostics)] = [limit, 0, None, 0]
+        
+        # 2. Correspondances partielles : mots-clés ayant au moins un token présent
+        pair_q, pair_kw = self._expand_postings(present_rows, present_ids)
+        pair_keys = np.unique(pair_q * len(kw_diag) + pair_kw)
+        pair_q, pair_kw = pair_keys // len(kw_diag), pair_keys % len(kw_diag)
+        keep, keys = before_exact(pair_q, pair_kw)
+        keys, ranks = keys[keep], kw_rank[pair_kw[keep]]
+        order = np.lexsort((ranks, keys))
+        keys, first, counts = np.unique(keys[order], return_index=True, return_counts=True)
+        for key, first_rank, count in zip(keys.tolist(), ranks[order][first].tolist(), counts.tolist()):
+            entry = lexical.setdefault(divmod(key, n_diagnostics), [None, 0, None, 0])
+            entry[1] = count
+            entry[2] = first_rank
+        
+        # 3. Overlap de tokens : |intersection| / |union| maximal par diagnostic
+        pair_q, pair_kw = self._expand_postings(token_rows, token_ids)
+        pair_keys, intersection = np.unique(pair_q * len(kw_diag) + pair_kw, return_counts=True)
+        pair_q, pair_kw = pair_keys // len(kw_diag), pair_keys % len(kw_diag)
+        query_sizes = np.array([len(query['tokens']) for query in queries], dtype=np.int64)
+        ratios = intersection / (query_sizes[pair_q] + kw_size[pair_kw] - intersection)
+        keep, keys = before_exact(pair_q, pair_kw)
+        keys, ratios = keys[keep], ratios[keep]
+        order = np.argsort(keys, kind='stable')
+        keys, first = np.unique(keys[order], return_index=True)
+        if len(keys):
+            best = np.maximum.reduceat(ratios[order], first)
+            for key, ratio in zip(keys.tolist(), best.tolist()):
+                lexical.setdefault(divmod(key, n_diagnostics), [None, 0, None, 0])[3] = ratio
+        
+        lexical = {pair: tuple(entry) for pair, entry in lexical.items()}
+        if index['stale']:
+            # Lignes de l'index périmées pour ces positions : critères recalculés sur la version courante
+            lexical = {pair: entry for pair, entry in lexical.items() if pair[1] not in index['stale']}
+            for position in index['stale']:
+                record = self.records[position]
+                if record is None:
+                    continue
+                for q, query in enumerate(queries):
+                    entry = lexical_criteria(query, record)
+                    if entry != (None, 0, None, 0):
+                        lexical[q, position] = entry
+        return lexical
+
+class PostingIndex(MutableMapping):
+    """
+    Index clé -> positions d'un snapshot compilé : les positions restent dans le
+    fichier mappé (tranches d'un array CSR lues par memoryview), seul le
+    dictionnaire clé -> ligne est propre au processus. Les modifications de
+    with_change sont gardées à part (changes : clé -> array, None si supprimée).
+    """
+    
+    __slots__ = ('rows', 'starts', 'postings', 'changes')
+    
+    def __init__(self, rows, starts, postings, changes=None):
+        self.rows = rows
+        self.starts = starts
+        self.postings = postings
+        self.changes = changes or {}
+    
+    def __getitem__(self, key):
+        if self.changes and key in self.changes:
+            positions = self.changes[key]
+            if positions is None:
+                raise KeyError(key)
+            return positions
+        row = self.rows[key]
+        return self.postings[self.starts[row]:self.starts[row + 1]]
+    
+    def __contains__(self, key):
+        if self.changes and key in self.changes:
+            return self.changes[key] is not None
+        return key in self.rows
+    
+    def __setitem__(self, key, positions):
+        self.changes[key] = positions
+    
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.changes[key] = None
+    
+    def __iter__(self):
+        changes = self.changes
+        for key in self.rows:
+            if not changes or changes.get(key, True) is not None:
+                yield key
+        for key, positions in changes.items():
+            if positions is not None and key not in self.rows:
+                yield key
+    
+    def __len__(self):
+        size = len(self.rows)
+        for key, positions in self.changes.items():
+            if key in self.rows:
+                size -= positions is None
+            else:
+                size += positions is not None
+        return size
+    
+    def copy(self):
+        """Copie sur laquelle with_change peut écrire (tables du fichier partagées)"""
+        return PostingIndex(self.rows, self.starts, self.postings, dict(self.changes))
+
+class FlatEdges:
+    """
+    Arêtes de l'automate d'un snapshot compilé : clés (nœud << 21 | caractère)
+    triées et nœuds cibles, lues par memoryview dans le fichier mappé
+    """
+    
+    __slots__ = ('keys', 'nodes')
+    
+    def __init__(self, keys, nodes):
+        self.keys = keys
+        self.nodes = nodes
+    
+    def get(self, key, default=None):
+        index = bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.nodes[index]
+        return default
+    
+    def __contains__(self, key):
+        return self.get(key) is not None
+    
+    def __len__(self):
+        return len(self.keys)
+
+class LazyDiagnostic(Mapping):
+    """
+    Diagnostic d'un snapshot compilé, décodé depuis le fichier mappé en mémoire
+    seulement quand un résultat en a besoin
+    """
+    
+    __slots__ = ('buffer', 'offset', 'length', 'decoded')
+    
+    def __init__(self, buffer, offset, length):
+        self.buffer = buffer
+        self.offset = offset
+        self.length = length
+        self.decoded = None
+    
+    def _load(self):
+        if self.decoded is None:
+            self.decoded = json.loads(self.buffer[self.offset:self.offset + self.length].decode('utf-8'))
+        return self.decoded
+    
+    def __getitem__(self, key):
+        return self._load()[key]
+    
+    def __iter__(self):
+        return iter(self._load())
+    
+    def __len__(self):
+        return len(self._load())
+
+def write_compiled_snapshot(snapshot, output_path):
+    """
+    Écrit un snapshot binaire versionné de la base et de ses index :
+    
+        SNAPSHOT_MAGIC | longueur de l'en-tête (uint32) | en-tête JSON | sections | diagnostics (JSON)
+    
+    Les sections sont des arrays plats (alignés sur 8 octets) : textes concaténés
+    avec leurs offsets, listes de positions au format CSR, tables de l'automate.
+    Aucun objet Python sérialisé : l'ouverture ne fait que lire des nombres et
+    du texte. L'en-tête contient le format, l'ordre des octets, le mtime/taille
+    du fichier JSON source et l'emplacement des sections. L'écriture est
+    atomique (fichier temporaire).
+    """
+    records = snapshot.records
+    table = snapshot.keyword_table
+    sections = {}
+    
+    def add_strings(name, values):
+        offsets = array.array('I', [0])
+        for value in values:
+            offsets.append(offsets[-1] + len(value))
+        sections[f'{name}_text'] = ''.join(values).encode('utf-8')
+        sections[f'{name}_offsets'] = offsets
+    
+    def add_postings(name, index):
+        starts = array.array('I', [0])
+        postings = array.array('I')
+        for positions in index.values():
+            postings.extend(positions)
+            starts.append(len(postings))
+        sections[f'{name}_starts'] = starts
+        sections[f'{name}_postings'] = postings
+    
+    # Mots-clés normalisés (KeywordTable) et diagnostics au format CSR
+    add_strings('keyword', table.norms)
+    add_strings('record_id', [record.id for record in records])
+    add_strings('record_keyword', [keyword for record in records for keyword in record.keywords])
+    keyword_starts = array.array('I', [0])
+    for record in records:
+        keyword_starts.append(keyword_starts[-1] + len(record.keywords))
+    sections['record_keyword_starts'] = keyword_starts
+    sections['record_keyword_ids'] = array.array('I', [kid for record in records for kid in record.keyword_ids])
+    sections['record_length_order'] = array.array('I', [i for record in records for i in record.length_order])
+    sections['record_sorted_lengths'] = array.array('I', [n for record in records for n in record.sorted_lengths])
+    sections['record_urgency'] = array.array('B', [record.urgency_score for record in records])
+    sections['record_confidence'] = array.array('d', [record.confidence for record in records])
+    
+    # Index de correspondance
+    add_strings('token', list(snapshot.token_index))
+    add_postings('token', snapshot.token_index)
+    sections['exact_keys'] = array.array('I', [table.ids[kw_norm] for kw_norm in snapshot.exact_index])
+    add_postings('exact', snapshot.exact_index)
+    length_keys = [(urgency_score, kw_length) for urgency_score, lengths in snapshot.length_index.items()
+                   for kw_length in lengths]
+    sections['length_urgency'] = array.array('I', [urgency_score for urgency_score, _ in length_keys])
+    sections['length_length'] = array.array('I', [kw_length for _, kw_length in length_keys])
+    add_postings('length', {key: snapshot.length_index[key[0]][key[1]] for key in length_keys})
+    sections['always_candidates'] = array.array('I', sorted(snapshot.always_candidates))
+    
+    automaton = snapshot.automaton
+    if automaton is None or snapshot.pending_patterns:
+        # Base chargée depuis le JSON ou modifiée depuis : l'automate n'est
+        # construit qu'ici, une fois, pour être repris à chaque ouverture
+        automaton = AhoCorasickMatcher(snapshot.exact_index)
+    edges = sorted(automaton.edges.items())
+    sections['automaton_edge_keys'] = array.array('Q', [key for key, _ in edges])
+    sections['automaton_edge_nodes'] = array.array('I', [node for _, node in edges])
+    sections['automaton_fail'] = automaton.fail
+    sections['automaton_terminal'] = automaton.terminal
+    sections['automaton_output'] = automaton.output_link
+    sections['automaton_patterns'] = array.array('I', [table.ids[pattern] for pattern in automaton.patterns])
+    
+    # Diagnostics JSON d'origine, décodés à la demande (LazyDiagnostic)
+    payloads = [json.dumps(dict(record.data), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+                for record in records]
+    payload_offsets = array.array('Q', [0])
+    for payload in payloads:
+        payload_offsets.append(payload_offsets[-1] + len(payload))
+    sections['payload_offsets'] = payload_offsets
+    
+    layout = {}
+    blobs = []
+    position = 0
+    for name, section in sections.items():
+        blob = section if isinstance(section, bytes) else section.tobytes()
+        padding = -len(blob) % 8
+        layout[name] = [position, len(blob), 's' if isinstance(section, bytes) else section.typecode]
+        blobs.append(blob + bytes(padding))
+        position += len(blob) + padding
+    
+    meta = {key: value for key, value in snapshot.data.items() if key != 'diagnostics'}
+    header = {
+        'format': SNAPSHOT_FORMAT,
+        'byteorder': sys.byteorder,
+        'source': {'mtime_ns': snapshot.source_mtime, 'size': snapshot.source_size},
+        'meta': meta,
+        'max_token_length': snapshot.max_token_length,
+        'sections': layout,
+        'sections_length': position
+    }
+    header_blob = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack('<I', len(header_blob)))
+        f.write(header_blob)
+        f.write(bytes(-(len(SNAPSHOT_MAGIC) + 4 + len(header_blob)) % 8))
+        for blob in blobs:
+            f.write(blob)
+        for payload in payloads:
+            f.write(payload)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+def open_compiled_snapshot(path, source_stat, generation=0):
+    """
+    Ouvre un snapshot binaire par mmap (lecture seule).
+    
+    Les listes de positions (token_index, exact_index, length_index, voir
+    PostingIndex) et les tables de l'automate (FlatEdges) sont lues en place
+    par memoryview : ces pages du fichier sont partagées par tous les
+    processus qui ouvrent le même snapshot (cache de pages). Les chaînes
+    (mots-clés, tokens, identifiants), les dictionnaires clé -> ligne et les
+    DiagnosticRecord sont en revanche reconstruits dans chaque processus, et
+    un diagnostic JSON y est décodé au premier résultat qui l'utilise.
+    
+    Retourne None si le fichier est absent, d'un autre format, ou périmé par
+    rapport au fichier JSON source (mtime ou taille différents).
+    """
+    try:
+        with open(path, 'rb') as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    
+    try:
+        if buffer[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            return None
+        start = len(SNAPSHOT_MAGIC)
+        (header_length,) = struct.unpack('<I', buffer[start:start + 4])
+        start += 4
+        header = json.loads(buffer[start:start + header_length].decode('utf-8'))
+        start += header_length
+        start += -start % 8
+        
+        source = header.get('source', {})
+        if header.get('format') != SNAPSHOT_FORMAT or header.get('byteorder') != sys.byteorder or \
+                (source.get('mtime_ns'), source.get('size')) != (source_stat.st_mtime_ns, source_stat.st_size):
+            return None
+        
+        view = memoryview(buffer)
+        layout = header['sections']
+        if start + header['sections_length'] > len(buffer):
+            return None
+        
+        def section(name):
+            offset, length, typecode = layout[name]
+            data = view[start + offset:start + offset + length]
+            return data if typecode == 's' else data.cast(typecode)
+        
+        def strings(name):
+            text = str(section(f'{name}_text'), 'utf-8')
+            offsets = section(f'{name}_offsets')
+            return [sys.intern(text[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+        
+        def postings(name, keys):
+            starts = section(f'{name}_starts')
+            if len(starts) != len(keys) + 1:
+                raise ValueError("❌ Section de positions incohérente")
+            return PostingIndex({key: row for row, key in enumerate(keys)}, starts, section(f'{name}_postings'))
+        
+        norms = strings('keyword')
+        keyword_table = KeywordTable(norms, [frozenset(sys.intern(token) for token in kw_norm.split())
+                                             for kw_norm in norms])
+        
+        ids = strings('record_id')
+        keywords = strings('record_keyword')
+        keyword_starts = section('record_keyword_starts')
+        keyword_ids = section('record_keyword_ids')
+        length_order = section('record_length_order')
+        sorted_lengths = section('record_sorted_lengths')
+        urgency = section('record_urgency')
+        confidence = section('record_confidence')
+        payload_offsets = section('payload_offsets')
+        payloads_start = start + header['sections_length']
+        
+        diagnostics = {}
+        records = []
+        for position, diag_id in enumerate(ids):
+            low, high = keyword_starts[position], keyword_starts[position + 1]
+            data = diagnostics[diag_id] = LazyDiagnostic(
+                buffer, payloads_start + payload_offsets[position],
+                payload_offsets[position + 1] - payload_offsets[position])
+            records.append(DiagnosticRecord.restore(
+                diag_id, position, keywords[low:high], array.array('I', keyword_ids[low:high]),
+                array.array('I', length_order[low:high]), array.array('I', sorted_lengths[low:high]),
+                urgency[position], confidence[position], keyword_table, data))
+        
+        # length_index : un PostingIndex par urgence sur les mêmes tables CSR
+        length_starts = section('length_starts')
+        length_postings = section('length_postings')
+        length_index = {}
+        for row, (urgency_score, kw_length) in enumerate(zip(section('length_urgency'), section('length_length'))):
+            lengths = length_index.setdefault(urgency_score, PostingIndex({}, length_starts, length_postings))
+            lengths.rows[kw_length] = row
+        if len(length_starts) != sum(len(lengths) for lengths in length_index.values()) + 1:
+            raise ValueError("❌ Section de positions incohérente")
+        
+        index_state = {
+            'token_index': postings('token', strings('token')),
+            'exact_index': postings('exact', [norms[kid] for kid in section('exact_keys')]),
+            'length_index': length_index,
+            'always_candidates': set(section('always_candidates')),
+            'max_token_length': header['max_token_length'],
+            'automaton': AhoCorasickMatcher.restore(
+                FlatEdges(section('automaton_edge_keys'), section('automaton_edge_nodes')),
+                section('automaton_fail'), section('automaton_terminal'), section('automaton_output'),
+                [norms[kid] for kid in section('automaton_patterns')])
+        }
+    except (ValueError, KeyError, TypeError, IndexError, struct.error):
+        return None
+    
+    data = dict(header['meta'], diagnostics=diagnostics)
+    return DatabaseSnapshot.restore(data, records, keyword_table, index_state, generation,
+                                    source_stat.st_mtime_ns, source_stat.st_size)
+
+def validate_diagnostic(diag_id, diagnostic):
+    """
+    Vérifie un diagnostic contribué (schéma de la base : mots-clés, titre, urgence,
+    listes de causes et solutions) et en retourne une copie JSON indépendante
+    """
+    if not isinstance(diag_id, str) or not diag_id.strip():
+        raise ValueError(f"❌ Identifiant de diagnostic invalide: {diag_id!r}")
+    if not isinstance(diagnostic, Mapping):
+        raise ValueError(f"❌ Diagnostic {diag_id} : objet JSON attendu")
+    keywords = diagnostic.get('keywords')
+    if not isinstance(keywords, list) or not keywords or \
+            not all(isinstance(keyword, str) and normalize_text(keyword) for keyword in keywords):
+        raise ValueError(f"❌ Diagnostic {diag_id} : liste de mots-clés non vides attendue")
+    if not isinstance(diagnostic.get('titre'), str) or not diagnostic['titre'].strip():
+        raise ValueError(f"❌ Diagnostic {diag_id} : titre manquant")
+    if diagnostic.get('urgence') not in URGENCY_SCORE:
+        raise ValueError(f"❌ Diagnostic {diag_id} : urgence inconnue {diagnostic.get('urgence')!r} "
+                         f"(attendu: {', '.join(URGENCY_SCORE)})")
+    for field in ('causes', 'solutions'):
+        values = diagnostic.get(field, [])
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"❌ Diagnostic {diag_id} : {field} doit être une liste de textes")
+    try:
+        return json.loads(json.dumps(dict(diagnostic), ensure_ascii=False))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"❌ Diagnostic {diag_id} : valeur non sérialisable en JSON ({e})")
+
+def read_delta_log(path):
+    """
+    Modifications enregistrées dans le journal (une ligne JSON par changement :
+    {"op": "put" | "remove", "id": ..., "diagnostic": ...}). Une ligne illisible,
+    typiquement la dernière après un arrêt brutal, est ignorée avec un avertissement.
+    """
+    entries = []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                    if entry['op'] not in ('put', 'remove') or not isinstance(entry['id'], str):
+                        raise ValueError(f"opération inconnue {entry['op']!r}")
+                    if entry['op'] == 'put' and not isinstance(entry.get('diagnostic'), dict):
+                        raise ValueError("diagnostic manquant")
+                except (ValueError, KeyError, TypeError) as e:
+                    print(f"⚠️ Journal {path}, ligne {line_number} ignorée: {e}", file=sys.stderr)
+                    continue
+                entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+def apply_delta_log(diagnostics, changes):
+    """Rejoue les modifications du journal sur le dictionnaire des diagnostics (ordre conservé)"""
+    for change in changes:
+        if change['op'] == 'put':
+            diagnostics[change['id']] = change['diagnostic']
+        else:
+            diagnostics.pop(change['id'], None)
+    return diagnostics
+
+def render_database_json(data):
+    """Base JSON indentée comme les fichiers livrés (mots-clés sur une seule ligne)"""
+    text = json.dumps(data, ensure_ascii=False, indent=2, default=dict)
+    return re.sub(r'"keywords": \[\n\s*(.*?)\n\s*\]',
+                  lambda match: '"keywords": [' + re.sub(r',\n\s*', ', ', match.group(1)) + ']',
+                  text, flags=re.DOTALL) + "\n"
 
 class BotIADiagnosticEngine:
     """
     Moteur de diagnostic automobile intelligent pour BotIA
     """
     
-    def __init__(self, database_path=None):
-        """Initialise le moteur avec la base de données"""
+    def __init__(self, database_path=None, fuzzy_mode="fast", fuzzy_tolerance=0.0,
+                 cache_size=0, cache_ttl=None, snapshot_path=None, use_snapshot=True, top_k=False,
+                 metrics=False, max_sessions=1024, session_ttl=900.0, spelling_distance=0, scoring=None,
+                 delta_log_path=None, compact_every=DELTA_COMPACT_EVERY, fuzzy_candidates=FUZZY_CANDIDATE_LIMIT):
+        """
+        Initialise le moteur avec la base de données
+        
+        Args:
+            database_path (str): Chemin du fichier JSON (détection automatique si None)
+            fuzzy_mode (str): "fast" (similarité bornée, voir best_fuzzy) ou
+                "reference" (SequenceMatcher sur chaque paire, comportement historique)
+            fuzzy_tolerance (float): écart maximal toléré sur la similarité fuzzy en mode
+                "fast" ; 0.0 donne exactement les mêmes valeurs que le mode "reference"
+            cache_size (int): nombre de résultats gardés en cache LRU (0 = pas de cache)
+            cache_ttl (float): durée de vie d'un résultat en cache, en secondes (None = illimitée)
+            snapshot_path (str): snapshot binaire compilé (défaut: <database_path>.snapshot)
+            use_snapshot (bool): ouvrir le snapshot compilé s'il est à jour au lieu du JSON
+            top_k (bool): sélection des meilleurs résultats par bornes supérieures (voir
+                diagnose_top_k) ; mêmes résultats, fuzzy calculé pour moins de diagnostics
+            metrics (bool): mesurer la durée de chaque étape et compter candidats,
+                résultats et clarifications (voir StageMetrics) ; coût quasi nul si désactivé
+            max_sessions (int): nombre maximal de conversations gardées par refine
+            session_ttl (float): expiration d'une conversation inactive, en secondes (None = jamais)
+            spelling_distance (int): correction des tokens inconnus vers le vocabulaire des
+                mots-clés jusqu'à cette distance d'édition (voir SpellingCorrector ; 0 = désactivée)
+            scoring (ScoringConfig | dict | str): poids du score, seuil de pertinence et écart
+                d'ambiguïté, ou fichier JSON de scripts/tune_weights.py (None = scoring historique)
+            delta_log_path (str): journal des diagnostics ajoutés, modifiés ou supprimés depuis
+                la dernière compaction (défaut: <database_path>.delta.jsonl, voir put_diagnostic)
+            compact_every (int): modifications du journal avant sa compaction automatique dans
+                la base JSON, en arrière-plan (0 = seulement par compact)
+            fuzzy_candidates (int): diagnostics sans token commun avec la requête notés au plus,
+                choisis par n-grammes communs (voir find_candidates) ; 0 = tous, classement
+                et total_matches exacts même sur une grande base
+        """
+        
+        if fuzzy_mode not in FUZZY_MODES:
+            raise ValueError(f"❌ Mode fuzzy inconnu: {fuzzy_mode} (attendu: {', '.join(FUZZY_MODES)})")
+        self.fuzzy_mode = fuzzy_mode
+        self.fuzzy_tolerance = fuzzy_tolerance
+        self.top_k = top_k
+        self.metrics = StageMetrics() if metrics else None
+        self.spelling_distance = spelling_distance
+        self.fuzzy_candidates = fuzzy_candidates
+        self.scoring = ScoringConfig.coerce(scoring)
         
         # Détection automatique du chemin de la base
         if database_path is None:
-            # Essai des chemins possibles
-            possible_paths = [
-                "données/diagnostics_complet.json",
-                "données/diagnostics.json", 
-                "data/diagnostics.json",
-                "../données/diagnostics_complet.json"
-            ]
-            
-            for path in possible_paths:
-                if os.path.exists(path):
-                    database_path = path
-                    break
-            
-            if database_path is None:
-                raise FileNotFoundError("❌ Aucune base de données trouvée. Vérifiez les chemins.")
+            database_path = self.find_database_path()
         
         self.database_path = database_path
-        self.data = None
+        self.snapshot_path = snapshot_path or f"{database_path}.snapshot"
+        self.delta_log_path = delta_log_path or f"{database_path}.delta.jsonl"
+        self.compact_every = compact_every
+        self.pending_changes = 0  # lignes du journal non encore compactées dans la base
+        self.compactor = None
+        self.use_snapshot = use_snapshot
+        self.snapshot = None
+        self.load_count = 0
+        self.reload_lock = threading.RLock()  # compact recharge la base en gardant le verrou
+        self.watcher = None
+        self.watcher_stop = threading.Event()
+        self.cache = DiagnosisCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.sessions = SessionStore(max_sessions, session_ttl)
         self.load_database()
     
+    @staticmethod
+    def find_database_path():
+        """Premier chemin de base existant parmi les emplacements connus"""
+        # Essai des chemins possibles
+        possible_paths = [
+            "données/diagnostics_complet.json",
+            "données/diagnostics.json", 
+            "data/diagnostics.json",
+            "../données/diagnostics_complet.json"
+        ]
+        
+        for path in possible_paths:
+            if os.path.exists(path):
+                return path
+        
+        raise FileNotFoundError("❌ Aucune base de données trouvée. Vérifiez les chemins.")
+    
+    @property
+    def data(self):
+        """Données JSON de la base actuellement en service"""
+        return self.snapshot.data if self.snapshot is not None else None
+    
+    @property
+    def compiled(self):
+        """Diagnostics précompilés de la base actuellement en service, par id"""
+        return self.snapshot.compiled if self.snapshot is not None else {}
+    
+    @property
+    def records(self):
+        """Diagnostics précompilés de la base actuellement en service, dans l'ordre de la base"""
+        if self.snapshot is None:
+            return []
+        if self.snapshot.removed:
+            return [record for record in self.snapshot.records if record is not None]
+        return self.snapshot.records
+    
     def load_database(self):
-        """Charge la base de données depuis le fichier JSON"""
-        try:
-            with open(self.database_path, 'r', encoding='utf-8') as f:
-                self.data = json.load(f)
+        """
+        Charge la base de données depuis le fichier JSON.
+        
+        Le nouveau snapshot (données + index) est entièrement construit avant
+        d'être mis en service par une seule affectation : les appels concurrents
+        à diagnose voient l'ancienne ou la nouvelle base, jamais un état partiel.
+        En cas d'erreur, la base en service reste inchangée.
+        
+        Un snapshot compilé à jour (voir compile_snapshot) est ouvert par mmap à
+        la place du JSON ; s'il est absent ou périmé, le JSON est relu. Les
+        modifications du journal (voir put_diagnostic) sont appliquées au JSON
+        avant la construction des index.
+        """
+        with self.reload_lock:
+            try:
+                stat = os.stat(self.database_path)
+                changes = read_delta_log(self.delta_log_path)
+                snapshot = None
+                if self.use_snapshot and not changes:
+                    snapshot = open_compiled_snapshot(self.snapshot_path, stat, self.load_count + 1)
+                
+                if snapshot is None:
+                    with open(self.database_path, 'r', encoding='utf-8') as f:
+                        data = json.load(f)
+                    apply_delta_log(data.setdefault('diagnostics', {}), changes)
+                    snapshot = DatabaseSnapshot(data, self.load_count + 1, stat.st_mtime_ns, stat.st_size)
+                else:
+                    print(f"⚡ Snapshot compilé utilisé: {self.snapshot_path}", file=sys.stderr)
+                data = snapshot.data
+                
+            except FileNotFoundError:
+                raise Exception(f"❌ Base de données non trouvée: {self.database_path}")
+            except json.JSONDecodeError as e:
+                raise Exception(f"❌ Erreur de format JSON: {e}")
             
-            diagnostics_count = len(self.data.get('diagnostics', {}))
-            print(f"✅ Base BotIA chargée: {diagnostics_count} diagnostics disponibles")
+            # Dictionnaire de correction construit avant la mise en service du snapshot
+            if self.spelling_distance > 0:
+                snapshot.spelling = SpellingCorrector(snapshot.token_index, self.spelling_distance,
+                                                      lexicon=spelling_lexicon(data))
             
-            # Affichage des métadonnées si disponibles
-            if 'metadata' in self.data:
-                meta = self.data['metadata']
-                print(f"📊 Métadonnées: {meta.get('total_keywords', 'N/A')} mots-clés, version {self.data.get('version', 'N/A')}")
+            self.snapshot = snapshot
+            self.load_count += 1
+            self.pending_changes = len(changes)
+            if self.cache is not None:
+                self.cache.invalidate((data.get('version'), data.get('lastUpdate'), self.load_count))
+        
+        diagnostics_count = len(data.get('diagnostics', {}))
+        print(f"✅ Base BotIA chargée: {diagnostics_count} diagnostics disponibles", file=sys.stderr)
+        if changes:
+            print(f"📝 {len(changes)} modification(s) du journal appliquée(s): {self.delta_log_path}", file=sys.stderr)
+        
+        # Affichage des métadonnées si disponibles
+        if 'metadata' in data:
+            meta = data['metadata']
+            print(f"📊 Métadonnées: {meta.get('total_keywords', 'N/A')} mots-clés, version {data.get('version', 'N/A')}",
+                  file=sys.stderr)
+    
+    def compile_snapshot(self, output_path=None):
+        """
+        Écrit le snapshot binaire compilé de la base en service (défaut: snapshot_path),
+        après compaction du journal : le snapshot correspond toujours au fichier JSON
+        """
+        with self.reload_lock:
+            if self.pending_changes:
+                self.compact()
+            return write_compiled_snapshot(self.snapshot, output_path or self.snapshot_path)
+    
+    def add_diagnostic(self, diag_id, diagnostic):
+        """Ajoute un diagnostic (erreur si l'identifiant existe déjà) ; voir put_diagnostic"""
+        return self.put_diagnostic(diag_id, diagnostic, expect_existing=False)
+    
+    def update_diagnostic(self, diag_id, diagnostic):
+        """Remplace un diagnostic existant (même position dans la base) ; voir put_diagnostic"""
+        return self.put_diagnostic(diag_id, diagnostic, expect_existing=True)
+    
+    def remove_diagnostic(self, diag_id):
+        """Supprime un diagnostic ; voir put_diagnostic"""
+        return self.put_diagnostic(diag_id, None, expect_existing=True)
+    
+    def put_diagnostic(self, diag_id, diagnostic, expect_existing=None):
+        """
+        Ajoute ou remplace un diagnostic (ou le supprime si diagnostic est None)
+        sans recharger la base :
+        
+        1. le nouveau snapshot est dérivé du snapshot en service
+           (DatabaseSnapshot.with_change, seules les entrées de ce diagnostic changent) ;
+        2. la modification est ajoutée au journal (fichier JSONL, synchronisé sur disque) ;
+        3. le snapshot est mis en service par une seule affectation et le cache vidé.
+        
+        Le journal est rejoué au chargement de la base ; au-delà de compact_every
+        modifications, il est intégré au fichier JSON en arrière-plan (voir compact).
+        
+        Args:
+            expect_existing (bool): True si le diagnostic doit exister, False s'il ne
+                doit pas exister, None pour accepter les deux
             
-        except FileNotFoundError:
-            raise Exception(f"❌ Base de données non trouvée: {self.database_path}")
-        except json.JSONDecodeError as e:
-            raise Exception(f"❌ Erreur de format JSON: {e}")
+        Returns:
+            int: génération du snapshot mis en service
+        """
+        if diagnostic is not None:
+            diagnostic = validate_diagnostic(diag_id, diagnostic)
+        
+        with self.reload_lock:
+            snapshot = self.snapshot
+            exists = diag_id in snapshot.compiled
+            if expect_existing is not None and exists != expect_existing:
+                raise LookupError(f"❌ Diagnostic {'inconnu' if expect_existing else 'déjà existant'}: {diag_id}")
+            
+            updated = snapshot.with_change(diag_id, diagnostic, self.load_count + 1)
+            entry = {'op': 'remove', 'id': diag_id} if diagnostic is None else \
+                {'op': 'put', 'id': diag_id, 'diagnostic': diagnostic}
+            with open(self.delta_log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            
+            self.snapshot = updated
+            self.load_count += 1
+            self.pending_changes += 1
+            if self.cache is not None:
+                self.cache.invalidate(('delta', self.load_count))
+            
+            if self.compact_every and self.pending_changes >= self.compact_every and \
+                    (self.compactor is None or not self.compactor.is_alive()):
+                self.compactor = threading.Thread(target=self._compact_safely, name="botia-compact", daemon=True)
+                self.compactor.start()
+        return updated.generation
+    
+    def compact(self):
+        """
+        Intègre le journal au fichier JSON (écriture atomique), le vide, puis recharge
+        la base : index et automate sont reconstruits sans positions libérées.
+        Les modifications concurrentes attendent la fin de la compaction.
+        """
+        with self.reload_lock:
+            if not self.pending_changes and not os.path.exists(self.delta_log_path):
+                return False
+            data = dict(self.snapshot.data, lastUpdate=date.today().isoformat())
+            tmp_path = f"{self.database_path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(render_database_json(data))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.database_path)
+            if os.path.exists(self.delta_log_path):
+                os.remove(self.delta_log_path)
+            self.load_database()
+        return True
+    
+    def _compact_safely(self):
+        """Compaction en arrière-plan : en cas d'échec le journal est conservé"""
+        try:
+            self.compact()
+        except Exception as e:
+            print(f"⚠️ Compaction du journal ignorée: {e}", file=sys.stderr)
+    
+    def database_modified(self):
+        """Indique si le fichier de la base a changé (mtime ou taille) depuis le dernier chargement"""
+        try:
+            stat = os.stat(self.database_path)
+        except OSError:
+            return False
+        snapshot = self.snapshot
+        return snapshot is None or (stat.st_mtime_ns, stat.st_size) != (snapshot.source_mtime, snapshot.source_size)
+    
+    def reload(self, background=False):
+        """
+        Recharge la base. Avec background=True, l'analyse et la compilation se
+        font dans un thread séparé (retourné) ; diagnose continue de servir
+        l'ancienne base jusqu'au remplacement atomique du snapshot.
+        """
+        if not background:
+            self.load_database()
+            return None
+        
+        thread = threading.Thread(target=self._reload_safely, name="botia-reload", daemon=True)
+        thread.start()
+        return thread
+    
+    def reload_if_modified(self, background=False):
+        """Recharge la base seulement si le fichier a changé ; retourne True si un rechargement a été lancé"""
+        if not self.database_modified():
+            return False
+        self.reload(background)
+        return True
+    
+    def _reload_safely(self):
+        """Rechargement en arrière-plan : une base invalide est signalée et l'ancienne reste en service"""
+        try:
+            self.load_database()
+        except Exception as e:
+            print(f"⚠️ Rechargement ignoré, base précédente conservée: {e}", file=sys.stderr)
+    
+    def start_watching(self, interval=2.0):
+        """Surveille le mtime du fichier de la base et le recharge en arrière-plan quand il change"""
+        if self.watcher is not None and self.watcher.is_alive():
+            return self.watcher
+        
+        self.watcher_stop.clear()
+        
+        def watch():
+            while not self.watcher_stop.wait(interval):
+                if self.database_modified():
+                    self._reload_safely()
+        
+        self.watcher = threading.Thread(target=watch, name="botia-watch", daemon=True)
+        self.watcher.start()
+        return self.watcher
+    
+    def stop_watching(self):
+        """Arrête la surveillance du fichier de la base"""
+        self.watcher_stop.set()
+        if self.watcher is not None:
+            self.watcher.join()
+            self.watcher = None
+    
+    def install_reload_signal(self, signum=None):
+        """Recharge la base en arrière-plan à la réception d'un signal (SIGHUP par défaut)"""
+        signum = signal.SIGHUP if signum is None else signum
+        signal.signal(signum, lambda *_: self.reload(background=True))
+    
+    def prepare_query(self, user_input, input_norm=None):
+        """Normalise l'input utilisateur une seule fois pour toute la requête"""
+        return self.snapshot.prepare_query(user_input, input_norm)
+    
+    def exact_matches(self, user_input):
+        """Diagnostics ayant un mot-clé présent tel quel dans l'input (voir DatabaseSnapshot.exact_matches)"""
+        return self.snapshot.exact_matches(user_input)
+    
+    def find_candidates(self, query):
+        """Diagnostics candidats pour une requête préparée (voir DatabaseSnapshot.find_candidates)"""
+        return self.snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)
     
     def normalize_text(self, text):
         """Normalise le texte (supprime accents, met en minuscules)"""
-        text = text.lower()
-        text = unicodedata.normalize('NFD', text)
-        text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
-        return text.strip()
+        return normalize_text(text)
     
     def fuzzy_similarity(self, a, b):
         """Calcule la similarité entre deux chaînes"""
         return SequenceMatcher(None, a, b).ratio()
     
-    def compute_match_score(self, user_input, diagnostic):
-        """Calcule le score de correspondance entre l'input utilisateur et un diagnostic"""
+    def best_fuzzy(self, query, record, limit, cap):
+        """
+        Similarité fuzzy d'un diagnostic précompilé.
+        
+        Retourne (meilleure similarité parmi keywords[:limit], premier index < cap
+        dont la similarité dépasse FUZZY_KEYWORD_THRESHOLD, ou None).
+        
+        En mode "fast", les mots-clés sont visités par borne de longueur
+        décroissante et la recherche s'arrête dès qu'aucun mot-clé restant ne peut
+        améliorer le meilleur score de plus de fuzzy_tolerance ; la borne sur les
+        caractères communs évite le calcul de ratio() pour les autres. Écart maximal
+        garanti : 0 <= ratio_reference - ratio_fast <= fuzzy_tolerance, soit au plus
+        0.1 * fuzzy_tolerance sur le score (+0.001 d'arrondi). L'index du mot-clé
+        retenu est toujours exact.
+        """
+        input_norm = query['norm']
+        keywords_norm = record.keywords_norm
+        
+        if self.fuzzy_mode == "reference":
+            fuzzy_best = 0
+            first_index = None
+            for i in range(limit):
+                fuzzy_score = self.fuzzy_similarity(input_norm, keywords_norm[i])
+                fuzzy_best = max(fuzzy_best, fuzzy_score)
+                if first_index is None and i < cap and fuzzy_score > FUZZY_KEYWORD_THRESHOLD:
+                    first_index = i
+            return fuzzy_best, first_index
+        
+        input_chars = query['chars']
+        input_length = len(input_norm)
+        tolerance = self.fuzzy_tolerance
+        table = record.table
+        keyword_ids = record.keyword_ids
+        order = record.length_order
+        lengths = record.sorted_lengths
+        computed = {}
+        fuzzy_best = 0
+        
+        # Parcours par borne de longueur décroissante, à partir de la longueur de l'input
+        right = bisect_left(lengths, input_length)
+        left = right - 1
+        while left >= 0 or right < len(order):
+            left_bound = length_bound(input_length, lengths[left]) if left >= 0 else -1
+            right_bound = length_bound(input_length, lengths[right]) if right < len(order) else -1
+            if max(left_bound, right_bound) <= fuzzy_best + tolerance:
+                break
+            
+            if right_bound >= left_bound:
+                i = order[right]
+                right += 1
+            else:
+                i = order[left]
+                left -= 1
+            
+            if i >= limit:
+                continue
+            kw_norm = keywords_norm[i]
+            if char_bound(input_chars, input_length, table.chars(keyword_ids[i]), len(kw_norm)) <= fuzzy_best + tolerance:
+                continue
+            computed[i] = sequence_ratio(input_norm, kw_norm, table.b2j(keyword_ids[i]))
+            fuzzy_best = max(fuzzy_best, computed[i])
+        
+        # Premier mot-clé (dans l'ordre de la base) au-dessus du seuil fuzzy
+        first_index = None
+        if fuzzy_best + tolerance > FUZZY_KEYWORD_THRESHOLD:
+            for i in range(min(cap, limit)):
+                fuzzy_score = computed.get(i)
+                if fuzzy_score is None:
+                    kw_norm = keywords_norm[i]
+                    if char_bound(input_chars, input_length, table.chars(keyword_ids[i]), len(kw_norm)) <= FUZZY_KEYWORD_THRESHOLD:
+                        continue
+                    fuzzy_score = sequence_ratio(input_norm, kw_norm, table.b2j(keyword_ids[i]))
+                if fuzzy_score > FUZZY_KEYWORD_THRESHOLD:
+                    first_index = i
+                    break
+        
+        return fuzzy_best, first_index
+    
+    def compute_match_score(self, user_input, diagnostic):
+        """Calcule le score de correspondance entre l'input utilisateur et un diagnostic"""
+        
+        input_norm = self.normalize_text(user_input)
+        input_tokens = set(input_norm.split())
+        
+        best_keyword = None
+        exact_match = 0
+        token_overlap = 0
+        fuzzy_best = 0
+        partial_matches = 0
+        
+        keywords = diagnostic.get('keywords', [])
+        
+        for keyword in keywords:
+            kw_norm = self.normalize_text(keyword)
+            kw_tokens = set(kw_norm.split())
+            
+            # 1. Correspondance exacte (keyword complet dans l'input)
+            if kw_norm in input_norm:
+                exact_match = 1.0
+                best_keyword = keyword
+                break
+            
+            # 2. Correspondance partielle (keyword dans l'input)
+            if any(kw_word in input_norm for kw_word in kw_tokens):
+                partial_matches += 1
+                if best_keyword is None:
+                    best_keyword = keyword
+            
+            # 3. Overlap de tokens
+            intersection = input_tokens.intersection(kw_tokens)
+            union = input_tokens.union(kw_tokens)
+            
+            if union:
+                overlap_ratio = len(intersection) / len(union)
+                token_overlap = max(token_overlap, overlap_ratio)
+            
+            # 4. Similarité fuzzy
+            fuzzy_score = self.fuzzy_similarity(input_norm, kw_norm)
+            if fuzzy_score > fuzzy_best:
+                fuzzy_best = fuzzy_score
+                if best_keyword is None and fuzzy_score > 0.6:
+                    best_keyword = keyword
+        
+        # Calcul du score composite
+        urgency_score = URGENCY_SCORE.get(diagnostic.get('urgence', 'faible'), 1)
+        confidence = 0.7 if diagnostic.get('contributeur') == 'système' else 0.85
+        
+        # Pondération des différents critères (voir ScoringConfig)
+        scoring = self.scoring
+        score = (
+            scoring.exact * exact_match +                    # Correspondance exacte (priorité max)
+            scoring.partial * min(partial_matches / len(keywords), 1.0) +  # Correspondances partielles
+            scoring.overlap * token_overlap +                # Overlap de mots
+            scoring.urgency * (urgency_score / 10) +         # Boost selon urgence
+            scoring.fuzzy * fuzzy_best                       # Similarité fuzzy
+        )
+        
+        return {
+            'score': round(score, 3),
+            'matched_keyword': best_keyword,
+            'exact_match': exact_match > 0,
+            'partial_matches': partial_matches,
+            'token_overlap': round(token_overlap, 3),
+            'fuzzy': round(fuzzy_best, 3)
+        }
+    
+    def score_record(self, query, record):
+        """
+        Calcule le score de correspondance à partir d'une requête préparée
+        et d'un diagnostic précompilé (mêmes critères que compute_match_score)
+        """
+        return self.finish_match(query, record, self.lexical_match(query, record))
+    
+    def lexical_match(self, query, record):
+        """Critères lexicaux d'un diagnostic pour une requête préparée (voir lexical_criteria)"""
+        return lexical_criteria(query, record)
+    
+    def finish_match(self, query, record, lexical, with_fuzzy=True):
+        """
+        Ajoute la similarité fuzzy aux critères lexicaux et calcule le score composite.
+        Avec with_fuzzy=False (échéance atteinte), le fuzzy n'est pas calculé : le score
+        provisoire est la borne inférieure du score final et 'fuzzy' vaut None.
+        """
+        exact_index, partial_matches, first_partial, token_overlap = lexical
+        keywords = record.keywords
+        
+        best_keyword = None
+        exact_match = 0
+        limit = len(keywords)
+        if exact_index is not None:
+            exact_match = 1.0
+            best_keyword = keywords[exact_index]
+            limit = exact_index
+        
+        # 4. Similarité fuzzy (sur les mots-clés précédant la correspondance exacte)
+        cap = limit if first_partial is None else first_partial
+        if with_fuzzy:
+            fuzzy_best, first_fuzzy = self.best_fuzzy(query, record, limit, cap)
+        else:
+            fuzzy_best, first_fuzzy = 0, None
+        
+        if best_keyword is None:
+            candidates = [i for i in (first_partial, first_fuzzy) if i is not None]
+            if candidates:
+                best_keyword = keywords[min(candidates)]
+        
+        # Pondération des différents critères
+        scoring = self.scoring
+        score = (
+            scoring.exact * exact_match +
+            scoring.partial * min(partial_matches / len(keywords), 1.0) +
+            scoring.overlap * token_overlap +
+            scoring.urgency * (record.urgency_score / 10) +
+            scoring.fuzzy * fuzzy_best
+        )
+        
+        match_info = {
+            'score': round(score, 3),
+            'matched_keyword': best_keyword,
+            'exact_match': exact_match > 0,
+            'partial_matches': partial_matches,
+            'token_overlap': round(token_overlap, 3),
+            'fuzzy': round(fuzzy_best, 3) if with_fuzzy else None
+        }
+        
+        # Corrections orthographiques portant sur un token des mots-clés de ce diagnostic
+        if query['corrections']:
+            corrections = {token: correction for token, correction in query['corrections'].items()
+                           if any(correction in kw_tokens for kw_tokens in record.keyword_tokens)}
+            if corrections:
+                match_info['corrections'] = corrections
+        return match_info
+    
+    def diagnose(self, user_input, top_n=3, deadline_ms=None):
+        """
+        Fonction principale de diagnostic
+        
+        Args:
+            user_input (str): Description du problème par l'utilisateur
+            top_n (int): Nombre de résultats à retourner
+            deadline_ms (float): Budget de temps en millisecondes (voir diagnose_anytime) ;
+                le résultat porte alors 'partial' (True si l'échéance a interrompu le calcul)
+            
+        Returns:
+            dict: Résultats du diagnostic avec scores et suggestions
+            
+        Avec le cache activé, les résultats d'une même requête normalisée
+        partagent les dictionnaires de top_matches.
+        """
+        
+        started = time.perf_counter()
+        
+        # Une seule lecture du snapshot : toute la requête utilise la même base
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.data.get('diagnostics'):
+            raise Exception("❌ Base de données non chargée ou vide")
+        
+        stopwatch = self.metrics.stopwatch() if self.metrics is not None else None
+        
+        input_norm = self.normalize_text(user_input)
+        if stopwatch is not None:
+            stopwatch.lap('normalize')
+        cache_key = (snapshot.generation, input_norm, top_n)
+        if self.cache is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                if stopwatch is not None:
+                    self.metrics.increment('cache_hits')
+                return dict(cached, input=user_input, top_matches=list(cached['top_matches']))
+        
+        query = snapshot.prepare_query(user_input, input_norm, stopwatch)
+        
+        if deadline_ms is not None:
+            # Résultat dépendant du temps disponible : jamais mis en cache
+            diagnosis, candidates = self.diagnose_anytime(query, top_n, snapshot, started + deadline_ms / 1000)
+            if stopwatch is not None:
+                stopwatch.lap('anytime')
+                self.metrics.record_diagnosis(diagnosis, candidates)
+                if diagnosis['partial']:
+                    self.metrics.increment('partial_results')
+            return diagnosis
+        
+        if self.top_k:
+            diagnosis, candidates = self.diagnose_top_k(query, top_n, snapshot)
+            if stopwatch is not None:
+                stopwatch.lap('top_k')
+                self.metrics.record_diagnosis(diagnosis, candidates)
+        elif stopwatch is None:
+            # Calcul des scores pour les seuls diagnostics candidats
+            scored = [(record, self.score_record(query, record))
+                      for record in snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)]
+            diagnosis = self.build_diagnosis(user_input, scored, top_n, snapshot)
+        else:
+            diagnosis = self.diagnose_profiled(query, top_n, snapshot, stopwatch)
+        
+        if self.cache is not None:
+            self.cache.put(cache_key, diagnosis)
+        return diagnosis
+    
+    def diagnose_anytime(self, query, top_n, snapshot, deadline):
+        """
+        Diagnostic interruptible à l'échéance deadline (time.perf_counter) :
+        
+        1. critères lexicaux (exact, partiels, overlap) de chaque candidat, avec
+           les bornes du score (score_upper_bound) ;
+        2. fuzzy des candidats par borne supérieure décroissante, tant qu'il reste du temps.
+        
+        À l'échéance, les candidats sans fuzzy gardent leur score provisoire (borne
+        inférieure, 'fuzzy' à None) et les candidats sans critères lexicaux sont
+        ignorés : 'partial' vaut True et total_matches_approximate aussi. Terminé
+        à temps, le résultat est identique à diagnose avec 'partial' à False.
+        
+        Retourne (diagnostic, nombre de candidats présélectionnés).
+        """
+        candidates = snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)
+        bounded = []
+        complete = True
+        for count, record in enumerate(candidates):
+            # Au moins un paquet de candidats est toujours noté, même échéance dépassée
+            if count and count % ANYTIME_CHECK_INTERVAL == 0 and time.perf_counter() > deadline:
+                complete = False
+                break
+            lexical = self.lexical_match(query, record)
+            lower, upper = self.score_upper_bound(query, record, lexical)
+            if upper > self.scoring.threshold:
+                bounded.append(((upper, record.urgency_score, -record.position), record, lexical))
+        bounded.sort(key=lambda item: item[0], reverse=True)
+        
+        scored = []
+        for rank, (_, record, lexical) in enumerate(bounded):
+            if time.perf_counter() > deadline:
+                complete = False
+                scored.extend((record, self.finish_match(query, record, lexical, with_fuzzy=False))
+                              for _, record, lexical in bounded[rank:])
+                break
+            scored.append((record, self.finish_match(query, record, lexical)))
+        
+        # build_diagnosis départage les égalités par l'ordre de la base
+        scored.sort(key=lambda item: item[0].position)
+        diagnosis = self.build_diagnosis(query['input'], scored, top_n, snapshot,
+                                         approximate_total=None if complete else True)
+        diagnosis['partial'] = not complete
+        return diagnosis, len(candidates)
+    
+    def diagnose_profiled(self, query, top_n, snapshot, stopwatch):
+        """Chemin de diagnose avec mesure séparée des critères lexicaux et du fuzzy"""
+        candidates = snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)
+        stopwatch.lap('candidates')
+        
+        scored = []
+        lexical_time = fuzzy_time = 0.0
+        for record in candidates:
+            start = time.perf_counter()
+            lexical = self.lexical_match(query, record)
+            middle = time.perf_counter()
+            scored.append((record, self.finish_match(query, record, lexical)))
+            end = time.perf_counter()
+            lexical_time += middle - start
+            fuzzy_time += end - middle
+        self.metrics.observe('lexical', lexical_time)
+        self.metrics.observe('fuzzy', fuzzy_time)
+        stopwatch.last = time.perf_counter()
+        
+        diagnosis = self.build_diagnosis(query['input'], scored, top_n, snapshot)
+        stopwatch.lap('ranking')
+        self.metrics.record_diagnosis(diagnosis, len(candidates))
+        return diagnosis
+    
+    def metrics_snapshot(self):
+        """Mesures par étape et compteurs (None si l'instrumentation est désactivée)"""
+        return self.metrics.snapshot() if self.metrics is not None else None
+    
+    def metrics_text(self):
+        """Mesures au format texte Prometheus (chaîne vide si l'instrumentation est désactivée)"""
+        return self.metrics.prometheus_text() if self.metrics is not None else ""
+    
+    def score_upper_bound(self, query, record, lexical):
+        """
+        Bornes (inférieure, supérieure) du score arrondi d'un diagnostic dont les
+        critères lexicaux sont connus : seul le fuzzy reste à calculer, compris
+        entre 0 et la meilleure borne de longueur des mots-clés qu'il parcourt.
+        """
+        exact_index, partial_matches, first_partial, token_overlap = lexical
+        keywords_norm = record.keywords_norm
+        limit = len(keywords_norm) if exact_index is None else exact_index
+        
+        input_length = len(query['norm'])
+        fuzzy_bound = 0
+        for i in range(limit):
+            fuzzy_bound = max(fuzzy_bound, length_bound(input_length, len(keywords_norm[i])))
+        
+        # Même expression que finish_match : l'arrondi est monotone, les bornes restent valides
+        exact_match = 1.0 if exact_index is not None else 0
+        scoring = self.scoring
+        known = (
+            scoring.exact * exact_match +
+            scoring.partial * min(partial_matches / len(keywords_norm), 1.0) +
+            scoring.overlap * token_overlap +
+            scoring.urgency * (record.urgency_score / 10)
+        )
+        return round(known, 3), round(known + scoring.fuzzy * fuzzy_bound, 3)
+    
+    def passes_threshold(self, query, record, lexical):
+        """
+        Le score d'un diagnostic dont les bornes encadrent le seuil le dépasse-t-il ?
+        En mode "fast" sans tolérance, s'arrête au premier mot-clé suffisant et
+        écarte les autres par la borne sur les caractères communs ; sinon le
+        diagnostic est noté (même fuzzy que diagnose).
+        """
+        threshold = self.scoring.threshold
+        if self.fuzzy_mode != "fast" or self.fuzzy_tolerance:
+            return self.finish_match(query, record, lexical)['score'] > threshold
         
-        input_norm = self.normalize_text(user_input)
-        input_tokens = set(input_norm.split())
+        exact_index, partial_matches, first_partial, token_overlap = lexical
+        keywords_norm = record.keywords_norm
+        limit = len(keywords_norm) if exact_index is None else exact_index
+        input_norm = query['norm']
+        input_chars = query['chars']
+        input_length = len(input_norm)
         
-        best_keyword = None
-        exact_match = 0
-        token_overlap = 0
-        fuzzy_best = 0
-        partial_matches = 0
+        # Score sans fuzzy, mêmes opérations que finish_match (arrondi identique)
+        scoring = self.scoring
+        known = (
+            scoring.exact * (1.0 if exact_index is not None else 0) +
+            scoring.partial * min(partial_matches / len(keywords_norm), 1.0) +
+            scoring.overlap * token_overlap +
+            scoring.urgency * (record.urgency_score / 10)
+        )
+        weight = scoring.fuzzy
+        table = record.table
+        for i in range(limit):
+            kw_norm = keywords_norm[i]
+            kid = record.keyword_ids[i]
+            if round(known + weight * length_bound(input_length, len(kw_norm)), 3) <= threshold or \
+                    round(known + weight * char_bound(input_chars, input_length, table.chars(kid), len(kw_norm)), 3) <= threshold:
+                continue
+            if round(known + weight * sequence_ratio(input_norm, kw_norm, table.b2j(kid)), 3) > threshold:
+                return True
+        return False
+    
+    def diagnose_top_k(self, query, top_n, snapshot):
+        """
+        Diagnostic par sélection des k meilleurs (k = max(top_n, 2) pour que la
+        détection d'ambiguïté reste exacte) : les candidats sont parcourus par borne
+        supérieure décroissante et le fuzzy n'est calculé que tant qu'une borne peut
+        encore battre le k-ième résultat du tas. Les top_matches, la clarification
+        et total_matches sont identiques à diagnose : les diagnostics restants sont
+        comptés par leurs bornes, et ceux dont les bornes de longueur encadrent le
+        seuil par la borne sur les caractères communs, puis notés si elle ne suffit
+        pas à les écarter.
         
-        keywords = diagnostic.get('keywords', [])
+        Retourne (diagnostic, nombre de candidats présélectionnés).
+        """
+        k = max(top_n, 2)
+        candidates = snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)
+        bounded = []
+        for record in candidates:
+            lexical = self.lexical_match(query, record)
+            lower, upper = self.score_upper_bound(query, record, lexical)
+            if upper > self.scoring.threshold:
+                # Clé de classement de build_diagnosis : score, urgence, puis ordre de la base
+                bounded.append(((upper, record.urgency_score, -record.position), lower, record, lexical))
+        bounded.sort(key=lambda item: item[0], reverse=True)
         
-        for keyword in keywords:
-            kw_norm = self.normalize_text(keyword)
-            kw_tokens = set(kw_norm.split())
-            
-            # 1. Correspondance exacte (keyword complet dans l'input)
-            if kw_norm in input_norm:
-                exact_match = 1.0
-                best_keyword = keyword
+        heap = []
+        total_matches = 0
+        threshold = self.scoring.threshold
+        for rank, (bound_key, lower, record, lexical) in enumerate(bounded):
+            if len(heap) == k and bound_key < heap[0][0]:
+                # Plus aucun candidat ne peut entrer dans le top-k : comptage par bornes
+                for _, remaining_lower, remaining, remaining_lexical in bounded[rank:]:
+                    if remaining_lower > threshold:
+                        total_matches += 1
+                    elif self.passes_threshold(query, remaining, remaining_lexical):
+                        total_matches += 1
                 break
             
-            # 2. Correspondance partielle (keyword dans l'input)
-            if any(kw_word in input_norm for kw_word in kw_tokens):
-                partial_matches += 1
-                if best_keyword is None:
-                    best_keyword = keyword
-            
-            # 3. Overlap de tokens
-            intersection = input_tokens.intersection(kw_tokens)
-            union = input_tokens.union(kw_tokens)
-            
-            if union:
-                overlap_ratio = len(intersection) / len(union)
-                token_overlap = max(token_overlap, overlap_ratio)
+            match_info = self.finish_match(query, record, lexical)
+            if match_info['score'] > threshold:
+                total_matches += 1
+                key = (match_info['score'], record.urgency_score, -record.position)
+                if len(heap) < k:
+                    heapq.heappush(heap, (key, record.position, match_info))
+                elif key > heap[0][0]:
+                    heapq.heapreplace(heap, (key, record.position, match_info))
+        
+        # Seuls les k retenus sont construits, dans l'ordre de la base
+        selected = sorted(heap, key=lambda item: item[1])
+        scored = [(snapshot.records[position], match_info) for _, position, match_info in selected]
+        diagnosis = self.build_diagnosis(query['input'], scored, top_n, snapshot, total_matches=total_matches)
+        return diagnosis, len(candidates)
+    
+    def refine(self, session_id, user_input, top_n=3, widen=True):
+        """
+        Diagnostic d'un message dans une conversation. Le premier message est
+        noté sur toute la base ; chaque message suivant est ajouté aux précédents
+        et seuls les diagnostics retenus au tour précédent sont notés à nouveau.
+        Si aucun ne dépasse plus le seuil, ou si un mot-clé exact désigne un
+        diagnostic hors de ces candidats, toute la base est notée (widen). Une
+        session inconnue, expirée ou antérieure à un rechargement de la base
+        repart de zéro.
+        
+        Args:
+            session_id (str): Identifiant de la conversation (None = nouvelle session)
+            user_input (str): Nouveau message de l'utilisateur
+            top_n (int): Nombre de résultats à retourner
+            widen (bool): Noter toute la base si les candidats ne conviennent plus
             
-            # 4. Similarité fuzzy
-            fuzzy_score = self.fuzzy_similarity(input_norm, kw_norm)
-            if fuzzy_score > fuzzy_best:
-                fuzzy_best = fuzzy_score
-                if best_keyword is None and fuzzy_score > 0.6:
-                    best_keyword = keyword
+        Returns:
+            dict: Résultat de diagnose pour les messages cumulés, avec 'session' :
+                id, tour, mode ("initial", "refined" ou "widened"), candidats notés
+                et évolution du score des résultats déjà proposés
+        """
         
-        # Calcul du score composite
-        urgency_score = URGENCY_SCORE.get(diagnostic.get('urgence', 'faible'), 1)
-        confidence = 0.7 if diagnostic.get('contributeur') == 'système' else 0.85
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.data.get('diagnostics'):
+            raise Exception("❌ Base de données non chargée ou vide")
         
-        # Pondération des différents critères
-        score = (
-            0.4 * exact_match +                    # Correspondance exacte (priorité max)
-            0.2 * min(partial_matches / len(keywords), 1.0) +  # Correspondances partielles
-            0.2 * token_overlap +                  # Overlap de mots
-            0.1 * (urgency_score / 10) +          # Boost selon urgence
-            0.1 * fuzzy_best                      # Similarité fuzzy
-        )
+        session_id = session_id or uuid.uuid4().hex
+        session = self.sessions.get(session_id)
+        if session is not None and session.generation != snapshot.generation:
+            session = None
         
-        return {
-            'score': round(score, 3),
-            'matched_keyword': best_keyword,
-            'exact_match': exact_match > 0,
-            'partial_matches': partial_matches,
-            'token_overlap': round(token_overlap, 3),
-            'fuzzy': round(fuzzy_best, 3)
+        stopwatch = self.metrics.stopwatch() if self.metrics is not None else None
+        if session is None:
+            turns, mode = (user_input,), 'initial'
+        else:
+            turns, mode = (session.turns + (user_input,))[-SESSION_MAX_TURNS:], 'refined'
+        text = " ".join(turns)
+        input_norm = self.normalize_text(text)
+        if stopwatch is not None:
+            stopwatch.lap('normalize')
+        query = snapshot.prepare_query(text, input_norm, stopwatch)
+        
+        scored = None
+        if session is not None:
+            records = snapshot.records
+            candidates = set(session.positions)
+            # Un mot-clé exact d'un diagnostic hors candidats désigne une autre piste
+            elsewhere = any(position not in candidates
+                            for kw_norm in query['exact'] for position in snapshot.exact_index.get(kw_norm, ()))
+            if not (widen and elsewhere):
+                scored = [(records[position], self.score_record(query, records[position]))
+                          for position in session.positions]
+            if widen and (scored is None or
+                          not any(match_info['score'] > self.scoring.threshold for _, match_info in scored)):
+                scored, mode = None, 'widened'
+        if scored is None:
+            scored = [(record, self.score_record(query, record))
+                      for record in snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)]
+        if stopwatch is not None:
+            stopwatch.lap('refine')
+        
+        diagnosis = self.build_diagnosis(text, scored, top_n, snapshot)
+        if stopwatch is not None:
+            stopwatch.lap('ranking')
+            self.metrics.record_diagnosis(diagnosis, len(scored))
+        
+        # Diagnostics retenus pour le tour suivant (ordre de la base) ; inchangés si plus rien ne convient
+        retained = [(record.position, match_info['score']) for record, match_info in scored
+                    if match_info['score'] > self.scoring.threshold]
+        if not retained and session is not None:
+            retained = list(zip(session.positions, session.scores))
+        self.sessions.put(session_id, RefinementSession(turns, snapshot.generation,
+                                                        [position for position, _ in retained],
+                                                        [score for _, score in retained]))
+        
+        previous = dict(zip(session.positions, session.scores)) if session is not None else {}
+        diagnosis['session'] = {
+            'id': session_id,
+            'turn': len(turns),
+            'mode': mode,
+            'candidates': len(scored),
+            'score_changes': {
+                result['id']: round(result['score'] - previous[snapshot.compiled[result['id']].position], 3)
+                for result in diagnosis['top_matches']
+                if snapshot.compiled[result['id']].position in previous
+            }
         }
+        return diagnosis
     
-    def diagnose(self, user_input, top_n=3):
+    def end_session(self, session_id):
+        """Termine une conversation de refine"""
+        self.sessions.discard(session_id)
+    
+    def suggest(self, prefix, limit=SUGGEST_LIMIT, state=None):
         """
-        Fonction principale de diagnostic
+        Suggestions d'autocomplétion pour une saisie en cours : mots-clés de la
+        base commençant par le texte tapé (ou, à défaut, par ses derniers mots)
+        et diagnostics correspondants, classés par pertinence.
         
         Args:
-            user_input (str): Description du problème par l'utilisateur
-            top_n (int): Nombre de résultats à retourner
+            prefix (str): Texte en cours de saisie
+            limit (int): Nombre maximal de mots-clés et de diagnostics suggérés
+            state (SuggestState): État de la saisie, mis à jour ; si le nouveau
+                texte prolonge le précédent, la recherche se limite à l'intervalle
+                déjà trouvé
             
         Returns:
-            dict: Résultats du diagnostic avec scores et suggestions
+            dict: {'prefix', 'matched' (partie du texte complétée), 'keywords', 'diagnostics'}
         """
         
-        if not self.data or not self.data.get('diagnostics'):
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.data.get('diagnostics'):
             raise Exception("❌ Base de données non chargée ou vide")
         
+        index = snapshot.suggestion_index
+        if index is None:
+            index = snapshot.suggestion_index = SuggestionIndex(snapshot)
+        
+        # Texte complet d'abord, puis ses derniers mots ("mes freins gri" -> "freins gri" -> "gri")
+        text = self.normalize_text(prefix)
+        words = text.split(' ') if text else []
+        resume = state is not None and state.generation == snapshot.generation and state.prefix is not None
+        matched, low, high = None, 0, 0
+        for start in range(len(words)):
+            tail = ' '.join(words[start:])
+            if not tail.strip():
+                continue
+            if resume and tail.startswith(state.prefix):
+                low, high = index.prefix_range(tail, state.low, state.high)
+            else:
+                low, high = index.prefix_range(tail)
+            if low < high and not index.stale or index.top_keywords(low, high, 1, tail):
+                matched = tail
+                break
+        
+        if state is not None:
+            state.generation = snapshot.generation
+            state.prefix = matched if matched is not None else (text or None)
+            state.low, state.high = low, high
+        
+        keywords = []
+        diagnostics = []
+        seen = set()
+        for kid in (index.top_keywords(low, high, limit, matched) if matched is not None else ()):
+            kw_norm = index.norms[kid]
+            keywords.append({'keyword': index.display[kid], 'norm': kw_norm, 'diagnostics': index.counts[kid]})
+            
+            # Diagnostics du mot-clé : les plus urgents d'abord, puis ordre de la base
+            records = sorted((snapshot.records[position] for position in snapshot.exact_index[kw_norm]),
+                             key=lambda record: (-record.urgency_score, record.position))
+            for record in records:
+                if len(diagnostics) < limit and record.id not in seen:
+                    seen.add(record.id)
+                    diagnostics.append({
+                        'id': record.id,
+                        'titre': record.data['titre'],
+                        'urgence': record.data['urgence'],
+                        'keyword': index.display[kid]
+                    })
+        
+        return {'prefix': prefix, 'matched': matched, 'keywords': keywords, 'diagnostics': diagnostics}
+    
+    def cache_stats(self):
+        """Compteurs du cache de résultats (None si le cache est désactivé)"""
+        return self.cache.stats() if self.cache is not None else None
+    
+    def build_diagnosis(self, user_input, scored, top_n, snapshot=None, total_matches=None, approximate_total=None):
+        """
+        Construit le résultat de diagnostic à partir des couples (diagnostic, score) dans l'ordre de la base.
+        total_matches remplace le comptage quand scored ne contient qu'un top-k ;
+        approximate_total signale un total incomplet (échéance de diagnose_anytime).
+        """
+        
+        snapshot = snapshot or self.snapshot
+        
+        # Tri par score décroissant, puis par urgence (tri stable : ordre de la base à égalité)
+        ranked = [(record, match_info) for record, match_info in scored
+                  if match_info['score'] > self.scoring.threshold]  # Seuil minimum de pertinence
+        ranked.sort(key=lambda item: (item[1]['score'], item[0].urgency_score), reverse=True)
+        
+        # Dictionnaires de résultat construits pour les seuls top_n retournés
         results = []
-        diagnostics = self.data['diagnostics']
-        
-        # Calcul des scores pour chaque diagnostic
-        for diag_id, diag_data in diagnostics.items():
-            match_info = self.compute_match_score(user_input, diag_data)
-            
-            if match_info['score'] > 0.1:  # Seuil minimum de pertinence
-                results.append({
-                    'id': diag_id,
-                    'titre': diag_data['titre'],
-                    'score': match_info['score'],
-                    'urgence': diag_data['urgence'],
-                    'urgence_score': URGENCY_SCORE.get(diag_data['urgence'], 1),
-                    'matched_keyword': match_info['matched_keyword'],
-                    'causes': diag_data.get('causes', []),
-                    'solutions': diag_data.get('solutions', []),
-                    'cout_estime': diag_data.get('cout_estime', 'N/A'),
-                    'contributeur': diag_data.get('contributeur', 'inconnu'),
-                    'details': match_info
-                })
-        
-        # Tri par score décroissant, puis par urgence
-        results.sort(key=lambda x: (x['score'], x['urgence_score']), reverse=True)
+        for record, match_info in ranked[:top_n]:
+            diag_data = record.data
+            results.append({
+                'id': record.id,
+                'titre': diag_data['titre'],
+                'score': match_info['score'],
+                'urgence': diag_data['urgence'],
+                'urgence_score': URGENCY_SCORE.get(diag_data['urgence'], 1),
+                'matched_keyword': match_info['matched_keyword'],
+                'causes': diag_data.get('causes', []),
+                'solutions': diag_data.get('solutions', []),
+                'cout_estime': diag_data.get('cout_estime', 'N/A'),
+                'contributeur': diag_data.get('contributeur', 'inconnu'),
+                'details': match_info
+            })
         
         # Détection d'ambiguïté
         clarification = None
-        if len(results) >= 2:
-            delta_score = results[0]['score'] - results[1]['score']
-            if delta_score < 0.15 and results[0]['score'] > 0.4:
-                clarification = (
-                    f"🤔 Symptômes ambigus entre '{results[0]['titre']}' et '{results[1]['titre']}'. "
-                    f"Pouvez-vous préciser : s'agit-il plutôt de {results[0]['titre'].lower()} "
-                    f"ou de {results[1]['titre'].lower()} ?"
-                )
+        if len(ranked) >= 2:
+            (first, first_match), (second, second_match) = ranked[0], ranked[1]
+            clarification = self.scoring.clarification(first.data['titre'], first_match['score'],
+                                                       second.data['titre'], second_match['score'])
         
-        return {
+        diagnosis = {
             'input': user_input,
-            'total_matches': len(results),
-            'top_matches': results[:top_n],
+            'total_matches': len(ranked) if total_matches is None else total_matches,
+            'top_matches': results,
             'clarification': clarification,
-            'confidence': results[0]['score'] if results else 0,
-            'database_version': self.data.get('version', 'inconnue')
+            'confidence': ranked[0][1]['score'] if ranked else 0,
+            'database_version': snapshot.data.get('version', 'inconnue')
         }
+        if approximate_total is not None:
+            diagnosis['total_matches_approximate'] = approximate_total
+        return diagnosis
+    
+    def diagnose_many(self, queries, top_n=3, chunk_size=1024):
+        """
+        Diagnostic d'un lot de requêtes : les critères lexicaux de tout le lot sont
+        calculés par produits de matrices creuses (numpy), le fuzzy et le score final
+        réutilisent le chemin de diagnose. Les requêtes identiques après normalisation
+        ne sont calculées qu'une fois (leurs résultats partagent top_matches).
+        Retourne la liste des résultats, dans l'ordre des requêtes, identiques à
+        ceux de diagnose.
+        
+        Args:
+            queries (list): Descriptions de problèmes
+            top_n (int): Nombre de résultats par requête
+            chunk_size (int): Nombre de requêtes traitées par passe (mémoire bornée)
+        """
+        
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.data.get('diagnostics'):
+            raise Exception("❌ Base de données non chargée ou vide")
+        
+        if np is None:
+            return [self.diagnose(user_input, top_n) for user_input in queries]
+        
+        if snapshot.batch_index is None:
+            snapshot.build_batch_index()
+        
+        queries = list(queries)
+        no_match = (None, 0, None, 0)
+        diagnoses = []
+        start = time.perf_counter()
+        
+        for chunk_start in range(0, len(queries), chunk_size):
+            chunk = queries[chunk_start:chunk_start + chunk_size]
+            
+            # Les requêtes identiques après normalisation ne sont calculées qu'une fois
+            norms = [self.normalize_text(user_input) for user_input in chunk]
+            prepared = {}
+            for user_input, input_norm in zip(chunk, norms):
+                if input_norm not in prepared:
+                    prepared[input_norm] = snapshot.prepare_query(user_input, input_norm)
+            unique = list(prepared.values())
+            lexical = snapshot.batch_lexical_matches(unique)
+            
+            by_norm = {}
+            for q, (input_norm, query) in enumerate(prepared.items()):
+                scored = [
+                    (record, self.finish_match(query, record, lexical.get((q, record.position), no_match)))
+                    for record in snapshot.find_candidates(query, self.scoring, self.fuzzy_candidates)
+                ]
+                by_norm[input_norm] = self.build_diagnosis(query['input'], scored, top_n, snapshot)
+                if self.metrics is not None:
+                    self.metrics.record_diagnosis(by_norm[input_norm], len(scored))
+            
+            for user_input, input_norm in zip(chunk, norms):
+                diagnosis = by_norm[input_norm]
+                diagnoses.append(diagnosis if diagnosis['input'] == user_input else dict(diagnosis, input=user_input))
+        
+        if self.metrics is not None:
+            self.metrics.observe('batch', time.perf_counter() - start)
+        return diagnoses
     
     def format_response(self, diagnosis_result):
         """Formate la réponse de diagnostic de façon lisible"""
+        if self.metrics is None:
+            return self.render_response(diagnosis_result)
+        start = time.perf_counter()
+        response = self.render_response(diagnosis_result)
+        self.metrics.observe('format', time.perf_counter() - start)
+        return response
+    
+    def render_response(self, diagnosis_result):
+        """Texte de format_response (sans instrumentation)"""
+        return render_diagnosis(diagnosis_result, self.response_fragments)
+    
+    def format_json(self, diagnosis_result, prefix=None, suffix=None):
+        """
+        JSON compact d'un résultat (une ligne), assemblé depuis les fragments
+        pré-rendus des diagnostics ; prefix et suffix ajoutent des champs avant/après
+        """
+        if self.metrics is None:
+            return render_diagnosis_json(diagnosis_result, self.response_fragments, prefix, suffix)
+        start = time.perf_counter()
+        response = render_diagnosis_json(diagnosis_result, self.response_fragments, prefix, suffix)
+        self.metrics.observe('format', time.perf_counter() - start)
+        return response
+    
+    def response_fragments(self, result):
+        """Fragments pré-rendus du diagnostic d'un résultat (None s'il ne vient pas de la base en service)"""
+        snapshot = self.snapshot
+        record = snapshot.compiled.get(result.get('id')) if snapshot is not None else None
+        if record is None or record.data is None:
+            return None
+        fragments = record.response_fragments()
+        return fragments if fragments.causes is result.get('causes') else None
+
+def render_match_details(result):
+    """Lignes fixes d'un diagnostic dans format_response : coût, causes et solutions (3 max)"""
+    lines = [f"   💰 Coût estimé: {result['cout_estime']}"]
+    
+    # Causes principales (max 3)
+    if result['causes']:
+        lines.append("   🧩 **Causes possibles:**")
+        for cause in result['causes'][:3]:
+            lines.append(f"      • {cause}")
+    
+    # Solutions prioritaires (max 3)
+    if result['solutions']:
+        lines.append("   🔧 **Solutions recommandées:**")
+        for solution in result['solutions'][:3]:
+            # Highlighting des solutions urgentes
+            if any(urgent in solution.lower() for urgent in URGENT_SOLUTION_WORDS):
+                lines.append(f"      🚨 {solution}")
+            else:
+                lines.append(f"      • {solution}")
+    
+    return "\n".join(lines)
+
+class ResponseFragments:
+    """
+    Parties fixes de la réponse d'un diagnostic, rendues une seule fois : bloc
+    texte de format_response (solutions urgentes signalées) et morceaux JSON
+    compacts du résultat. causes référence la liste des données d'origine pour
+    vérifier qu'un résultat provient bien de ce diagnostic.
+    """
+    
+    __slots__ = ('causes', 'text', 'titre_json', 'urgence_json', 'tail_json', 'keyword_json')
+    
+    def __init__(self, diagnostic):
+        result = {
+            'urgence': diagnostic['urgence'],
+            'urgence_score': URGENCY_SCORE.get(diagnostic['urgence'], 1),
+            'causes': diagnostic.get('causes', []),
+            'solutions': diagnostic.get('solutions', []),
+            'cout_estime': diagnostic.get('cout_estime', 'N/A'),
+            'contributeur': diagnostic.get('contributeur', 'inconnu')
+        }
+        self.causes = diagnostic.get('causes')
+        self.text = render_match_details(result)
+        self.titre_json = compact_json(diagnostic['titre'])
+        self.urgence_json = compact_json(dict(list(result.items())[:2]))[1:-1]
+        self.tail_json = compact_json(dict(list(result.items())[2:]))[1:-1]
+        self.keyword_json = {None: 'null'}
+    
+    def keyword(self, keyword):
+        """JSON d'un mot-clé du diagnostic (mis en cache)"""
+        encoded = self.keyword_json.get(keyword)
+        if encoded is None:
+            encoded = self.keyword_json[keyword] = compact_json(keyword)
+        return encoded
+
+# Encodeur partagé : json.dumps avec options recrée un encodeur à chaque appel
+_compact_encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+
+def compact_json(value):
+    """JSON compact sur une ligne (séparateurs sans espace, accents conservés)"""
+    return _compact_encoder.encode(value)
+
+def _scalar_json(value):
+    """JSON d'un booléen, entier ou flottant fini (même texte que json.dumps)"""
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    return repr(value)
+
+def render_match_json(result, fragments=None):
+    """JSON compact d'un résultat de top_matches, assemblé depuis ses fragments si disponibles"""
+    if fragments is None or tuple(result) != RESULT_KEYS:
+        return compact_json(result)
+    
+    details = result['details']
+    keyword = fragments.keyword(result['matched_keyword'])
+    score, partial, overlap, fuzzy = details.get('score'), details.get('partial_matches'), \
+        details.get('token_overlap'), details.get('fuzzy')
+    # Types exacts seulement : repr d'un flottant numpy n'est pas du JSON
+    if (tuple(details) == DETAIL_KEYS and details['matched_keyword'] == result['matched_keyword']
+            and type(details['exact_match']) is bool and type(score) is float and type(partial) is int
+            and type(overlap) in (int, float) and type(fuzzy) in (int, float)):
+        details_json = (f'{{"score":{score!r},"matched_keyword":{keyword},'
+                        f'"exact_match":{_scalar_json(details["exact_match"])},'
+                        f'"partial_matches":{partial!r},"token_overlap":{overlap!r},"fuzzy":{fuzzy!r}}}')
+    else:
+        details_json = compact_json(details)
+    
+    score = result['score']
+    score_json = repr(score) if type(score) is float else compact_json(score)
+    return (f'{{"id":{compact_json(result["id"])},"titre":{fragments.titre_json},'
+            f'"score":{score_json},{fragments.urgence_json},'
+            f'"matched_keyword":{keyword},{fragments.tail_json},"details":{details_json}}}')
+
+def render_diagnosis_json(diagnosis_result, fragment=None, prefix=None, suffix=None):
+    """
+    JSON compact d'un résultat de diagnostic, identique à
+    json.dumps({**prefix, **diagnosis_result, **suffix}, ensure_ascii=False, separators=(',', ':')) ;
+    fragment(result) retourne les ResponseFragments d'un résultat (ou None)
+    """
+    document = {**(prefix or {}), **diagnosis_result, **(suffix or {})}
+    matches = document.get('top_matches')
+    if not isinstance(matches, list) or not matches:
+        return compact_json(document)
+    
+    # Un seul encodage pour le reste du document : une chaîne JSON ne peut pas
+    # contenir "top_matches":[] sans échappement, le marqueur est donc unique
+    document['top_matches'] = []
+    encoded = compact_json(document)
+    rendered = ",".join(render_match_json(result, fragment(result) if fragment else None) for result in matches)
+    return encoded.replace('"top_matches":[]', f'"top_matches":[{rendered}]', 1)
+
+def render_diagnosis(diagnosis_result, fragment=None):
+    """
+    Texte lisible d'un résultat de diagnostic (format_response, sans instrumentation) ;
+    fragment(result) retourne les ResponseFragments d'un résultat (ou None)
+    """
+    
+    if not diagnosis_result['top_matches']:
+        return f"❓ Désolé, aucun diagnostic trouvé pour : '{diagnosis_result['input']}'\n💡 Essayez avec d'autres mots-clés ou soyez plus spécifique."
+    
+    response = []
+    response.append(f"🤖 **BotIA - Diagnostic pour :** '{diagnosis_result['input']}'")
+    total = f"≥ {diagnosis_result['total_matches']}" if diagnosis_result.get('total_matches_approximate') else diagnosis_result['total_matches']
+    response.append(f"📊 **Confiance :** {diagnosis_result['confidence']:.1%} | **Correspondances :** {total}")
+    if diagnosis_result.get('partial'):
+        response.append("⏱️ Résultat partiel : temps de réponse maximal atteint, scores provisoires")
+    response.append("")
+    
+    for i, result in enumerate(diagnosis_result['top_matches'], 1):
+        icon = URGENCY_ICONS.get(result['urgence'], '🔧')
         
-        if not diagnosis_result['top_matches']:
-            return f"❓ Désolé, aucun diagnostic trouvé pour : '{diagnosis_result['input']}'\n💡 Essayez avec d'autres mots-clés ou soyez plus spécifique."
+        response.append(f"**{i}. {icon} {result['titre']}**")
+        response.append(f"   📈 Score: {result['score']:.3f} | 🚨 Urgence: {result['urgence']} | 🔍 Mot-clé: '{result['matched_keyword']}'")
         
-        response = []
-        response.append(f"🤖 **BotIA - Diagnostic pour :** '{diagnosis_result['input']}'")
-        response.append(f"📊 **Confiance :** {diagnosis_result['confidence']:.1%} | **Correspondances :** {diagnosis_result['total_matches']}")
+        # Coût, causes et solutions : bloc pré-rendu du diagnostic si disponible
+        fragments = fragment(result) if fragment else None
+        response.append(fragments.text if fragments is not None else render_match_details(result))
+        
+        response.append("")
+    
+    # Clarification si nécessaire
+    if diagnosis_result['clarification']:
+        response.append(f"💬 **Besoin de clarification:**")
+        response.append(f"   {diagnosis_result['clarification']}")
         response.append("")
+    
+    # Statistiques de debug (optionnel)
+    if diagnosis_result['top_matches']:
+        best = diagnosis_result['top_matches'][0]
+        details = best['details']
+        response.append(f"🔍 **Détails matching:** Exact={details['exact_match']}, Partiels={details['partial_matches']}, Tokens={details['token_overlap']}, Fuzzy={details['fuzzy']}")
+        if details.get('corrections'):
+            corrections = ", ".join(f"{token} → {correction}" for token, correction in details['corrections'].items())
+            response.append(f"✏️ **Corrections:** {corrections}")
+    
+    return "\n".join(response)
+
+def _shard_worker(connection, shard_path, engine_options):
+    """
+    Processus d'un shard : charge sa partition puis répond aux requêtes reçues
+    sur la connexion jusqu'au message None
+    """
+    try:
+        engine = BotIADiagnosticEngine(shard_path, **engine_options)
+    except Exception as e:
+        connection.send(('error', str(e)))
+        return
+    connection.send(('ready', len(engine.records)))
+    
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
         
-        for i, result in enumerate(diagnosis_result['top_matches'], 1):
-            icon = URGENCY_ICONS.get(result['urgence'], '🔧')
-            
-            response.append(f"**{i}. {icon} {result['titre']}**")
-            response.append(f"   📈 Score: {result['score']:.3f} | 🚨 Urgence: {result['urgence']} | 🔍 Mot-clé: '{result['matched_keyword']}'")
-            response.append(f"   💰 Coût estimé: {result['cout_estime']}")
-            
-            # Causes principales (max 3)
-            if result['causes']:
-                response.append("   🧩 **Causes possibles:**")
-                for cause in result['causes'][:3]:
-                    response.append(f"      • {cause}")
-            
-            # Solutions prioritaires (max 3)
-            if result['solutions']:
-                response.append("   🔧 **Solutions recommandées:**")
-                for solution in result['solutions'][:3]:
-                    # Highlighting des solutions urgentes
-                    if any(urgent in solution.lower() for urgent in ['arrêt', 'immédiat', 'urgence']):
-                        response.append(f"      🚨 {solution}")
-                    else:
-                        response.append(f"      • {solution}")
+        command, queries, top_n = message
+        try:
+            if command == 'diagnose':
+                user_input, deadline_ms = queries
+                reply = engine.diagnose(user_input, top_n, deadline_ms)
+            else:
+                reply = engine.diagnose_many(queries, top_n)
+            connection.send(('ok', reply))
+        except Exception as e:
+            connection.send(('error', str(e)))
+    connection.close()
+
+class ShardedDiagnosticEngine:
+    """
+    Moteur réparti : les diagnostics sont distribués (à tour de rôle) entre N
+    processus, chaque requête est envoyée à tous les shards en parallèle puis
+    leurs k meilleurs résultats (k = max(top_n, 2)) sont fusionnés par score,
+    urgence et position dans la base complète. Le résultat est identique à
+    celui de BotIADiagnosticEngine.diagnose : total_matches est la somme des
+    shards et la clarification est calculée sur les deux meilleurs globaux.
+    """
+    
+    def __init__(self, database_path=None, shards=None, **engine_options):
+        """
+        Args:
+            database_path (str): Chemin du fichier JSON (détection automatique si None)
+            shards (int): Nombre de processus (défaut: nombre de CPU)
+            **engine_options: options de BotIADiagnosticEngine appliquées à chaque shard
+        """
+        if database_path is None:
+            database_path = BotIADiagnosticEngine.find_database_path()
+        try:
+            with open(database_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            raise Exception(f"❌ Base de données non trouvée: {database_path}")
+        except json.JSONDecodeError as e:
+            raise Exception(f"❌ Erreur de format JSON: {e}")
+        
+        # Modifications du journal non compactées (voir BotIADiagnosticEngine.put_diagnostic)
+        delta_log_path = engine_options.pop('delta_log_path', None) or f"{database_path}.delta.jsonl"
+        diagnostics = apply_delta_log(data.get('diagnostics', {}), read_delta_log(delta_log_path))
+        if not diagnostics:
+            raise Exception("❌ Base de données non chargée ou vide")
+        
+        self.database_path = database_path
+        self.database_version = data.get('version', 'inconnue')
+        self.positions = {diag_id: position for position, diag_id in enumerate(diagnostics)}
+        self.shard_count = max(1, min(shards or os.cpu_count() or 1, len(diagnostics)))
+        self.lock = threading.Lock()
+        self.connections = []
+        self.processes = []
+        
+        # Configuration lue une seule fois, transmise telle quelle aux shards
+        self.scoring = ScoringConfig.coerce(engine_options.get('scoring'))
+        engine_options = dict(engine_options, use_snapshot=False, scoring=self.scoring)
+        engine_options.pop('snapshot_path', None)
+        
+        # Une partition par shard, écrite dans un répertoire temporaire le temps du chargement
+        with tempfile.TemporaryDirectory(prefix="botia-shards-") as workdir:
+            partitions = [dict(data, diagnostics={}) for _ in range(self.shard_count)]
+            for position, (diag_id, diagnostic) in enumerate(diagnostics.items()):
+                partitions[position % self.shard_count]['diagnostics'][diag_id] = diagnostic
             
-            response.append("")
+            try:
+                for shard, partition in enumerate(partitions):
+                    shard_path = os.path.join(workdir, f"shard_{shard}.json")
+                    with open(shard_path, 'w', encoding='utf-8') as f:
+                        json.dump(partition, f, ensure_ascii=False)
+                    parent_end, child_end = multiprocessing.Pipe()
+                    process = multiprocessing.Process(target=_shard_worker, name=f"botia-shard-{shard}",
+                                                      args=(child_end, shard_path, engine_options), daemon=True)
+                    process.start()
+                    child_end.close()
+                    self.connections.append(parent_end)
+                    self.processes.append(process)
+                del partitions, data, diagnostics
+                
+                # Les shards chargent leur partition en parallèle
+                for shard, connection in enumerate(self.connections):
+                    status, value = self._receive(connection)
+                    if status != 'ready':
+                        raise Exception(f"❌ Shard {shard} non chargé: {value}")
+            except BaseException:
+                self.close()
+                raise
+        
+        print(f"✅ {self.shard_count} shards BotIA prêts ({len(self.positions)} diagnostics)", file=sys.stderr)
+    
+    def _receive(self, connection):
+        try:
+            return connection.recv()
+        except EOFError:
+            return ('error', "processus arrêté")
+    
+    def _scatter(self, command, payload, top_n):
+        """Envoie la même requête à tous les shards puis collecte leurs réponses"""
+        if not self.connections:
+            raise Exception("❌ Moteur réparti fermé")
+        with self.lock:
+            for connection in self.connections:
+                connection.send((command, payload, top_n))
+            replies = [self._receive(connection) for connection in self.connections]
+        
+        for shard, (status, value) in enumerate(replies):
+            if status != 'ok':
+                raise Exception(f"❌ Shard {shard} en échec: {value}")
+        return [value for _, value in replies]
+    
+    def merge(self, user_input, partials, top_n):
+        """Fusionne les diagnostics partiels des shards en un diagnostic global"""
+        positions = self.positions
+        ranked = [match for partial in partials for match in partial['top_matches']]
+        ranked.sort(key=lambda match: (-match['score'], -match['urgence_score'], positions[match['id']]))
+        
+        clarification = None
+        if len(ranked) >= 2:
+            first, second = ranked[0], ranked[1]
+            clarification = self.scoring.clarification(first['titre'], first['score'], second['titre'], second['score'])
+        
+        diagnosis = {
+            'input': user_input,
+            'total_matches': sum(partial['total_matches'] for partial in partials),
+            'top_matches': ranked[:top_n],
+            'clarification': clarification,
+            'confidence': ranked[0]['score'] if ranked else 0,
+            'database_version': self.database_version
+        }
+        approximate = [partial['total_matches_approximate'] for partial in partials
+                       if 'total_matches_approximate' in partial]
+        if approximate:
+            diagnosis['total_matches_approximate'] = any(approximate)
+        if any('partial' in partial for partial in partials):
+            diagnosis['partial'] = any(partial.get('partial') for partial in partials)
+        return diagnosis
+    
+    def diagnose(self, user_input, top_n=3, deadline_ms=None):
+        """
+        Diagnostic réparti, même résultat que BotIADiagnosticEngine.diagnose ;
+        deadline_ms s'applique à chaque shard à réception de la requête
+        """
+        partials = self._scatter('diagnose', (user_input, deadline_ms), max(top_n, 2))
+        return self.merge(user_input, partials, top_n)
+    
+    def diagnose_many(self, queries, top_n=3):
+        """Lot de requêtes : un seul aller-retour par shard (diagnose_many dans chaque shard)"""
+        queries = list(queries)
+        per_shard = self._scatter('diagnose_many', queries, max(top_n, 2))
+        return [self.merge(user_input, partials, top_n) for user_input, partials in zip(queries, zip(*per_shard))]
+    
+    def format_response(self, diagnosis_result):
+        """Formate la réponse de diagnostic de façon lisible"""
+        return render_diagnosis(diagnosis_result)
+    
+    def format_json(self, diagnosis_result, prefix=None, suffix=None):
+        """JSON compact d'un résultat (une ligne)"""
+        return render_diagnosis_json(diagnosis_result, None, prefix, suffix)
+    
+    def metrics_text(self):
+        """Pas d'instrumentation agrégée entre shards"""
+        return ""
+    
+    def close(self):
+        """Arrête les processus des shards"""
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self.connections:
+            connection.close()
+        self.connections = []
+        self.processes = []
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def handle_socket_request(engine, request, top_n=3, suggest_state=None):
+    """
+    Traite une requête du mode --serve : {"query": "...", "top": 3, "result": false}.
+    Retourne {"response": texte de format_response} (+ "result" si demandé) ou {"error": "..."}.
+    {"metrics": true} retourne les mesures au format Prometheus (serveur lancé avec --profile).
+    Avec "session", la requête raffine la conversation correspondante (voir refine) ;
+    avec "deadline_ms", le diagnostic respecte ce budget de temps (résultat éventuellement partiel).
+    {"suggest": "fre", "limit": 8} retourne {"suggestions": ...} (voir suggest) ; suggest_state
+    garde la saisie d'une connexion d'une requête à l'autre.
+    """
+    if isinstance(request, str):
+        request = {'query': request}
+    if isinstance(request, dict) and request.get('metrics'):
+        return {'metrics': engine.metrics_text()}
+    if isinstance(request, dict) and isinstance(request.get('suggest'), str):
+        try:
+            return {'suggestions': engine.suggest(request['suggest'], int(request.get('limit', SUGGEST_LIMIT)), suggest_state)}
+        except Exception as e:
+            return {'error': f"❌ Erreur de suggestion: {e}"}
+    if not isinstance(request, dict) or not isinstance(request.get('query'), str):
+        return {'error': '❌ Requête invalide : champ "query" (texte) attendu'}
+    
+    try:
+        if request.get('session') is not None:
+            result = engine.refine(str(request['session']), request['query'], int(request.get('top', top_n)))
+        elif request.get('deadline_ms') is not None:
+            result = engine.diagnose(request['query'], int(request.get('top', top_n)), float(request['deadline_ms']))
+        else:
+            result = engine.diagnose(request['query'], int(request.get('top', top_n)))
+    except Exception as e:
+        return {'error': f"❌ Erreur de diagnostic: {e}"}
+    
+    reply = {'response': engine.format_response(result)}
+    if request.get('result'):
+        reply['result'] = result
+    return reply
+
+class DiagnosisRequestHandler(socketserver.StreamRequestHandler):
+    """Connexion d'un client : une requête JSON par ligne, une réponse JSON par ligne"""
+    
+    def handle(self):
+        suggest_state = SuggestState()  # Saisie en cours propre à la connexion
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                reply = {'error': '❌ JSON invalide'}
+            else:
+                reply = handle_socket_request(self.server.engine, request, self.server.top_n, suggest_state)
+            self.wfile.write(json.dumps(reply, ensure_ascii=False).encode('utf-8') + b"\n")
+            self.wfile.flush()
+
+class DiagnosisSocketServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Serveur local (socket Unix) gardant un moteur chargé entre les requêtes"""
+    
+    daemon_threads = True
+    
+    def __init__(self, engine, socket_path=None, top_n=3):
+        self.engine = engine
+        self.top_n = top_n
+        self.socket_path = socket_path or DEFAULT_SOCKET_PATH
+        self.remove_stale_socket()
+        super().__init__(self.socket_path, DiagnosisRequestHandler)
+        os.chmod(self.socket_path, 0o600)  # Réservé à l'utilisateur courant
+    
+    def remove_stale_socket(self):
+        """Supprime le fichier socket laissé par un serveur arrêté ; refuse si un serveur répond"""
+        if not os.path.exists(self.socket_path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.socket_path)
+        except OSError:
+            os.unlink(self.socket_path)
+        else:
+            raise Exception(f"❌ Un serveur BotIA écoute déjà sur {self.socket_path}")
+        finally:
+            probe.close()
+    
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+
+def serve(engine, socket_path=None, top_n=3):
+    """Mode --serve : répond aux clients jusqu'à SIGTERM ou Ctrl+C"""
+    server = DiagnosisSocketServer(engine, socket_path, top_n)
+    
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+    
+    print(f"🔌 Serveur BotIA à l'écoute sur {server.socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("👋 Serveur arrêté")
+
+# Moteur propre à chaque processus du mode batch (construit une seule fois par processus)
+_batch_engine = None
+
+def _init_batch_worker(engine_options):
+    """Initialise le moteur d'un processus de travail du mode batch"""
+    global _batch_engine
+    _batch_engine = BotIADiagnosticEngine(**engine_options)
+
+def iter_batch_lines(stream):
+    """Lit un flux JSONL ligne par ligne : (numéro de ligne, texte), lignes vides ignorées"""
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if line:
+            yield line_no, line
+
+def parse_batch_line(text):
+    """
+    Extrait la requête d'une ligne du mode batch : objet JSON avec un champ
+    "query" (et "id" optionnel), chaîne JSON, ou texte brut
+    """
+    try:
+        item = json.loads(text)
+    except json.JSONDecodeError:
+        return {}, text
+    
+    if isinstance(item, str):
+        return {}, item
+    if isinstance(item, dict) and isinstance(item.get('query'), str):
+        return ({'id': item['id']} if 'id' in item else {}), item['query']
+    raise ValueError("ligne sans champ 'query' textuel")
+
+def diagnose_batch_chunk(chunk, top_n, engine=None):
+    """Diagnostique un paquet de lignes (numéro, texte) et retourne les lignes JSONL produites"""
+    engine = engine or _batch_engine
+    outputs = {}
+    pending = []
+    
+    for line_no, text in chunk:
+        try:
+            meta, query = parse_batch_line(text)
+            pending.append((line_no, meta, query))
+        except ValueError as e:
+            outputs[line_no] = {'line': line_no, 'error': str(e)}
+    
+    diagnoses = engine.diagnose_many([query for _, _, query in pending], top_n)
+    for (line_no, meta, _), diagnosis in zip(pending, diagnoses):
+        # Ligne assemblée depuis les fragments JSON pré-rendus des diagnostics
+        outputs[line_no] = engine.format_json(diagnosis, prefix={'line': line_no, **meta})
+    
+    return [output if isinstance(output, str) else compact_json(output) for _, output in sorted(outputs.items())]
+
+def run_batch(source, top_n=3, workers=1, ordered=False, engine_options=None, chunk_size=32, output=None):
+    """
+    Mode batch : lit les requêtes en flux (fichier JSONL ou '-' pour stdin) et
+    écrit un résultat JSON par ligne dès qu'un paquet est terminé.
+    
+    Le nombre de paquets en cours est borné (2 par processus), la mémoire reste
+    donc constante quelle que soit la taille de l'entrée. Avec ordered=True, les
+    résultats sont écrits dans l'ordre des lignes d'entrée.
+    
+    Returns:
+        int: Nombre de lignes traitées
+    """
+    engine_options = engine_options or {}
+    output = output or sys.stdout
+    stream = sys.stdin if source == '-' else open(source, 'r', encoding='utf-8')
+    processed = 0
+    
+    def emit(lines):
+        nonlocal processed
+        for line in lines:
+            output.write(line + "\n")
+        output.flush()
+        processed += len(lines)
+    
+    try:
+        lines = iter_batch_lines(stream)
+        chunks = iter(lambda: list(islice(lines, chunk_size)), [])
         
-        # Clarification si nécessaire
-        if diagnosis_result['clarification']:
-            response.append(f"💬 **Besoin de clarification:**")
-            response.append(f"   {diagnosis_result['clarification']}")
-            response.append("")
+        if workers <= 1:
+            engine = BotIADiagnosticEngine(**engine_options)
+            for chunk in chunks:
+                emit(diagnose_batch_chunk(chunk, top_n, engine))
+            return processed
         
-        # Statistiques de debug (optionnel)
-        if diagnosis_result['top_matches']:
-            best = diagnosis_result['top_matches'][0]
-            details = best['details']
-            response.append(f"🔍 **Détails matching:** Exact={details['exact_match']}, Partiels={details['partial_matches']}, Tokens={details['token_overlap']}, Fuzzy={details['fuzzy']}")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(engine_options,)) as pool:
+            max_pending = workers * 2
+            if ordered:
+                pending = deque()
+                for chunk in chunks:
+                    pending.append(pool.submit(diagnose_batch_chunk, chunk, top_n))
+                    if len(pending) >= max_pending:
+                        emit(pending.popleft().result())
+                while pending:
+                    emit(pending.popleft().result())
+            else:
+                pending = set()
+                for chunk in chunks:
+                    pending.add(pool.submit(diagnose_batch_chunk, chunk, top_n))
+                    if len(pending) >= max_pending:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            emit(future.result())
+                for future in pending:
+                    emit(future.result())
         
-        return "\n".join(response)
+        return processed
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+
+def compile_main(argv):
+    """Sous-commande compile : écrit le snapshot binaire de la base"""
+    
+    parser = argparse.ArgumentParser(prog='diagnostic_engine.py compile',
+                                     description='Compile la base JSON en snapshot binaire (ouverture par mmap)')
+    parser.add_argument('--database', '-d', help='Chemin vers la base de données JSON')
+    parser.add_argument('--output', '-o', help='Fichier snapshot (défaut: <base>.snapshot)')
+    args = parser.parse_args(argv)
+    
+    try:
+        engine = BotIADiagnosticEngine(args.database, use_snapshot=False)
+        path = engine.compile_snapshot(args.output)
+        print(f"✅ Snapshot compilé: {path} ({os.path.getsize(path) / 1024:.0f} Ko, format {SNAPSHOT_FORMAT})")
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        sys.exit(1)
 
 def main():
     """Fonction principale avec interface en ligne de commande"""
     
+    if sys.argv[1:2] == ['compile']:
+        return compile_main(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(description='BotIA - Moteur de Diagnostic Automobile')
     parser.add_argument('query', nargs='?', help='Description du problème automobile')
     parser.add_argument('--interactive', '-i', action='store_true', help='Mode interactif')
+    parser.add_argument('--refine', action='store_true',
+                        help='Mode interactif : la réponse à une clarification raffine les diagnostics proposés '
+                             '(conversation, sans cache ni --top-k ; hors --shards et --deadline-ms)')
     parser.add_argument('--database', '-d', help='Chemin vers la base de données JSON')
     parser.add_argument('--top', '-t', type=int, default=3, help='Nombre de résultats (défaut: 3)')
     parser.add_argument('--debug', action='store_true', help='Mode debug avec détails')
+    parser.add_argument('--format', '-f', choices=OUTPUT_FORMATS, default='text',
+                        help='Sortie : text (lisible, défaut), json (résultat JSON compact) ou ndjson '
+                             '(un résultat JSON par ligne, sans invite en mode interactif)')
+    parser.add_argument('--fuzzy', choices=FUZZY_MODES, default='fast',
+                        help='Calcul de similarité fuzzy (défaut: fast, reference = historique)')
+    parser.add_argument('--fuzzy-tolerance', type=float, default=0.0,
+                        help='Écart fuzzy toléré en mode fast (défaut: 0, résultats identiques)')
+    parser.add_argument('--spelling', type=int, default=0, metavar='DISTANCE',
+                        help="Corriger les mots inconnus jusqu'à DISTANCE fautes (défaut: 0, désactivé ; conseillé: 2)")
+    parser.add_argument('--fuzzy-candidates', type=int, default=FUZZY_CANDIDATE_LIMIT, metavar='N',
+                        help=f'Diagnostics sans mot commun notés au plus par requête (défaut: {FUZZY_CANDIDATE_LIMIT} ; '
+                             '0 = tous, total exact mais lent sur une grande base)')
+    parser.add_argument('--scoring', metavar='FICHIER',
+                        help='Poids du score, seuil et écart d\'ambiguïté (JSON de scripts/tune_weights.py --save)')
+    parser.add_argument('--cache', type=int, default=0, metavar='N',
+                        help='Garder en cache les N derniers résultats (défaut: 0, désactivé)')
+    parser.add_argument('--watch', action='store_true',
+                        help='Recharger automatiquement la base quand le fichier change (SIGHUP force un rechargement)')
+    parser.add_argument('--batch', '-b', nargs='?', const='-', metavar='FICHIER',
+                        help='Mode batch : requêtes JSONL depuis un fichier (ou stdin), résultats JSONL sur stdout')
+    parser.add_argument('--workers', '-w', type=int, default=os.cpu_count() or 1,
+                        help='Nombre de processus du mode batch (défaut: nombre de CPU)')
+    parser.add_argument('--ordered', action='store_true',
+                        help="Mode batch : conserver l'ordre des requêtes en sortie")
+    parser.add_argument('--deadline-ms', type=float, metavar='MS',
+                        help='Budget de temps par diagnostic : au-delà, meilleurs résultats provisoires (partiels)')
+    parser.add_argument('--top-k', action='store_true',
+                        help='Calculer le fuzzy seulement des diagnostics pouvant entrer dans le top (total exact)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Mesurer chaque étape du diagnostic et afficher le profil (stderr)')
+    parser.add_argument('--serve', action='store_true',
+                        help='Garder le moteur chargé et répondre sur une socket Unix (client: js/diagnostic_client.py)')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH,
+                        help=f'Socket du mode --serve (défaut: {DEFAULT_SOCKET_PATH}, ou $BOTIA_SOCKET)')
+    parser.add_argument('--suggest', action='store_true',
+                        help="Suggérer des mots-clés et diagnostics pour un début de saisie (la requête ; hors --shards)")
+    parser.add_argument('--shards', type=int, default=0, metavar='N',
+                        help='Répartir la base entre N processus interrogés en parallèle (défaut: 0, désactivé)')
+    parser.add_argument('--no-snapshot', action='store_true',
+                        help='Ignorer le snapshot compilé et relire le JSON (voir la sous-commande compile)')
     
     args = parser.parse_args()
+    if args.suggest and args.shards > 1:
+        # Les processus répartis ne connaissent chacun qu'une part des mots-clés
+        parser.error("--suggest n'est pas disponible avec --shards")
+    engine_options = {
+        'database_path': args.database,
+        'fuzzy_mode': args.fuzzy,
+        'fuzzy_tolerance': args.fuzzy_tolerance,
+        'cache_size': args.cache,
+        'use_snapshot': not args.no_snapshot,
+        'top_k': args.top_k,
+        'metrics': args.profile,
+        'spelling_distance': args.spelling,
+        'fuzzy_candidates': args.fuzzy_candidates,
+        'scoring': args.scoring
+    }
+    
+    if args.batch:
+        # Mode batch : stdout est réservé au flux JSONL
+        try:
+            processed = run_batch(args.batch, args.top, args.workers, args.ordered, engine_options)
+            print(f"✅ {processed} requêtes traitées", file=sys.stderr)
+        except Exception as e:
+            print(f"❌ Erreur: {e}", file=sys.stderr)
+            sys.exit(1)
+        return
+    
+    # Formats json et ndjson : stdout ne contient que les résultats
+    text_output = args.format == 'text'
     
     try:
         # Initialisation du moteur
-        print("🚗 BotIA - Assistant de Diagnostic Automobile")
-        print("=" * 50)
+        if text_output:
+            print("🚗 BotIA - Assistant de Diagnostic Automobile")
+            print("=" * 50)
+        
+        if args.shards > 1:
+            # Pas d'instrumentation ni de rechargement dans le mode réparti
+            engine = ShardedDiagnosticEngine(shards=args.shards, **engine_options)
+            atexit.register(engine.close)
+        else:
+            engine = BotIADiagnosticEngine(**engine_options)
+        if args.watch and args.shards <= 1:
+            engine.start_watching()
+            if hasattr(signal, 'SIGHUP'):
+                engine.install_reload_signal()
         
-        engine = BotIADiagnosticEngine(args.database)
+        if args.serve:
+            serve(engine, args.socket, args.top)
         
-        if args.interactive:
+        elif args.interactive:
             # Mode interactif
-            print("💬 Mode interactif - Décrivez votre problème automobile")
-            print("(Tapez 'quit' pour quitter)")
-            print("-" * 50)
+            if text_output:
+                print("💬 Mode interactif - Décrivez votre problème automobile")
+                print("(Tapez 'quit' pour quitter)")
+                print("-" * 50)
+            session_id = "interactive"
+            refining = args.refine and args.shards <= 1 and args.deadline_ms is None
+            clarifying = False
             
             while True:
                 try:
-                    user_input = input("\n🚗 Votre problème: ").strip()
+                    user_input = input("\n🚗 Votre problème: " if text_output else "").strip()
                     
                     if user_input.lower() in ['quit', 'exit', 'q']:
-                        print("👋 Au revoir !")
+                        if text_output:
+                            print("👋 Au revoir !")
                         break
                     
                     if not user_input:
                         continue
                     
-                    # Diagnostic
-                    result = engine.diagnose(user_input, args.top)
-                    response = engine.format_response(result)
-                    print("\n" + response)
+                    # Diagnostic ; avec --refine, la réponse à une clarification raffine les candidats précédents
+                    if refining:
+                        if not clarifying:
+                            engine.end_session(session_id)
+                        result = engine.refine(session_id, user_input, args.top)
+                        clarifying = bool(result['clarification'])
+                    else:
+                        result = engine.diagnose(user_input, args.top, args.deadline_ms)
+                    if text_output:
+                        print("\n" + engine.format_response(result))
+                    else:
+                        print(engine.format_json(result), flush=True)
                     
-                except KeyboardInterrupt:
-                    print("\n👋 Au revoir !")
+                except (KeyboardInterrupt, EOFError):
+                    if text_output:
+                        print("\n👋 Au revoir !")
                     break
+            
+            if args.profile and args.shards <= 1:
+                print("\n⏱️ PROFIL\n" + engine.metrics.report(), file=sys.stderr)
+        
+        elif args.query and args.suggest:
+            # Autocomplétion d'un début de saisie
+            suggestions = engine.suggest(args.query)
+            if not text_output:
+                print(compact_json(suggestions))
+            elif not suggestions['keywords']:
+                print(f"❓ Aucune suggestion pour : '{args.query}'")
+            else:
+                print(f"⌨️ Suggestions pour : '{args.query}'")
+                for item in suggestions['keywords']:
+                    print(f"   🔍 {item['keyword']} ({item['diagnostics']} diagnostic(s))")
+                for item in suggestions['diagnostics']:
+                    print(f"   {URGENCY_ICONS.get(item['urgence'], '🔧')} {item['titre']} ← '{item['keyword']}'")
         
         elif args.query:
             # Mode requête unique
-            result = engine.diagnose(args.query, args.top)
-            response = engine.format_response(result)
-            print(response)
+            result = engine.diagnose(args.query, args.top, args.deadline_ms)
+            if not text_output:
+                # Résultat complet, assemblé depuis les fragments pré-rendus
+                print(engine.format_json(result))
+            else:
+                print(engine.format_response(result))
             
-            if args.debug:
+            if args.debug and text_output:
                 print("\n🔧 DEBUG - Détails techniques:")
                 print(json.dumps(result, indent=2, ensure_ascii=False))
+            
+            if args.profile and args.shards <= 1:
+                print("\n⏱️ PROFIL\n" + engine.metrics.report(), file=sys.stderr)
         
         else:
             # Aucune requête fournie, afficher l'aide
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Benchmark BotIA : bases synthétiques de tailles croissantes, requêtes variées
+
+Chaque taille est mesurée dans un processus séparé (RSS et démarrage isolés) :
+temps de démarrage, latences p50/p95/p99, débit et pic de mémoire (ru_maxrss).
+Chaque taille rejoue le même nombre de requêtes (--queries), quelle que soit sa
+durée ; un budget de temps optionnel (--time-budget) ne coupe le rejeu qu'après
+--min-queries requêtes. Les résultats peuvent être sauvegardés comme référence
+(baseline JSON, avec le nombre de requêtes rejouées) ; une exécution suivante
+échoue si une métrique se dégrade au-delà du seuil, et refuse la comparaison si
+le nombre de requêtes d'une taille diffère de la référence.
+
+Usage:
+    python scripts/benchmark.py --sizes 42,1000,10000,100000 --output bench.json
+    python scripts/benchmark.py --save-baseline benchmarks/baseline.json
+    python scripts/benchmark.py --baseline benchmarks/baseline.json --threshold 0.25
+"""
+
+import sys
+import os
+import json
+import math
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer le moteur
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from js.diagnostic_engine import URGENCY_SCORE
+
+DEFAULT_SIZES = (42, 1000, 10000, 100000)
+DEFAULT_MIN_QUERIES = 100  # requêtes toujours rejouées, même au-delà du budget de temps
+SOURCE_DATABASE = Path(__file__).parent.parent / "data" / "diagnostics.json"
+
+# Sens de chaque métrique : une hausse (+1) ou une baisse (-1) est une régression
+METRIC_DIRECTIONS = {
+    'startup_s': 1,
+    'p50_ms': 1,
+    'p95_ms': 1,
+    'p99_ms': 1,
+    'throughput_rps': -1,
+    'peak_rss_mb': 1
+}
+
+def load_vocabulary(path=SOURCE_DATABASE):
+    """Mots des mots-clés de la base réelle, pour des bases synthétiques réalistes"""
+    with open(path, 'r', encoding='utf-8') as f:
+        diagnostics = json.load(f)['diagnostics']
+    return sorted({word for diag in diagnostics.values() for keyword in diag['keywords'] for word in keyword.split()})
+
+def generate_database(size, seed=42, vocabulary=None):
+    """
+    Base synthétique de `size` diagnostics : mots-clés de 1 à 3 mots tirés du
+    vocabulaire réel, enrichi de mots synthétiques proportionnellement à la taille
+    """
+    rng = random.Random(seed)
+    words = list(vocabulary or load_vocabulary())
+    words += [f"{rng.choice(words)[:4]}{i}" for i in range(size // 4)]
+    urgencies = list(URGENCY_SCORE)
+    
+    diagnostics = {}
+    for i in range(size):
+        keywords = []
+        for _ in range(rng.randint(4, 12)):
+            keyword = " ".join(rng.choice(words) for _ in range(rng.randint(1, 3)))
+            if keyword not in keywords:
+                keywords.append(keyword)
+        diagnostics[f"diag_{i}"] = {
+            "keywords": keywords,
+            "titre": f"Diagnostic synthétique {i}",
+            "urgence": rng.choice(urgencies),
+            "causes": [f"Cause {i}.{j}" for j in range(3)],
+            "solutions": [f"Solution {i}.{j}" for j in range(3)],
+            "cout_estime": f"{rng.randint(20, 200)}-{rng.randint(300, 2000)}€",
+            "contributeur": "benchmark"
+        }
+    
+    return {"version": f"bench-{size}", "description": "Base synthétique de benchmark", "diagnostics": diagnostics}
+
+def generate_queries(database, count, seed=7):
+    """
+    Requêtes variées : mot-clé exact, combinaison de mots-clés, faute de frappe,
+    phrase avec mots parasites et texte sans rapport
+    """
+    rng = random.Random(seed)
+    keywords = [keyword for diag in database['diagnostics'].values() for keyword in diag['keywords']]
+    fillers = ["ma voiture", "depuis hier", "quand je roule", "bizarre", "un peu", "le matin"]
+    
+    def typo(text):
+        if len(text) < 4:
+            return text
+        i = rng.randrange(1, len(text) - 1)
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    
+    queries = []
+    for i in range(count):
+        kind = i % 5
+        if kind == 0:
+            query = rng.choice(keywords)
+        elif kind == 1:
+            query = f"{rng.choice(keywords)} et {rng.choice(keywords)}"
+        elif kind == 2:
+            query = typo(rng.choice(keywords))
+        elif kind == 3:
+            query = f"{rng.choice(fillers)} {rng.choice(keywords)} {rng.choice(fillers)}"
+        else:
+            query = " ".join(rng.choice(fillers) for _ in range(2))
+        queries.append(query)
+    return queries
+
+def percentile(sorted_values, fraction):
+    """Percentile par rang le plus proche sur une liste triée"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(rank, 1)) - 1]
+
+def run_worker(database_path, queries_path, engine_options, time_budget=None, min_queries=DEFAULT_MIN_QUERIES):
+    """
+    Mesures dans le processus courant (appelé via --worker) : toutes les requêtes,
+    ou au moins min_queries si le budget de temps est dépassé
+    """
+    import resource
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    with open(queries_path, 'r', encoding='utf-8') as f:
+        queries = json.load(f)
+    
+    start = time.perf_counter()
+    engine = BotIADiagnosticEngine(database_path, **engine_options)
+    startup = time.perf_counter() - start
+    
+    latencies = []
+    replay_start = time.perf_counter()
+    for query in queries:
+        query_start = time.perf_counter()
+        engine.diagnose(query)
+        latencies.append(time.perf_counter() - query_start)
+        if (time_budget and len(latencies) >= min_queries
+                and time.perf_counter() - replay_start > time_budget):
+            break
+    replay = time.perf_counter() - replay_start
+    
+    latencies.sort()
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # Ko sous Linux
+    if sys.platform == 'darwin':
+        peak_rss_kb /= 1024  # octets sous macOS
+    
+    return {
+        'diagnostics': len(engine.records),
+        'queries': len(latencies),
+        'startup_s': round(startup, 4),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'throughput_rps': round(len(latencies) / replay, 1) if replay else 0.0,
+        'peak_rss_mb': round(peak_rss_kb / 1024, 1)
+    }
+
+def benchmark_size(size, query_count=500, engine_options=None, time_budget=None, seed=42, workdir=None,
+                   min_queries=DEFAULT_MIN_QUERIES):
+    """Génère la base et les requêtes d'une taille puis mesure dans un sous-processus"""
+    workdir = workdir or tempfile.mkdtemp(prefix="botia-bench-")
+    database = generate_database(size, seed)
+    database_path = os.path.join(workdir, f"bench_{size}.json")
+    queries_path = os.path.join(workdir, f"queries_{size}.json")
+    with open(database_path, 'w', encoding='utf-8') as f:
+        json.dump(database, f, ensure_ascii=False)
+    with open(queries_path, 'w', encoding='utf-8') as f:
+        json.dump(generate_queries(database, query_count, seed), f, ensure_ascii=False)
+    del database
+    
+    command = [sys.executable, str(Path(__file__).resolve()), '--worker',
+               '--database', database_path, '--queries-file', queries_path,
+               '--engine-options', json.dumps(engine_options or {}), '--min-queries', str(min_queries)]
+    if time_budget:
+        command += ['--time-budget', str(time_budget)]
+    completed = subprocess.run(command, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise Exception(f"❌ Benchmark {size} diagnostics en échec:\n{completed.stderr.strip()}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def compare_to_baseline(results, baseline, threshold):
+    """
+    Liste des régressions (taille, métrique, référence, mesure, variation) :
+    variation relative défavorable supérieure au seuil. Les percentiles et le débit
+    ne sont comparables que sur le même nombre de requêtes : une taille rejouée
+    sur un autre nombre que la référence (ou une référence sans ce nombre) est refusée.
+    """
+    regressions = []
+    for size, metrics in results.items():
+        reference = baseline.get(size)
+        if not reference:
+            continue
+        if reference.get('queries') != metrics.get('queries'):
+            raise ValueError(f"❌ {size} diagnostics : {metrics.get('queries')} requêtes rejouées contre "
+                             f"{reference.get('queries')} dans la référence (relancer avec le même --queries "
+                             f"sans --time-budget, ou réenregistrer la référence)")
+        for metric, direction in METRIC_DIRECTIONS.items():
+            before, after = reference.get(metric), metrics.get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * direction
+            if change > threshold:
+                regressions.append((size, metric, before, after, change))
+    return regressions
+
+def print_results(results):
+    """Tableau des mesures"""
+    print(f"{'Taille':>8} | {'Démarrage':>10} | {'p50':>9} | {'p95':>9} | {'p99':>9} | {'Débit':>10} | {'RSS':>8}")
+    print("-" * 80)
+    for size, metrics in results.items():
+        print(f"{size:>8} | {metrics['startup_s']:>9.3f}s | {metrics['p50_ms']:>7.2f}ms | "
+              f"{metrics['p95_ms']:>7.2f}ms | {metrics['p99_ms']:>7.2f}ms | "
+              f"{metrics['throughput_rps']:>6.0f} r/s | {metrics['peak_rss_mb']:>6.0f}Mo")
+
+def main():
+    """Fonction principale du benchmark"""
+    
+    parser = argparse.ArgumentParser(description='Benchmark BotIA sur bases synthétiques')
+    parser.add_argument('--sizes', default=",".join(map(str, DEFAULT_SIZES)),
+                        help='Tailles de base, séparées par des virgules (défaut: 42,1000,10000,100000)')
+    parser.add_argument('--queries', type=int, default=500, help='Requêtes rejouées par taille (défaut: 500)')
+    parser.add_argument('--time-budget', type=float,
+                        help='Durée maximale de rejeu par taille, en secondes (défaut: aucune ; '
+                             'rend le nombre de requêtes variable, donc la comparaison à une référence fragile)')
+    parser.add_argument('--min-queries', type=int, default=DEFAULT_MIN_QUERIES,
+                        help=f'Requêtes rejouées même au-delà du budget de temps (défaut: {DEFAULT_MIN_QUERIES})')
+    parser.add_argument('--fuzzy', choices=('fast', 'reference'), default='fast', help='Mode fuzzy du moteur')
+    parser.add_argument('--top-k', action='store_true', help='Sélection top-k par bornes')
+    parser.add_argument('--output', '-o', help='Fichier JSON des résultats')
+    parser.add_argument('--baseline', help='Référence JSON à comparer')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Dégradation relative tolérée par métrique (défaut: 0.2 = 20%%)')
+    parser.add_argument('--save-baseline', metavar='FICHIER', help='Enregistrer les résultats comme référence')
+    # Mode interne : mesure dans un sous-processus
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--queries-file', help=argparse.SUPPRESS)
+    parser.add_argument('--engine-options', default='{}', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        # Les messages du moteur vont sur stderr : stdout ne contient que les mesures
+        sys.stdout, stdout = sys.stderr, sys.stdout
+        metrics = run_worker(args.database, args.queries_file, json.loads(args.engine_options),
+                             args.time_budget, args.min_queries)
+        print(json.dumps(metrics), file=stdout)
+        return
+    
+    print("🏁 BotIA - Benchmark")
+    print("=" * 50)
+    
+    engine_options = {'fuzzy_mode': args.fuzzy, 'top_k': args.top_k, 'use_snapshot': False}
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="botia-bench-") as workdir:
+            for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+                print(f"⏱️  {size} diagnostics...", flush=True)
+                results[str(size)] = benchmark_size(size, args.queries, engine_options, args.time_budget,
+                                                    workdir=workdir, min_queries=args.min_queries)
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        sys.exit(1)
+    
+    print()
+    print_results(results)
+    
+    report = {'engine_options': engine_options, 'python': sys.version.split()[0], 'results': results}
+    for path in (args.output, args.save_baseline):
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            print(f"\n💾 Résultats enregistrés: {path}")
+    
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+        try:
+            regressions = compare_to_baseline(results, baseline, args.threshold)
+        except ValueError as e:
+            print(f"\n{e}")
+            sys.exit(1)
+        if regressions:
+            print(f"\n❌ {len(regressions)} régression(s) au-delà de {args.threshold:.0%}:")
+            for size, metric, before, after, change in regressions:
+                print(f"  - {size} diagnostics, {metric}: {before} → {after} ({change:+.0%})")
+            sys.exit(1)
+        print(f"\n✅ Aucune régression au-delà de {args.threshold:.0%} par rapport à {args.baseline}")
+
+if __name__ == "__main__":
+    main()
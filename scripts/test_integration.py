@@ -14,6 +14,24 @@ from pathlib import Path
 # Ajouter le répertoire parent au path pour importer le moteur
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from js.diagnostic_engine import URGENCY_SCORE
+
+def reference_diagnose(engine, user_input, top_n=3):
+    """Diagnostic historique : scoring complet de chaque diagnostic via compute_match_score"""
+    results = []
+    for diag_id, diag_data in engine.data['diagnostics'].items():
+        match_info = engine.compute_match_score(user_input, diag_data)
+        if match_info['score'] > 0.1:
+            results.append((match_info['score'], URGENCY_SCORE.get(diag_data['urgence'], 1), diag_id, match_info))
+    results.sort(key=lambda x: (x[0], x[1]), reverse=True)
+    return len(results), [(diag_id, score, match_info) for score, _, diag_id, match_info in results[:top_n]]
+
+REFERENCE_QUERIES = [
+    "voyant moteur allumé", "freins qui grincent", "problème de batterie",
+    "ma voiture surchauffe", "batery a plat", "frain", "embrayag qui patine",
+    "FUMÉE BLANCHE échappement", "bruit", "voiture", "", "xyz"
+]
+
 def test_database_files():
     """Test de présence et validité des fichiers de base de données"""
     print("🔍 Test des fichiers de base de données...")
@@ -199,6 +217,1254 @@ def test_performance():
         print(f"  ❌ Erreur lors du test de performance: {e}")
         return False
 
+def test_compiled_index():
+    """Test de cohérence entre les diagnostics précompilés et le scoring historique"""
+    print("\n🗂️ Test de l'index précompilé...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    queries = ["voyant moteur allumé", "FREINS qui grincent", "batery a plat", "bruit", ""]
+    
+    mismatches = 0
+    for query_text in queries:
+        query = engine.prepare_query(query_text)
+        for diag_id, record in engine.compiled.items():
+            expected = engine.compute_match_score(query_text, engine.data['diagnostics'][diag_id])
+            if engine.score_record(query, record) != expected:
+                mismatches += 1
+                print(f"  ❌ '{query_text}' / {diag_id}: divergence de score")
+    
+    checks = [
+        ("Un enregistrement par diagnostic", len(engine.compiled) == len(engine.data['diagnostics'])),
+        ("Mots-clés normalisés", all(
+            list(record.keywords_norm) == [engine.normalize_text(k) for k in record.keywords]
+            for record in engine.compiled.values()
+        )),
+        ("Scores identiques au calcul historique", mismatches == 0)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Index précompilé incohérent"
+    return all_passed
+
+def test_candidate_pruning():
+    """Test de l'index inversé : classement identique au scoring complet"""
+    print("\n🎯 Test de la présélection des candidats...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    
+    all_passed = True
+    for query_text in REFERENCE_QUERIES:
+        total, expected = reference_diagnose(engine, query_text, top_n=5)
+        result = engine.diagnose(query_text, top_n=5)
+        got = [(m['id'], m['score'], m['details']) for m in result['top_matches']]
+        candidates = len(engine.find_candidates(engine.prepare_query(query_text)))
+        
+        if got == expected and result['total_matches'] == total:
+            print(f"  ✅ '{query_text}' → {candidates}/{len(engine.records)} candidats")
+        else:
+            print(f"  ❌ '{query_text}' → classement différent du scoring complet")
+            all_passed = False
+    
+    # Base synthétique : la borne des caractères communs écarte les diagnostics
+    # que la seule borne de longueur retenait (sans token commun avec la requête)
+    import tempfile
+    from js.diagnostic_engine import length_bound
+    sys.path.insert(0, str(Path(__file__).parent))
+    import benchmark
+    
+    database = benchmark.generate_database(300)
+    queries = benchmark.generate_queries(database, 10)
+    with tempfile.TemporaryDirectory() as workdir:
+        database_path = os.path.join(workdir, "diagnostics.json")
+        with open(database_path, 'w', encoding='utf-8') as f:
+            json.dump(database, f, ensure_ascii=False)
+        engine = BotIADiagnosticEngine(database_path, use_snapshot=False, fuzzy_candidates=0)
+        
+        # Plafond des candidats sans token commun : les mieux classés par n-grammes, parmi ceux de la borne
+        capped = BotIADiagnosticEngine(database_path, use_snapshot=False, fuzzy_candidates=40, compact_every=0)
+        capped_ok = True
+        for query_text in queries:
+            query = capped.prepare_query(query_text)
+            lexical = set(capped.snapshot.always_candidates)
+            for kw_word in query['present']:
+                lexical.update(capped.snapshot.token_index[kw_word])
+            kept = {record.position for record in capped.find_candidates(query)}
+            exact = {record.position for record in engine.find_candidates(query)}
+            capped_ok = capped_ok and lexical <= kept <= exact and len(kept - lexical) <= 40
+        capped.add_diagnostic("gyroscope", {"keywords": ["gyroscope hurlant"], "titre": "Gyroscope",
+                                            "urgence": "critique", "causes": [], "solutions": []})
+        added_found = "gyroscope" in {record.id for record in capped.find_candidates(capped.prepare_query("gyroscpe hurlnt"))}
+    
+    snapshot = engine.snapshot
+    pruned = length_only = 0
+    for query_text in queries:
+        query = engine.prepare_query(query_text)
+        candidates = engine.find_candidates(query)
+        
+        # Présélection par la seule borne de longueur (ancienne présélection)
+        kept = set(snapshot.always_candidates)
+        for kw_word in query['present']:
+            kept.update(snapshot.token_index[kw_word])
+        for urgency_score, lengths in snapshot.length_index.items():
+            for kw_length, positions in lengths.items():
+                if 0.1 * urgency_score / 10 + 0.1 * length_bound(len(query['norm']), kw_length) > 0.1 - 1e-9:
+                    kept.update(positions)
+        
+        total, expected = reference_diagnose(engine, query_text, top_n=5)
+        result = engine.diagnose(query_text, top_n=5)
+        got = [(m['id'], m['score'], m['details']) for m in result['top_matches']]
+        if got != expected or result['total_matches'] != total:
+            print(f"  ❌ '{query_text}' → classement différent du scoring complet")
+            all_passed = False
+        pruned += len(candidates)
+        length_only += len(kept)
+    
+    check_result = pruned < 0.8 * length_only
+    print(f"  {'✅' if check_result else '❌'} Base synthétique : {pruned} candidats notés "
+          f"contre {length_only} par la borne de longueur seule")
+    all_passed = all_passed and check_result
+    for check_name, check_result in [("Plafond des candidats fuzzy seuls respecté", capped_ok),
+                                     ("Index n-gramme à jour après un ajout", added_found)]:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "La présélection modifie le classement"
+    return all_passed
+
+def test_exact_automaton():
+    """Test de l'automate Aho-Corasick contre la recherche de sous-chaîne naïve"""
+    print("\n🔎 Test de l'automate de correspondance exacte...")
+    
+    import random
+    from js.diagnostic_engine import AhoCorasickMatcher, BotIADiagnosticEngine, normalize_text
+    
+    rng = random.Random(42)
+    patterns = {''.join(rng.choice("abc ") for _ in range(rng.randint(1, 5))) for _ in range(60)}
+    matcher = AhoCorasickMatcher(patterns)
+    
+    automaton_ok = True
+    for _ in range(200):
+        text = ''.join(rng.choice("abcd ") for _ in range(rng.randint(0, 30)))
+        if matcher.find_all(text) != {p for p in patterns if p in text}:
+            automaton_ok = False
+    
+    engine = BotIADiagnosticEngine()
+    matches_ok = True
+    for query_text in REFERENCE_QUERIES:
+        expected = {}
+        for diag_id, diag_data in engine.data['diagnostics'].items():
+            match_info = engine.compute_match_score(query_text, diag_data)
+            if match_info['exact_match']:
+                expected[diag_id] = match_info['matched_keyword']
+        if engine.exact_matches(query_text) != expected:
+            matches_ok = False
+    
+    # Base chargée depuis le JSON : pas d'automate, recherche par sous-chaîne
+    snapshot = engine.snapshot
+    lookup_ok = snapshot.automaton is None and all(
+        snapshot.find_exact(normalize_text(query_text)) == {kw_norm for kw_norm in snapshot.exact_index
+                                                            if kw_norm in normalize_text(query_text)}
+        for query_text in REFERENCE_QUERIES + ["voyant moteur et freins qui grincent"])
+    
+    checks = [
+        ("Motifs identiques à la recherche naïve", automaton_ok),
+        ("Diagnostics et mots-clés exacts identiques", matches_ok),
+        ("Recherche sans automate identique (chargement JSON)", lookup_ok)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Automate de correspondance exacte incohérent"
+    return all_passed
+
+def test_fuzzy_modes():
+    """Test du fuzzy borné : identique au mode référence, écart contrôlé avec tolérance"""
+    print("\n〰️ Test de la similarité fuzzy bornée...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    reference = BotIADiagnosticEngine(fuzzy_mode="reference")
+    fast = BotIADiagnosticEngine(fuzzy_mode="fast")
+    tolerant = BotIADiagnosticEngine(fuzzy_mode="fast", fuzzy_tolerance=0.05)
+    
+    identical = True
+    max_deviation = 0
+    keyword_ok = True
+    for query_text in REFERENCE_QUERIES:
+        if reference.diagnose(query_text, top_n=5) != fast.diagnose(query_text, top_n=5):
+            identical = False
+        ref_query = reference.prepare_query(query_text)
+        tol_query = tolerant.prepare_query(query_text)
+        for diag_id, record in reference.compiled.items():
+            expected = reference.score_record(ref_query, record)
+            got = tolerant.score_record(tol_query, tolerant.compiled[diag_id])
+            max_deviation = max(max_deviation, expected['fuzzy'] - got['fuzzy'])
+            keyword_ok = keyword_ok and expected['matched_keyword'] == got['matched_keyword']
+    
+    checks = [
+        ("Mode fast (tolérance 0) identique au mode référence", identical),
+        (f"Écart fuzzy borné par la tolérance ({max_deviation:.3f} <= 0.05)", max_deviation <= 0.05 + 1e-3),
+        ("Mot-clé retenu identique avec tolérance", keyword_ok)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Similarité fuzzy bornée incohérente"
+    return all_passed
+
+def test_batch_diagnose():
+    """Test du diagnostic par lot : mêmes résultats que diagnose requête par requête"""
+    print("\n📦 Test du diagnostic par lot...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    queries = REFERENCE_QUERIES + ["Voyant Moteur Allumé", "voyant moteur allume"]
+    
+    expected = [engine.diagnose(query_text, top_n=4) for query_text in queries]
+    batched = engine.diagnose_many(queries, top_n=4, chunk_size=5)
+    
+    checks = [
+        ("Un résultat par requête", len(batched) == len(queries)),
+        ("Résultats identiques à diagnose", batched == expected),
+        ("Lot vide", engine.diagnose_many([]) == [])
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Diagnostic par lot incohérent"
+    return all_passed
+
+def test_batch_cli():
+    """Test du mode batch JSONL (un processus et pool de processus ordonné)"""
+    print("\n🧵 Test du mode batch JSONL...")
+    
+    import io
+    import tempfile
+    from js.diagnostic_engine import BotIADiagnosticEngine, run_batch
+    
+    engine = BotIADiagnosticEngine()
+    queries = ["voyant moteur", "frein", "batterie a plat", "bruit", "surchauffe"] * 5
+    
+    with tempfile.NamedTemporaryFile('w', suffix='.jsonl', delete=False, encoding='utf-8') as f:
+        for i, query_text in enumerate(queries):
+            f.write(json.dumps({'id': i, 'query': query_text}, ensure_ascii=False) + "\n")
+        f.write("\n{\"pas_de_query\": true}\n")
+        source = f.name
+    
+    try:
+        outputs = {}
+        for workers in (1, 2):
+            buffer = io.StringIO()
+            run_batch(source, top_n=2, workers=workers, ordered=True, chunk_size=4, output=buffer)
+            outputs[workers] = [json.loads(line) for line in buffer.getvalue().splitlines()]
+    finally:
+        os.unlink(source)
+    
+    expected = [engine.diagnose(query_text, top_n=2) for query_text in queries]
+    single = outputs[1]
+    checks = [
+        ("Une ligne JSON par requête", len(single) == len(queries) + 1),
+        ("Résultats identiques à diagnose", [
+            {k: v for k, v in line.items() if k not in ('line', 'id')} for line in single[:-1]
+        ] == json.loads(json.dumps(expected, ensure_ascii=False))),
+        ("Identifiants conservés", [line.get('id') for line in single[:-1]] == list(range(len(queries)))),
+        ("Ligne invalide signalée", 'error' in single[-1]),
+        ("Pool ordonné identique au mode mono-processus", outputs[2] == single)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Mode batch incohérent"
+    return all_passed
+
+def test_result_cache():
+    """Test du cache LRU : requêtes normalisées identiques, éviction, invalidation"""
+    print("\n🗃️ Test du cache de résultats...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine(cache_size=2)
+    uncached = BotIADiagnosticEngine()
+    
+    first = engine.diagnose("Batterie à plat")
+    second = engine.diagnose("batterie a plat")
+    after_hit = engine.cache_stats()
+    engine.diagnose("frein")
+    engine.diagnose("bruit")
+    after_eviction = engine.cache_stats()
+    engine.load_database()
+    after_reload = engine.cache_stats()
+    
+    checks = [
+        ("Résultat identique au moteur sans cache", first == uncached.diagnose("Batterie à plat")),
+        ("Input d'origine conservé sur un hit", second['input'] == "batterie a plat"
+            and second == uncached.diagnose("batterie a plat")),
+        ("Hit sur accents/casse différents", after_hit['hits'] == 1 and after_hit['misses'] == 1),
+        ("Éviction LRU", after_eviction['evictions'] == 1 and after_eviction['size'] == 2),
+        ("Invalidation au rechargement", after_reload['size'] == 0 and after_reload['invalidations'] == 1),
+        ("Cache désactivé par défaut", uncached.cache_stats() is None)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Cache de résultats incohérent"
+    return all_passed
+
+def test_hot_reload():
+    """Test du rechargement à chaud : les requêtes concurrentes voient l'ancienne ou la nouvelle base"""
+    print("\n♻️ Test du rechargement à chaud...")
+    
+    import shutil
+    import tempfile
+    import threading
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    with open("data/diagnostics.json", 'r', encoding='utf-8') as f:
+        base_a = json.load(f)
+    base_b = dict(base_a, version="test-b", diagnostics=dict(list(base_a['diagnostics'].items())[::2]))
+    
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "diagnostics.json")
+    
+    def write_base(data):
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+    
+    try:
+        queries = ["voyant moteur", "freins qui grincent", "batterie a plat"]
+        write_base(base_b)
+        expected_b = {q: BotIADiagnosticEngine(path).diagnose(q) for q in queries}
+        write_base(base_a)
+        engine = BotIADiagnosticEngine(path)
+        expected_a = {q: engine.diagnose(q) for q in queries}
+        
+        errors = []
+        stop = threading.Event()
+        
+        def hammer():
+            while not stop.is_set():
+                for q in queries:
+                    result = engine.diagnose(q)
+                    if result != expected_a[q] and result != expected_b[q]:
+                        errors.append(q)
+        
+        threads = [threading.Thread(target=hammer) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for i in range(6):
+            write_base(base_b if i % 2 == 0 else base_a)
+            engine.reload(background=True).join()
+        stop.set()
+        for thread in threads:
+            thread.join()
+        
+        write_base(base_b)
+        os.utime(path, ns=(1, 1))
+        modified = engine.database_modified()
+        engine.reload_if_modified()
+        
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("{ invalide")
+        engine.reload(background=True).join()
+        
+        checks = [
+            ("Aucun état partiel observé pendant les rechargements", not errors),
+            ("Modification du fichier détectée", modified),
+            ("Nouvelle base en service après rechargement", engine.diagnose(queries[0]) == expected_b[queries[0]]),
+            ("Base invalide ignorée, précédente conservée", engine.data['version'] == "test-b")
+        ]
+    finally:
+        shutil.rmtree(tmpdir)
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Rechargement à chaud incohérent"
+    return all_passed
+
+def test_compiled_snapshot():
+    """Test du snapshot compilé : résultats identiques au JSON, snapshot périmé ignoré"""
+    print("\n📦 Test du snapshot compilé...")
+    
+    import shutil
+    import tempfile
+    import mmap
+    from js.diagnostic_engine import BotIADiagnosticEngine, LazyDiagnostic, PostingIndex
+    
+    contribution = {"keywords": ["gyroscope hurlant", "voyant moteur"], "titre": "Turbo défaillant",
+                    "urgence": "elevee", "causes": [], "solutions": []}
+    
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, "diagnostics.json")
+    shutil.copy("data/diagnostics.json", path)
+    
+    try:
+        reference = BotIADiagnosticEngine(path, use_snapshot=False,
+                                          delta_log_path=os.path.join(tmpdir, "reference.delta.jsonl"))
+        snapshot_path = reference.compile_snapshot()
+        engine = BotIADiagnosticEngine(path)
+        lazy = all(isinstance(diag, LazyDiagnostic) for diag in engine.data['diagnostics'].values())
+        identical = all(engine.diagnose(q, 5) == reference.diagnose(q, 5) for q in REFERENCE_QUERIES)
+        batch_identical = engine.diagnose_many(REFERENCE_QUERIES) == reference.diagnose_many(REFERENCE_QUERIES)
+        
+        # Positions lues en place dans le fichier mappé (aucun pickle)
+        token_index = engine.snapshot.token_index
+        mapped = isinstance(token_index, PostingIndex) and all(
+            isinstance(positions, memoryview) and isinstance(positions.obj, mmap.mmap)
+            for positions in token_index.values())
+        
+        # Modifications incrémentales sur le snapshot compilé (index en copie sur écriture)
+        compiled_snapshot = engine.snapshot
+        engine.add_diagnostic("turbo_test", contribution)
+        engine.remove_diagnostic("batterie_faible")
+        reference.add_diagnostic("turbo_test", contribution)
+        reference.remove_diagnostic("batterie_faible")
+        incremental = all(engine.diagnose(q, 5) == reference.diagnose(q, 5)
+                          for q in REFERENCE_QUERIES + ["gyroscope hurlant"])
+        untouched = "gyroscope" not in compiled_snapshot.token_index and \
+            "turbo_test" not in compiled_snapshot.compiled and "batterie_faible" in compiled_snapshot.compiled
+        
+        # Source modifiée après la compilation : retour au JSON
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        data['version'] = "test-perime"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        stale = BotIADiagnosticEngine(path)
+        
+        with open(snapshot_path, 'wb') as f:
+            f.write(b"corrompu")
+        corrupted = BotIADiagnosticEngine(path)
+        
+        checks = [
+            ("Diagnostics chargés à la demande depuis le snapshot", lazy),
+            ("Résultats identiques au chargement JSON", identical),
+            ("Lot identique au chargement JSON", batch_identical),
+            ("Positions lues dans le fichier mappé", mapped),
+            ("Modifications sur le snapshot compilé", incremental and untouched),
+            ("Snapshot périmé ignoré", stale.data['version'] == "test-perime"),
+            ("Snapshot corrompu ignoré", len(corrupted.records) == len(reference.records))
+        ]
+    finally:
+        shutil.rmtree(tmpdir)
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Snapshot compilé incohérent"
+    return all_passed
+
+def test_socket_server():
+    """Test du mode --serve : le client léger obtient la même réponse que le moteur local"""
+    print("\n🔌 Test du serveur socket...")
+    
+    import tempfile
+    import threading
+    from js.diagnostic_engine import BotIADiagnosticEngine, DiagnosisSocketServer, DEFAULT_SOCKET_PATH
+    from js import diagnostic_client
+    
+    engine = BotIADiagnosticEngine()
+    socket_path = os.path.join(tempfile.mkdtemp(), "botia.sock")
+    server = DiagnosisSocketServer(engine, socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    
+    try:
+        query = "freins qui grincent"
+        reply = diagnostic_client.request_diagnosis(query, 5, socket_path, with_result=True)
+        expected = engine.diagnose(query, 5)
+        invalid = diagnostic_client.request_diagnosis(None, 3, socket_path)
+        
+        try:
+            DiagnosisSocketServer(engine, socket_path)
+            refused = False
+        except Exception:
+            refused = True
+    finally:
+        server.shutdown()
+        server.server_close()
+    
+    checks = [
+        ("Réponse texte identique à format_response", reply.get('response') == engine.format_response(expected)),
+        ("Résultat JSON identique", reply.get('result') == json.loads(json.dumps(expected))),
+        ("Requête invalide signalée", 'error' in invalid),
+        ("Second serveur refusé sur une socket active", refused),
+        ("Socket supprimée à l'arrêt", not os.path.exists(socket_path)),
+        ("Socket par défaut partagée avec le client", diagnostic_client.DEFAULT_SOCKET_PATH == DEFAULT_SOCKET_PATH)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Serveur socket incohérent"
+    return all_passed
+
+def test_micro_batching():
+    """Test du micro-batching de l'API : requêtes concurrentes regroupées, résultats identiques"""
+    print("\n📨 Test du micro-batching...")
+    
+    import asyncio
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    from js.api_server import MicroBatcher
+    
+    engine = BotIADiagnosticEngine()
+    requests = [(query, 5 if i % 3 == 0 else 3) for i, query in enumerate(REFERENCE_QUERIES * 4)]
+    
+    async def run():
+        batcher = MicroBatcher(engine, max_batch_size=16, max_latency_ms=20)
+        await batcher.start()
+        try:
+            results = await asyncio.gather(*(batcher.submit(query, top_n) for query, top_n in requests))
+        finally:
+            await batcher.stop()
+        return results, batcher.stats()
+    
+    results, stats = asyncio.run(run())
+    
+    checks = [
+        ("Résultats identiques à diagnose", all(result == engine.diagnose(query, top_n)
+                                               for (query, top_n), result in zip(requests, results))),
+        ("Requêtes regroupées en lots", stats['batches'] < len(requests)),
+        ("Taille de lot bornée", stats['largest_batch'] <= 16)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Micro-batching incohérent"
+    return all_passed
+
+def test_top_k_bounds():
+    """Test de la sélection top-k par bornes : même top et même clarification que diagnose"""
+    print("\n🏆 Test de la sélection top-k...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    top_k_engine = BotIADiagnosticEngine(top_k=True)
+    
+    identical = True
+    for query in REFERENCE_QUERIES:
+        for top_n in (1, 3, 5):
+            identical = identical and top_k_engine.diagnose(query, top_n) == engine.diagnose(query, top_n)
+    
+    # Base synthétique : la plupart des candidats restent hors du tas, comptés sans être tous notés
+    import tempfile
+    sys.path.insert(0, str(Path(__file__).parent))
+    import benchmark
+    
+    database = benchmark.generate_database(300)
+    with tempfile.TemporaryDirectory() as workdir:
+        database_path = os.path.join(workdir, "diagnostics.json")
+        with open(database_path, 'w', encoding='utf-8') as f:
+            json.dump(database, f, ensure_ascii=False)
+        engine = BotIADiagnosticEngine(database_path, use_snapshot=False)
+        top_k_engine = BotIADiagnosticEngine(database_path, use_snapshot=False, top_k=True)
+    
+    drift = 0
+    approximate = False
+    for query in benchmark.generate_queries(database, 20):
+        expected = engine.diagnose(query, 3)
+        result = top_k_engine.diagnose(query, 3)
+        drift = max(drift, abs(result['total_matches'] - expected['total_matches']))
+        approximate = approximate or 'total_matches_approximate' in result
+        identical = identical and result['top_matches'] == expected['top_matches']
+    
+    checks = [
+        ("Top et clarification identiques", identical),
+        ("Total exact, jamais signalé approché", drift == 0 and not approximate)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Sélection top-k incohérente"
+    return all_passed
+
+def test_benchmark_suite():
+    """Test du benchmark : mesures d'une petite base synthétique et détection de régression"""
+    print("\n🏁 Test du benchmark...")
+    
+    sys.path.insert(0, str(Path(__file__).parent))
+    import benchmark
+    
+    database = benchmark.generate_database(42)
+    metrics = benchmark.benchmark_size(42, query_count=20, time_budget=10.0)
+    baseline = {'42': dict(metrics, p95_ms=metrics['p95_ms'] / 2, throughput_rps=metrics['throughput_rps'] * 2)}
+    regressions = {metric for _, metric, _, _, _ in benchmark.compare_to_baseline({'42': metrics}, baseline, 0.2)}
+    
+    # Budget de temps épuisé dès la première requête : le minimum est tout de même rejoué
+    budgeted = benchmark.benchmark_size(42, query_count=20, time_budget=1e-9, min_queries=5)
+    try:
+        benchmark.compare_to_baseline({'42': budgeted}, {'42': metrics}, 0.2)
+        mismatch_refused = False
+    except ValueError:
+        mismatch_refused = True
+    
+    checks = [
+        ("Base synthétique de la taille demandée", len(database['diagnostics']) == 42),
+        ("Génération déterministe", benchmark.generate_database(42) == database),
+        ("Mesures complètes", set(benchmark.METRIC_DIRECTIONS) <= set(metrics) and metrics['queries'] == 20),
+        ("Minimum de requêtes rejoué malgré le budget", budgeted['queries'] == 5),
+        ("Comparaison refusée si le nombre de requêtes diffère", mismatch_refused),
+        ("Régressions détectées (latence et débit)", regressions == {'p95_ms', 'throughput_rps'}),
+        ("Aucune régression contre soi-même",
+         not benchmark.compare_to_baseline({'42': metrics}, {'42': metrics}, 0.2))
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Benchmark incohérent"
+    return all_passed
+
+def test_differential_verifier():
+    """Test du vérificateur différentiel : modes optimisés identiques à la référence figée"""
+    print("\n🔬 Test du vérificateur différentiel...")
+    
+    sys.path.insert(0, str(Path(__file__).parent))
+    import verify_engine
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    database_path = "data/diagnostics.json"
+    with open(database_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    reference = verify_engine.ReferenceScorer(data)
+    corpus = verify_engine.generate_corpus(data, 150)
+    modes = verify_engine.build_modes(database_path, ['fast', 'top-k', 'batch'])
+    divergences = verify_engine.verify(modes, reference, corpus, top_values=(1, 3))
+    
+    # Mode volontairement faux : le dernier résultat disparaît
+    engine = BotIADiagnosticEngine(database_path)
+    
+    def broken(queries, top_n):
+        results = [engine.diagnose(q, top_n) for q in queries]
+        return [dict(r, top_matches=r['top_matches'][:-1]) for r in results]
+    detected = verify_engine.verify({'broken': broken}, reference, corpus[:30], top_values=(3,))
+    
+    checks = [
+        ("Corpus déterministe", verify_engine.generate_corpus(data, 150) == corpus),
+        ("Aucune divergence (fast, top-k, batch)", not divergences),
+        ("Divergences détectées avec diff", bool(detected) and all(d['diff'] for d in detected))
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Vérification différentielle en échec"
+    return all_passed
+
+def test_stage_metrics():
+    """Test de l'instrumentation par étape : mesures, compteurs et export Prometheus"""
+    print("\n⏱️ Test de l'instrumentation...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    profiled = BotIADiagnosticEngine(metrics=True, cache_size=16)
+    
+    identical = all(profiled.diagnose(q) == engine.diagnose(q) for q in REFERENCE_QUERIES)
+    profiled.diagnose(REFERENCE_QUERIES[0])  # servi par le cache
+    profiled.format_response(profiled.diagnose(REFERENCE_QUERIES[1]))
+    
+    data = profiled.metrics_snapshot()
+    expected_results = sum(engine.diagnose(q)['total_matches'] for q in REFERENCE_QUERIES)
+    clarifications = sum(engine.diagnose(q)['clarification'] is not None for q in REFERENCE_QUERIES)
+    text = profiled.metrics_text()
+    
+    # Top-k et budget de temps : une seule présélection par requête, comptée par le compteur
+    top_k = BotIADiagnosticEngine(metrics=True, top_k=True)
+    snapshot = top_k.snapshot
+    calls = []
+    find_candidates = snapshot.find_candidates
+    snapshot.find_candidates = lambda query, *args: calls.append(1) or find_candidates(query, *args)
+    top_k.diagnose("voyant moteur allumé")
+    top_k.diagnose("freins qui grincent", deadline_ms=1000)
+    expected_candidates = sum(len(find_candidates(top_k.prepare_query(q), top_k.scoring, top_k.fuzzy_candidates))
+                              for q in ("voyant moteur allumé", "freins qui grincent"))
+    
+    checks = [
+        ("Résultats identiques avec instrumentation", identical),
+        ("Toutes les étapes mesurées", {'normalize', 'tokens', 'exact', 'candidates', 'lexical', 'fuzzy',
+                                        'ranking', 'format'} <= set(data['stages'])),
+        ("Compteurs de requêtes et de cache", data['counters']['queries'] == len(REFERENCE_QUERIES)
+         and data['counters']['cache_hits'] == 2),
+        ("Résultats au-dessus du seuil comptés", data['counters']['results_above_threshold'] == expected_results),
+        ("Clarifications comptées", data['counters']['clarifications'] == clarifications),
+        ("Candidats top-k et budget de temps comptés sans seconde présélection", len(calls) == 2
+         and top_k.metrics_snapshot()['counters']['candidates_scored'] == expected_candidates),
+        ("Export Prometheus", 'botia_stage_seconds_bucket{stage="fuzzy",le="+Inf"}' in text
+         and "botia_candidates_scored_total" in text),
+        ("Désactivée par défaut", engine.metrics_snapshot() is None and engine.metrics_text() == "")
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Instrumentation incohérente"
+    return all_passed
+
+def test_compact_records():
+    """Test de la représentation compacte : enregistrements à slots, chaînes partagées, index en array"""
+    print("\n🗜️ Test de la représentation compacte...")
+    
+    import array
+    from js.diagnostic_engine import BotIADiagnosticEngine, AhoCorasickMatcher
+    
+    engine = BotIADiagnosticEngine()
+    snapshot = engine.snapshot
+    records = engine.records
+    
+    # Un même mot-clé normalisé est un seul objet chaîne partagé par tous les diagnostics
+    shared = {}
+    interned = True
+    for record in records:
+        for kw_norm in record.keywords_norm:
+            interned = interned and shared.setdefault(kw_norm, kw_norm) is kw_norm
+    
+    patterns = ["frein", "freins", "in", "moteur", "teur", "voyant moteur"]
+    matcher = AhoCorasickMatcher(patterns)
+    texts = ["voyant moteur et freins", "frein", "rien", "moteurin"]
+    automaton_ok = all(matcher.find_all(text) == {p for p in patterns if p in text} for text in texts)
+    
+    result = engine.diagnose("voyant moteur", top_n=1)
+    
+    checks = [
+        ("Enregistrements sans __dict__", all(not hasattr(record, '__dict__') for record in records)),
+        ("Mots-clés internés et partagés", interned),
+        ("Index de positions en array", all(isinstance(positions, array.array)
+                                            for positions in snapshot.token_index.values())),
+        ("Automate compact exact", automaton_ok),
+        ("Résultats construits pour le seul top_n", len(result['top_matches']) == 1 and result['total_matches'] > 1)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Représentation compacte incohérente"
+    return all_passed
+
+def test_sharded_engine():
+    """Test du moteur réparti : fusion des shards identique à diagnose"""
+    print("\n🧩 Test du moteur réparti...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine, ShardedDiagnosticEngine
+    
+    engine = BotIADiagnosticEngine(use_snapshot=False)
+    queries = ["voyant moteur allumé", "freins qui grincent", "moteur", "frain grince",
+               "surchauffe moteur bruit", "rien à voir"]
+    
+    with ShardedDiagnosticEngine(engine.database_path, shards=3) as sharded:
+        identical = all(sharded.diagnose(query, top_n) == engine.diagnose(query, top_n)
+                        for query in queries for top_n in (1, 3))
+        batch_identical = sharded.diagnose_many(queries, 2) == engine.diagnose_many(queries, 2)
+        ambiguous = [query for query in queries if engine.diagnose(query, 1)['clarification']]
+        shard_count = sharded.shard_count
+    
+    checks = [
+        ("Trois shards démarrés", shard_count == 3),
+        ("Résultats identiques à diagnose", identical),
+        ("Lot identique à diagnose_many", batch_identical),
+        ("Clarification sur le top 2 global (top_n=1)", bool(ambiguous)),
+        ("Shards arrêtés", not sharded.processes)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Moteur réparti incohérent"
+    return all_passed
+
+def test_suggest():
+    """Test de l'autocomplétion : préfixes, derniers mots, état incrémental"""
+    print("\n⌨️ Test de l'autocomplétion...")
+    
+    import subprocess
+    from js.diagnostic_engine import BotIADiagnosticEngine, SuggestState
+    
+    engine = BotIADiagnosticEngine()
+    state = SuggestState()
+    
+    narrowing = True
+    consistent = True
+    previous = None
+    for prefix in ["f", "fr", "fre", "frei", "freins"]:
+        result = engine.suggest(prefix, 5, state)
+        if previous is not None:
+            narrowing = narrowing and previous[0] <= state.low and state.high <= previous[1]
+        previous = (state.low, state.high)
+        consistent = consistent and result == engine.suggest(prefix, 5)
+    
+    frei = engine.suggest("frei", 5)
+    tail = engine.suggest("mes freins gri", 5)
+    
+    # --suggest refusé proprement avec --shards (chaque processus n'a qu'une part des mots-clés)
+    script = str(Path(__file__).parent.parent / "js" / "diagnostic_engine.py")
+    completed = subprocess.run([sys.executable, script, "frei", "--suggest", "--shards", "2"],
+                               capture_output=True, text=True, timeout=60)
+    
+    checks = [
+        ("Mots-clés commençant par le préfixe", all(item['norm'].startswith("frei") for item in frei['keywords'])),
+        ("Mot-clé le plus fréquent en premier", frei['keywords'][0]['norm'] == "freins"),
+        ("Diagnostic suggéré", any(item['id'] == "freins_defaillants" for item in frei['diagnostics'])),
+        ("Complétion des derniers mots", tail['matched'] == "gri" and tail['keywords']),
+        ("Intervalle restreint à chaque caractère", narrowing),
+        ("État incrémental sans effet sur le résultat", consistent),
+        ("Aucune suggestion hors base", engine.suggest("xyzw")['keywords'] == []),
+        ("--suggest avec --shards refusé sans trace d'erreur", completed.returncode == 2
+         and "--shards" in completed.stderr and "Traceback" not in completed.stderr)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Autocomplétion incohérente"
+    return all_passed
+
+def test_refinement_sessions():
+    """Test des sessions de raffinement : candidats restreints, élargissement, mémoire bornée"""
+    print("\n💬 Test des sessions de raffinement...")
+    
+    import subprocess
+    import time
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine(max_sessions=2, session_ttl=0.5)
+    
+    first = engine.refine("s1", "bruit", 3)
+    initial_identical = {k: v for k, v in first.items() if k != 'session'} == engine.diagnose("bruit", 3)
+    refined = engine.refine("s1", "ça grince quand je freine", 3)
+    full = engine.diagnose("bruit ça grince quand je freine", 3)
+    
+    engine.refine("s2", "voyant moteur", 3)
+    widened = engine.refine("s2", "et aussi une fuite d'huile", 3)
+    
+    engine.refine("s3", "fumée", 3)  # Évince s1, la moins récemment utilisée
+    restarted = engine.refine("s1", "frein", 3)
+    
+    time.sleep(0.6)
+    expired = engine.refine("s3", "noire", 3)
+    
+    profiled = BotIADiagnosticEngine(metrics=True)
+    profiled.refine("p1", "bruit", 3)
+    profiled.refine("p1", "ça grince quand je freine", 3)
+    metrics = profiled.metrics_snapshot()
+    
+    # Mode interactif : diagnose ligne par ligne, le raffinement n'a lieu qu'avec --refine
+    script = str(Path(__file__).parent.parent / "js" / "diagnostic_engine.py")
+    lines = "voyant moteur\nbatterie a plat\n"
+    outputs = {}
+    for extra in ([], ["--refine"]):
+        completed = subprocess.run([sys.executable, script, "-i", "--format", "ndjson", "--profile"] + extra,
+                                   input=lines, capture_output=True, text=True, timeout=60)
+        outputs[bool(extra)] = ([json.loads(line)['input'] for line in completed.stdout.splitlines()],
+                                completed.stderr)
+    
+    checks = [
+        ("Premier tour identique à diagnose", initial_identical and first['session']['mode'] == 'initial'),
+        ("Tour suivant restreint aux candidats", refined['session']['mode'] == 'refined'
+         and refined['session']['candidates'] == first['total_matches']),
+        ("Mêmes meilleurs résultats que la requête complète", refined['top_matches'] == full['top_matches']),
+        ("Évolution des scores fournie", bool(refined['session']['score_changes'])),
+        ("Élargissement sur un mot-clé hors candidats", widened['session']['mode'] == 'widened'
+         and any(match['id'] == 'fuite_huile' for match in widened['top_matches'])),
+        ("Nombre de sessions borné", restarted['session']['mode'] == 'initial'
+         and engine.sessions.stats()['evictions'] >= 1),
+        ("Expiration des sessions inactives", expired['session']['mode'] == 'initial'),
+        ("Tours de conversation instrumentés", metrics['counters']['queries'] == 2
+         and {'normalize', 'exact', 'refine', 'ranking'} <= set(metrics['stages'])),
+        ("Mode interactif : une ligne, un diagnostic", outputs[False][0] == ["voyant moteur", "batterie a plat"]
+         and "queries: 2" in outputs[False][1] and "fuzzy" in outputs[False][1]),
+        ("Mode interactif --refine : réponse à la clarification cumulée",
+         outputs[True][0] == ["voyant moteur", "voyant moteur batterie a plat"])
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Sessions de raffinement incohérentes"
+    return all_passed
+
+def test_response_fragments():
+    """Test des fragments de réponse pré-rendus : texte et JSON identiques au rendu complet"""
+    print("\n🧱 Test des fragments de réponse...")
+    
+    import json
+    from js.diagnostic_engine import BotIADiagnosticEngine, render_diagnosis, diagnose_batch_chunk
+    
+    engine = BotIADiagnosticEngine()
+    queries = ["voyant moteur allumé", "freins qui grincent", "moteur", "frain", 'bruit "top_matches":[]', "xyz"]
+    
+    text_identical = True
+    json_identical = True
+    for query in queries:
+        for top_n in (1, 3, 5):
+            result = engine.diagnose(query, top_n)
+            text_identical = text_identical and engine.format_response(result) == render_diagnosis(result)
+            expected = json.dumps({'line': 1, **result, 'response': 'ok'}, ensure_ascii=False, separators=(',', ':'))
+            json_identical = json_identical and engine.format_json(result, {'line': 1}, {'response': 'ok'}) == expected
+    
+    result = engine.diagnose("moteur", 5)
+    fragments = engine.response_fragments(result['top_matches'][0])
+    foreign = dict(result['top_matches'][0], causes=list(result['top_matches'][0]['causes']))
+    batch = [json.loads(line) for line in diagnose_batch_chunk([(1, '{"id": "a", "query": "moteur"}')], 3, engine)]
+    
+    checks = [
+        ("Texte identique au rendu complet", text_identical),
+        ("JSON identique à json.dumps", json_identical),
+        ("Fragments rendus une seule fois", engine.response_fragments(result['top_matches'][0]) is fragments),
+        ("Résultat hors base rendu sans fragment", engine.response_fragments(foreign) is None),
+        ("Lignes batch assemblées", batch[0]['line'] == 1 and batch[0]['id'] == "a" and batch[0]['top_matches'])
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Fragments de réponse incohérents"
+    return all_passed
+
+def test_spelling_correction():
+    """Test de la correction orthographique (suppressions symétriques)"""
+    print("\n✏️ Test de la correction orthographique...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine, edit_distance
+    
+    engine = BotIADiagnosticEngine(spelling_distance=2)
+    plain = BotIADiagnosticEngine()
+    corrector = engine.snapshot.spelling
+    
+    result = engine.diagnose("mon embrayag patine", 1)
+    details = result['top_matches'][0]['details']
+    queries = ["embrayag", "voyant motuer", "surchaufe moteur", "freins qui grincent"]
+    
+    checks = [
+        ("Distance avec transposition", edit_distance("motuer", "moteur", 2) == 1),
+        ("Correction d'un token inconnu", corrector.correct("voyant motuer") == ("voyant moteur", {"motuer": "moteur"})),
+        ("Tokens du vocabulaire inchangés", corrector.correct("voyant moteur et freins")[1] == {}),
+        ("Fautes de frappe corrigées", corrector.lookup("frain") == "frein" and corrector.lookup("batery") == "batterie"),
+        ("Mots courants jamais corrigés", all(corrector.correct(word) == (word, {})
+                                              for word in ("roule", "gauche", "droite", "claque", "allume", "freine"))),
+        ("Classement inchangé sur des mots justes", engine.diagnose("roule mal", 3) == plain.diagnose("roule mal", 3)),
+        ("Corrections dans les détails", details.get('corrections') == {"embrayag": "embrayage"}
+         and details['exact_match']),
+        ("Sans correction par défaut", plain.snapshot.spelling is None
+         and 'corrections' not in plain.diagnose("mon embrayag patine", 1)['top_matches'][0]['details']),
+        ("Lot identique à diagnose", engine.diagnose_many(queries, 3) == [engine.diagnose(q, 3) for q in queries])
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Correction orthographique incohérente"
+    return all_passed
+
+def test_deadline_diagnose():
+    """Test du diagnostic avec échéance : résultat complet à temps, partiel sinon"""
+    print("\n⏱️ Test du diagnostic avec échéance...")
+    
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    engine = BotIADiagnosticEngine()
+    queries = ["voyant moteur allumé", "frain grince", "moteur bruit", "xyz"]
+    
+    identical = True
+    for query in queries:
+        result = engine.diagnose(query, 3, deadline_ms=10000)
+        identical = identical and result.pop('partial') is False and result == engine.diagnose(query, 3)
+    
+    full = engine.diagnose("voyant moteur allumé", 5)
+    partial = engine.diagnose("voyant moteur allumé", 5, deadline_ms=0)
+    full_scores = {match['id']: match['score'] for match in full['top_matches']}
+    
+    checks = [
+        ("Terminé à temps : identique à diagnose", identical),
+        ("Échéance dépassée : résultat partiel", partial['partial'] and partial['total_matches_approximate']),
+        ("Critères lexicaux conservés", bool(partial['top_matches'])),
+        ("Fuzzy non calculé", all(match['details']['fuzzy'] is None for match in partial['top_matches'])),
+        ("Scores provisoires minorants", all(match['score'] <= full_scores.get(match['id'], 1.0)
+                                             for match in partial['top_matches'])),
+        ("Résultat partiel signalé", "partiel" in engine.format_response(partial))
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Diagnostic avec échéance incohérent"
+    return all_passed
+
+def test_scoring_weights():
+    """Test des poids configurables et de l'évaluation vectorisée de scripts/tune_weights.py"""
+    print("\n⚖️ Test des poids du score...")
+    
+    import shutil
+    import tempfile
+    import numpy as np
+    from js.diagnostic_engine import BotIADiagnosticEngine, ScoringConfig
+    from scripts.tune_weights import generate_labeled_queries, load_or_extract, weight_grid, evaluate
+    
+    weights = {'exact': 0.5, 'partial': 0.1, 'overlap': 0.2, 'urgency': 0.0, 'fuzzy': 0.2}
+    engine = BotIADiagnosticEngine(use_snapshot=False)
+    tuned = BotIADiagnosticEngine(use_snapshot=False, scoring={'weights': weights, 'threshold': 0.15})
+    queries = ["voyant moteur allumé", "frein qui grince", "bruit moteur au démarrage", "batterie"]
+    
+    # Chemin indexé et scoring historique complet avec la même configuration
+    consistent = True
+    for query in queries:
+        scores = {diag_id: tuned.compute_match_score(query, diagnostic)['score']
+                  for diag_id, diagnostic in tuned.data['diagnostics'].items()}
+        expected = sorted((score for score in scores.values() if score > 0.15), reverse=True)[:3]
+        consistent = consistent and [match['score'] for match in tuned.diagnose(query)['top_matches']] == expected
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        labeled = generate_labeled_queries(engine.data, 150, seed=7)
+        cache_path = os.path.join(workdir, "features.npz")
+        features, labels, urgency, from_cache = load_or_extract(engine, labeled, cache_path)
+        _, _, _, reloaded = load_or_extract(engine, labeled, cache_path)
+        
+        # Une modification journalisée (delta log) invalide le cache
+        database_copy = os.path.join(workdir, "diagnostics.json")
+        shutil.copy(engine.database_path, database_copy)
+        edited = BotIADiagnosticEngine(database_copy, use_snapshot=False)
+        load_or_extract(edited, labeled[:10], cache_path)
+        diag_id, diagnostic = next(iter(edited.data['diagnostics'].items()))
+        edited.update_diagnostic(diag_id, dict(diagnostic, keywords=diagnostic['keywords'] + ["bruit sourd"]))
+        edited = BotIADiagnosticEngine(database_copy, use_snapshot=False)
+        _, _, _, stale = load_or_extract(edited, labeled[:10], cache_path)
+        
+        config = ScoringConfig(weights, threshold=0.15)
+        results = evaluate(features, labels, urgency, np.array([config.weights()]), [0.15], [0.15])
+        correct = 0
+        for item in labeled:
+            expected = item['expected'] or []
+            top_matches = tuned.diagnose(item['query'], 1)['top_matches']
+            correct += top_matches[0]['id'] in expected if top_matches else not expected
+        
+        saved = os.path.join(workdir, "scoring.json")
+        with open(saved, 'w', encoding='utf-8') as f:
+            json.dump({'scoring': config.as_dict()}, f)
+        loaded = ScoringConfig.coerce(saved)
+    
+    try:
+        ScoringConfig({'exact': -0.1})
+        rejected = False
+    except ValueError:
+        rejected = True
+    
+    checks = [
+        ("Poids par défaut = scoring historique", ScoringConfig().weights() == (0.4, 0.2, 0.2, 0.1, 0.1)),
+        ("Poids configurés appliqués par diagnose", consistent),
+        ("Seuil configuré appliqué", all(match['score'] > 0.15 for query in queries
+                                         for match in tuned.diagnose(query)['top_matches'])),
+        ("Critères mis en cache puis relus", not from_cache and reloaded),
+        ("Cache invalidé par le journal des modifications", not stale),
+        ("Grille de poids de somme 1", np.allclose(weight_grid(0.25).sum(axis=1), 1) and len(weight_grid(0.25)) == 70),
+        ("Précision vectorisée = précision du moteur", abs(results[0]['top1'] - correct / len(labeled)) <= 0.01),
+        ("Configuration enregistrée rechargée", loaded.as_dict() == config.as_dict()),
+        ("Poids négatif refusé", rejected)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Poids du score incohérents"
+    return all_passed
+
+def test_incremental_updates():
+    """Test des ajouts, modifications et suppressions de diagnostics sans rechargement"""
+    print("\n📝 Test des modifications incrémentales...")
+    
+    import random
+    import shutil
+    import tempfile
+    from js.diagnostic_engine import BotIADiagnosticEngine
+    
+    queries = ["voyant moteur allumé", "gyroscope hurlant", "fuite d'huile sous la voiture", "frein qui grince",
+               "batterie à plat", "sifflement turbo", "surchauffe", "xyz"]
+    contribution = {
+        "keywords": ["gyroscope hurlant", "sifflement turbo"],
+        "titre": "Turbo défaillant",
+        "urgence": "elevee",
+        "causes": ["Roulement du turbo usé"],
+        "solutions": ["Contrôler le jeu de l'arbre du turbo"],
+        "cout_estime": "500-2000€",
+        "contributeur": "mecano_test"
+    }
+    
+    with tempfile.TemporaryDirectory() as workdir:
+        database_path = os.path.join(workdir, "diagnostics.json")
+        shutil.copy(Path(__file__).parent.parent / "data" / "diagnostics.json", database_path)
+        engine = BotIADiagnosticEngine(database_path, use_snapshot=False, cache_size=64, compact_every=0)
+        before = engine.diagnose("gyroscope hurlant")  # mis en cache
+        
+        # Suite aléatoire d'ajouts, remplacements et suppressions
+        rng = random.Random(3)
+        engine.add_diagnostic("turbo", contribution)
+        added = engine.diagnose("gyroscope hurlant")
+        for step in range(12):
+            ids = list(engine.data['diagnostics'])
+            action = rng.choice(("add", "update", "remove"))
+            if action == "add":
+                engine.add_diagnostic(f"contribution_{step}", dict(contribution, keywords=[rng.choice(queries)]))
+            elif action == "update":
+                diag_id = rng.choice(ids)
+                engine.update_diagnostic(diag_id, dict(engine.data['diagnostics'][diag_id], urgence="critique"))
+            else:
+                engine.remove_diagnostic(rng.choice(ids))
+        live = {query: engine.diagnose(query, 5) for query in queries}
+        removed = engine.snapshot.removed
+        
+        # Même base reconstruite entièrement par rejeu du journal
+        replayed = BotIADiagnosticEngine(database_path, use_snapshot=False)
+        identical = all(replayed.diagnose(query, 5)['top_matches'] == live[query]['top_matches'] for query in queries)
+        batch = engine.diagnose_many(queries, 5)
+        batch_identical = all(diagnosis['top_matches'] == live[query]['top_matches']
+                              for query, diagnosis in zip(queries, batch))
+        pending = engine.pending_changes
+        
+        # Index de diagnose_many, de suggest et correcteur repris en overlay après une modification
+        derived_path = os.path.join(workdir, "derived.json")
+        shutil.copy(Path(__file__).parent.parent / "data" / "diagnostics.json", derived_path)
+        derived = BotIADiagnosticEngine(derived_path, use_snapshot=False, spelling_distance=2, compact_every=0)
+        typos = ["gyroscpe hurlnt", "zorglb bidul", "frien qui grinse", "voyant moter"]
+        prefixes = ["gyro", "zorg", "sif", "fre", "voyant m", "hurl"]
+        derived.diagnose_many(queries)
+        derived.suggest("gyro")
+        indptr = derived.snapshot.batch_index['indptr']
+        suggest_keys = derived.snapshot.suggestion_index.keys
+        spelling = derived.snapshot.spelling
+        spelling_before = [spelling.correct(derived.normalize_text(typo)) for typo in typos]
+        
+        derived.add_diagnostic("turbo", contribution)
+        derived.add_diagnostic("zorglub", dict(contribution, keywords=["zorglub bidule"]))
+        turn = derived.refine(None, "zorglub bidule")
+        derived.remove_diagnostic("zorglub")
+        derived.remove_diagnostic(next(iter(derived.data['diagnostics'])))
+        batch_reused = derived.snapshot.batch_index is not None and derived.snapshot.batch_index['indptr'] is indptr
+        derived_batch = derived.diagnose_many(queries + typos, 5)
+        reused_after_batch = derived.snapshot.batch_index['indptr'] is indptr
+        try:
+            turn = derived.refine(None, "zorglub bidule")
+            turn = derived.refine(turn['session']['id'], "bidule")
+            refine_ok = turn['session']['turn'] == 2
+        except KeyError:
+            refine_ok = False
+        
+        fresh = BotIADiagnosticEngine(derived_path, use_snapshot=False, spelling_distance=2)
+        batch_overlay = all(diagnosis['top_matches'] == fresh.diagnose(query, 5)['top_matches']
+                            for query, diagnosis in zip(queries + typos, derived_batch))
+        suggest_overlay = all(derived.suggest(prefix) == fresh.suggest(prefix) for prefix in prefixes)
+        suggest_changes = (derived.snapshot.suggestion_index.keys is suggest_keys
+                           and derived.suggest("gyro")['keywords'][0]['norm'] == "gyroscope hurlant"
+                           and not derived.suggest("zorg")['keywords'])
+        spelling_overlay = all(derived.snapshot.spelling.correct(derived.normalize_text(typo)) ==
+                               fresh.snapshot.spelling.correct(fresh.normalize_text(typo)) for typo in typos)
+        spelling_shared = (derived.snapshot.spelling is not spelling and
+                           [spelling.correct(derived.normalize_text(typo)) for typo in typos] == spelling_before)
+        
+        engine.compact()
+        compacted = BotIADiagnosticEngine(database_path, use_snapshot=False)
+        after_compaction = all(compacted.diagnose(query, 5)['top_matches'] == live[query]['top_matches']
+                               for query in queries)
+        log_removed = not os.path.exists(engine.delta_log_path) and engine.pending_changes == 0
+        
+        auto = BotIADiagnosticEngine(database_path, use_snapshot=False, compact_every=2)
+        auto.add_diagnostic("auto_1", contribution)
+        auto.add_diagnostic("auto_2", contribution)
+        auto.compactor.join()
+        with open(database_path, 'r', encoding='utf-8') as f:
+            auto_compacted = '"auto_2"' in f.read() and auto.pending_changes == 0
+        
+        errors = 0
+        for invalid in (lambda: auto.add_diagnostic("auto_1", contribution),
+                        lambda: auto.update_diagnostic("inconnu", contribution),
+                        lambda: auto.remove_diagnostic("inconnu"),
+                        lambda: auto.add_diagnostic("vide", dict(contribution, keywords=[" "])),
+                        lambda: auto.add_diagnostic("urgence", dict(contribution, urgence="énorme"))):
+            try:
+                invalid()
+            except (LookupError, ValueError):
+                errors += 1
+    
+    checks = [
+        ("Contribution en service immédiatement", added['top_matches'][0]['id'] == "turbo"),
+        ("Cache invalidé", before['top_matches'] != added['top_matches']),
+        ("Incrémental = rechargement complet", identical),
+        ("Lots cohérents avec diagnose", batch_identical),
+        ("Journal de 13 modifications", pending == 13 and removed > 0),
+        ("Index de lot repris en overlay", batch_reused and reused_after_batch and batch_overlay),
+        ("Suggestions à jour sans reconstruction", suggest_overlay and suggest_changes),
+        ("Correcteur à jour, ancien snapshot inchangé", spelling_overlay and spelling_shared),
+        ("Raffinement après suppression d'un mot-clé", refine_ok),
+        ("Compaction : base réécrite, journal vidé", after_compaction and log_removed),
+        ("Compaction automatique", auto_compacted),
+        ("Modifications invalides refusées", errors == 5)
+    ]
+    
+    all_passed = True
+    for check_name, check_result in checks:
+        print(f"  {'✅' if check_result else '❌'} {check_name}")
+        all_passed = all_passed and check_result
+    
+    assert all_passed, "Modifications incrémentales incohérentes"
+    return all_passed
+
 def main():
     """Fonction principale de test"""
     print("🧪 BotIA - Tests d'Intégration")
@@ -210,7 +1476,31 @@ def main():
         ("Importation moteur", test_engine_import),
         ("Fonctionnalités", test_engine_functionality),
         ("Formatage sortie", test_output_format),
-        ("Performance", test_performance)
+        ("Performance", test_performance),
+        ("Index précompilé", test_compiled_index),
+        ("Présélection candidats", test_candidate_pruning),
+        ("Automate exact", test_exact_automaton),
+        ("Fuzzy borné", test_fuzzy_modes),
+        ("Diagnostic par lot", test_batch_diagnose),
+        ("Mode batch JSONL", test_batch_cli),
+        ("Cache de résultats", test_result_cache),
+        ("Rechargement à chaud", test_hot_reload),
+        ("Snapshot compilé", test_compiled_snapshot),
+        ("Serveur socket", test_socket_server),
+        ("Micro-batching API", test_micro_batching),
+        ("Sélection top-k", test_top_k_bounds),
+        ("Benchmark", test_benchmark_suite),
+        ("Vérification différentielle", test_differential_verifier),
+        ("Instrumentation", test_stage_metrics),
+        ("Représentation compacte", test_compact_records),
+        ("Moteur réparti", test_sharded_engine),
+        ("Autocomplétion", test_suggest),
+        ("Sessions de raffinement", test_refinement_sessions),
+        ("Fragments de réponse", test_response_fragments),
+        ("Correction orthographique", test_spelling_correction),
+        ("Diagnostic avec échéance", test_deadline_diagnose),
+        ("Poids du score", test_scoring_weights),
+        ("Modifications incrémentales", test_incremental_updates)
     ]
     
     results = {}
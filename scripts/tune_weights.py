@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+"""
+Réglage des poids du score BotIA sur des requêtes étiquetées
+
+Les critères bruts de chaque couple (requête, diagnostic) — correspondance
+exacte, ratio de correspondances partielles, overlap, urgence, fuzzy — sont
+calculés une seule fois par le moteur puis gardés en cache (.npz). Chaque
+configuration de poids est ensuite un simple produit matriciel : des milliers
+de combinaisons poids × seuil × écart d'ambiguïté sont évaluées en quelques
+secondes (précision top-1/top-3, taux de clarification). La meilleure peut
+être enregistrée puis chargée par le moteur (--scoring).
+
+Étiquettes (JSONL) : {"query": "...", "expected": "id"} ; expected peut être
+une liste d'identifiants acceptés, ou null si aucun diagnostic n'est attendu.
+Sans fichier, un corpus étiqueté est généré depuis les mots-clés de la base.
+
+Usage:
+    python scripts/tune_weights.py --labels requetes.jsonl --save scoring.json
+    python scripts/tune_weights.py --queries 5000 --step 0.05 --thresholds 0.05,0.1,0.15
+    python js/diagnostic_engine.py "voyant moteur" --scoring scoring.json
+"""
+
+import sys
+import json
+import random
+import hashlib
+import argparse
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+
+# Ajouter le répertoire parent au path pour importer le moteur
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from js.diagnostic_engine import (BotIADiagnosticEngine, ScoringConfig, SCORING_WEIGHTS, AMBIGUITY_MIN_SCORE,
+                                  DEFAULT_SCORING)
+
+FEATURE_FORMAT = 1  # À incrémenter à chaque changement du calcul des critères
+CONFIG_CHUNK = 64  # Configurations de poids évaluées par produit matriciel (mémoire bornée)
+
+def strip_accents(text):
+    return ''.join(ch for ch in unicodedata.normalize('NFD', text) if unicodedata.category(ch) != 'Mn')
+
+def generate_labeled_queries(data, size=2000, seed=4321):
+    """
+    Corpus étiqueté déterministe : mots-clés (exacts, sans accents, avec fautes de
+    frappe, partiels, entourés de mots parasites) étiquetés par les diagnostics qui
+    les contiennent, et requêtes de bruit sans diagnostic attendu
+    """
+    rng = random.Random(seed)
+    owners = {}
+    for diag_id, diagnostic in data['diagnostics'].items():
+        for keyword in diagnostic.get('keywords', []):
+            owners.setdefault(keyword, []).append(diag_id)
+    keywords = sorted(owners)
+    fillers = ["ma voiture", "depuis ce matin", "quand je roule", "au démarrage", "bizarre", "j'ai un souci"]
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    
+    def typo(text):
+        if len(text) < 4:
+            return text
+        i = rng.randrange(1, len(text) - 1)
+        kind = rng.randrange(3)
+        if kind == 0:
+            return text[:i] + text[i + 1:]
+        if kind == 1:
+            return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+        return text[:i] + rng.choice(letters) + text[i + 1:]
+    
+    def fragment(text):
+        words = text.split()
+        if len(words) < 2:
+            return text
+        return " ".join(rng.sample(words, rng.randint(1, len(words) - 1)))
+    
+    variants = [
+        lambda keyword: keyword,
+        lambda keyword: strip_accents(keyword),
+        lambda keyword: typo(keyword),
+        lambda keyword: fragment(keyword),
+        lambda keyword: f"{rng.choice(fillers)} {keyword}",
+        lambda keyword: f"{rng.choice(fillers)} {typo(keyword)} {rng.choice(fillers)}",
+    ]
+    
+    labeled = []
+    while len(labeled) < size:
+        if rng.random() < 0.05:
+            noise = "".join(rng.choice(letters) for _ in range(rng.randint(3, 10)))
+            labeled.append({'query': noise, 'expected': None})
+            continue
+        keyword = rng.choice(keywords)
+        labeled.append({'query': rng.choice(variants)(keyword), 'expected': owners[keyword]})
+    return labeled
+
+def load_labels(path):
+    """Requêtes étiquetées d'un fichier JSONL (lignes vides ignorées)"""
+    labeled = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                labeled.append({'query': item['query'], 'expected': item.get('expected')})
+            except (json.JSONDecodeError, KeyError, TypeError) as e:
+                raise Exception(f"❌ Ligne {line_number} invalide ({e}) : attendu "
+                                '{"query": ..., "expected": ...}')
+    if not labeled:
+        raise Exception(f"❌ Aucune requête étiquetée dans {path}")
+    return labeled
+
+def extract_features(engine, labeled):
+    """
+    Critères bruts de chaque couple (requête, diagnostic), dans l'ordre de SCORING_WEIGHTS :
+    tableau (requêtes, diagnostics, critères) tel que score = critères @ poids.
+    Tous les diagnostics sont notés (pas de filtrage des candidats, qui dépend des poids).
+    """
+    snapshot = engine.snapshot
+    records = snapshot.records
+    if snapshot.batch_index is None:
+        snapshot.build_batch_index()
+    
+    queries = [snapshot.prepare_query(item['query']) for item in labeled]
+    lexical = snapshot.batch_lexical_matches(queries)
+    no_match = (None, 0, None, 0)
+    
+    features = np.zeros((len(queries), len(records), len(SCORING_WEIGHTS)))
+    for q, query in enumerate(queries):
+        for record in records:
+            exact_index, partial_matches, first_partial, token_overlap = lexical.get((q, record.position), no_match)
+            limit = len(record.keywords) if exact_index is None else exact_index
+            fuzzy_best, _ = engine.best_fuzzy(query, record, limit, limit)
+            features[q, record.position] = (
+                1.0 if exact_index is not None else 0.0,
+                min(partial_matches / len(record.keywords), 1.0),
+                token_overlap,
+                record.urgency_score / 10,
+                fuzzy_best
+            )
+    return features
+
+def label_matrix(engine, labeled):
+    """Matrice booléenne (requêtes, diagnostics) des diagnostics acceptés"""
+    positions = {record.id: record.position for record in engine.snapshot.records}
+    labels = np.zeros((len(labeled), len(positions)), dtype=bool)
+    for q, item in enumerate(labeled):
+        expected = item['expected']
+        for diag_id in ([expected] if isinstance(expected, str) else expected or []):
+            if diag_id not in positions:
+                raise Exception(f"❌ Diagnostic étiqueté inconnu: {diag_id} (requête {item['query']!r})")
+            labels[q, positions[diag_id]] = True
+    return labels
+
+def load_or_extract(engine, labeled, cache_path=None):
+    """
+    Critères et étiquettes depuis le cache .npz s'il correspond à la même base (JSON et
+    journal des modifications), aux mêmes requêtes et au même moteur ; sinon calculés
+    puis enregistrés dans le cache
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(Path(engine.database_path).read_bytes())
+    delta_log = Path(engine.delta_log_path)
+    fingerprint.update(b'\0delta\0' + (delta_log.read_bytes() if delta_log.exists() else b''))
+    fingerprint.update(json.dumps([labeled, FEATURE_FORMAT, engine.fuzzy_mode, engine.fuzzy_tolerance,
+                                   engine.spelling_distance], ensure_ascii=False).encode('utf-8'))
+    key = fingerprint.hexdigest()
+    
+    if cache_path and Path(cache_path).exists():
+        with np.load(cache_path) as cached:
+            if str(cached['key']) == key:
+                return cached['features'], cached['labels'], cached['urgency'], True
+    
+    features = extract_features(engine, labeled)
+    labels = label_matrix(engine, labeled)
+    urgency = np.array([record.urgency_score for record in engine.snapshot.records], dtype=np.int64)
+    if cache_path:
+        np.savez_compressed(cache_path, key=np.array(key), features=features, labels=labels, urgency=urgency)
+    return features, labels, urgency, False
+
+def weight_grid(step=0.05, include=()):
+    """Toutes les pondérations de pas step dont la somme vaut 1 (plus les configurations include)"""
+    units = round(1 / step)
+    if abs(units * step - 1) > 1e-9:
+        raise Exception(f"❌ Pas de grille invalide: {step} (1 doit en être un multiple)")
+    
+    grid = []
+    def compose(prefix, remaining, slots):
+        if slots == 1:
+            grid.append(prefix + (remaining,))
+            return
+        for value in range(remaining + 1):
+            compose(prefix + (value,), remaining - value, slots - 1)
+    compose((), units, len(SCORING_WEIGHTS))
+    
+    weights = np.array(grid, dtype=np.float64) / units
+    if len(include):
+        weights = np.unique(np.vstack([np.asarray(include, dtype=np.float64), weights]).round(9), axis=0)
+    return weights
+
+def score_millis(flat_features, weights):
+    """
+    Scores en millièmes, (configurations, couples), par un seul produit matriciel.
+    Seuls les scores à mi-chemin entre deux millièmes peuvent être arrondis autrement
+    que par round() dans finish_match (ordre des additions) : effet négligeable sur
+    la précision mesurée.
+    """
+    scores = weights @ flat_features.T
+    scores *= 1000
+    return np.rint(scores, out=scores).astype(np.int64)
+
+def evaluate(features, labels, urgency, weights, thresholds, deltas, min_score=AMBIGUITY_MIN_SCORE, top=3):
+    """
+    Évalue chaque configuration (poids, seuil, écart d'ambiguïté) : classement de
+    build_diagnosis (score arrondi au millième, urgence, ordre de la base), puis
+    précision top-1/top-n et clarifications.
+    
+    Le classement ne dépend pas du seuil : les top-n sont extraits une fois par
+    pondération, chaque seuil ne fait que masquer les scores insuffisants.
+    Une requête sans diagnostic attendu est juste si aucun score ne dépasse le seuil.
+    
+    Returns:
+        list: un dictionnaire de mesures par configuration
+    """
+    n_queries, n_diagnostics, n_features = features.shape
+    top = min(top, n_diagnostics)
+    flat_features = features.reshape(-1, n_features)
+    flat_labels = labels.reshape(-1)
+    rows = np.arange(n_queries)[None, :] * n_diagnostics
+    expects_none = ~labels.any(axis=1)
+    # Départage des scores égaux : urgence décroissante puis ordre de la base
+    tie_break = urgency * n_diagnostics + (n_diagnostics - 1 - np.arange(n_diagnostics))
+    tie_range = 10 * n_diagnostics
+    
+    results = []
+    for start in range(0, len(weights), CONFIG_CHUNK):
+        chunk = weights[start:start + CONFIG_CHUNK]
+        millis = score_millis(flat_features, chunk)
+        keys = (millis * tie_range).reshape(len(chunk), n_queries, n_diagnostics) + tie_break
+        
+        # top-n par argmax successifs (n petit devant le nombre de diagnostics)
+        best, best_millis = [], []
+        for rank in range(top):
+            position = keys.argmax(axis=2)
+            best_key = np.take_along_axis(keys, position[:, :, None], axis=2)[:, :, 0]
+            best.append(position)
+            best_millis.append(best_key // tie_range)
+            if rank + 1 < top:
+                np.put_along_axis(keys, position[:, :, None], -1, axis=2)
+        hits = np.stack([flat_labels[rows + position] for position in best], axis=2)
+        best_millis = np.stack(best_millis, axis=2)
+        
+        for threshold in thresholds:
+            found = best_millis > round(threshold * 1000)
+            answered = found[:, :, 0]
+            top1 = np.where(expects_none, ~answered, hits[:, :, 0] & answered)
+            topn = np.where(expects_none, ~answered, (hits & found).any(axis=2))
+            errors = ~top1
+            error_counts = errors.sum(axis=1)
+            top1_rate, topn_rate = top1.mean(axis=1), topn.mean(axis=1)
+            
+            # Détection d'ambiguïté sur les deux meilleurs scores (en millièmes)
+            if top > 1:
+                candidates = found[:, :, 1] & (best_millis[:, :, 0] > round(min_score * 1000))
+                gaps = best_millis[:, :, 0] - best_millis[:, :, 1]
+            else:
+                candidates, gaps = np.zeros_like(answered), np.zeros_like(best_millis[:, :, 0])
+            
+            for delta in deltas:
+                clarified = candidates & (gaps < round(delta * 1000))
+                clarification_rate = clarified.mean(axis=1)
+                # Part des erreurs top-1 signalées par une clarification
+                errors_clarified = np.where(error_counts > 0, (clarified & errors).sum(axis=1) /
+                                            np.maximum(error_counts, 1), 1.0)
+                for c, config_weights in enumerate(chunk.tolist()):
+                    results.append({
+                        'weights': dict(zip(SCORING_WEIGHTS, (round(weight, 6) for weight in config_weights))),
+                        'threshold': threshold,
+                        'ambiguity_delta': delta,
+                        'top1': float(top1_rate[c]),
+                        f'top{top}': float(topn_rate[c]),
+                        'clarification_rate': float(clarification_rate[c]),
+                        'errors_clarified': float(errors_clarified[c])
+                    })
+    return results
+
+def predict(features, urgency, config, top=3):
+    """Classement d'une configuration pour chaque requête (positions des diagnostics, comme diagnose)"""
+    n_queries, n_diagnostics, n_features = features.shape
+    millis = score_millis(features.reshape(-1, n_features), np.array([config.weights()]))
+    millis = millis.reshape(n_queries, n_diagnostics)
+    predictions = []
+    threshold = round(config.threshold * 1000)
+    for row in millis:
+        ranked = sorted((position for position in range(n_diagnostics) if row[position] > threshold),
+                        key=lambda position: (-row[position], -urgency[position], position))
+        predictions.append(ranked[:top])
+    return predictions
+
+def parse_values(text):
+    return [float(value) for value in text.split(",") if value.strip()]
+
+def main():
+    """Fonction principale de réglage"""
+    
+    parser = argparse.ArgumentParser(description='Réglage des poids du score BotIA')
+    parser.add_argument('--database', '-d', default='data/diagnostics.json', help='Base de données JSON')
+    parser.add_argument('--labels', '-l', help='Requêtes étiquetées JSONL (défaut: corpus généré)')
+    parser.add_argument('--queries', '-n', type=int, default=2000, help='Taille du corpus généré (défaut: 2000)')
+    parser.add_argument('--seed', type=int, default=4321, help='Graine du corpus généré')
+    parser.add_argument('--cache', help='Cache des critères .npz (défaut: <base>.features.npz)')
+    parser.add_argument('--step', type=float, default=0.1,
+                        help='Pas de la grille des poids de somme 1 (défaut: 0.1, 1001 pondérations ; 0.05: 10626)')
+    parser.add_argument('--thresholds', default="0.05,0.1,0.15,0.2", help='Seuils de pertinence évalués')
+    parser.add_argument('--deltas', default="0.05,0.1,0.15,0.2", help="Écarts d'ambiguïté évalués")
+    parser.add_argument('--top', type=int, default=3, help='Précision top-n rapportée en plus du top-1 (défaut: 3)')
+    parser.add_argument('--show', type=int, default=10, help='Configurations affichées (défaut: 10)')
+    parser.add_argument('--fuzzy-tolerance', type=float, default=0.0, help='fuzzy_tolerance du moteur')
+    parser.add_argument('--spelling', type=int, default=0, metavar='DISTANCE', help='Correction orthographique')
+    parser.add_argument('--save', metavar='FICHIER', help='Enregistrer la meilleure configuration (moteur: --scoring)')
+    parser.add_argument('--output', '-o', help='Toutes les configurations évaluées (JSON)')
+    args = parser.parse_args()
+    
+    print("⚖️ BotIA - Réglage des poids du score")
+    print("=" * 50)
+    
+    try:
+        engine = BotIADiagnosticEngine(args.database, fuzzy_tolerance=args.fuzzy_tolerance,
+                                       spelling_distance=args.spelling, use_snapshot=False)
+        if args.labels:
+            labeled = load_labels(args.labels)
+        else:
+            labeled = generate_labeled_queries(engine.data, args.queries, args.seed)
+        
+        cache_path = args.cache or f"{args.database}.features.npz"
+        features, labels, urgency, from_cache = load_or_extract(engine, labeled, cache_path)
+        print(f"📦 Critères {'lus depuis' if from_cache else 'calculés, enregistrés dans'} {cache_path} "
+              f"({features.shape[0]} requêtes × {features.shape[1]} diagnostics)")
+        
+        weights = weight_grid(args.step, include=[DEFAULT_SCORING.weights()])
+        thresholds, deltas = parse_values(args.thresholds), parse_values(args.deltas)
+        results = evaluate(features, labels, urgency, weights, thresholds, deltas, top=args.top)
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        sys.exit(1)
+    
+    top_key = f'top{min(args.top, features.shape[1])}'
+    # Meilleure précision, puis le moins de clarifications inutiles
+    results.sort(key=lambda r: (r['top1'], r[top_key], r['errors_clarified'], -r['clarification_rate']), reverse=True)
+    print(f"🔢 {len(results)} configurations ({len(weights)} pondérations × {len(thresholds)} seuils × "
+          f"{len(deltas)} écarts)")
+    
+    def describe(result):
+        weights_text = " ".join(f"{name}={weight:.2f}" for name, weight in result['weights'].items())
+        return (f"{weights_text} | seuil {result['threshold']:.2f} | écart {result['ambiguity_delta']:.2f} | "
+                f"top-1 {result['top1']:.1%} | {top_key} {result[top_key]:.1%} | "
+                f"clarifications {result['clarification_rate']:.1%} "
+                f"(erreurs signalées {result['errors_clarified']:.1%})")
+    
+    for rank, result in enumerate(results[:args.show], 1):
+        print(f"  {rank:>2}. {describe(result)}")
+    
+    reference = dict(zip(SCORING_WEIGHTS, DEFAULT_SCORING.weights()))
+    historical = [r for r in results if r['weights'] == reference and r['threshold'] == DEFAULT_SCORING.threshold
+                  and r['ambiguity_delta'] == DEFAULT_SCORING.ambiguity_delta]
+    if historical:
+        print(f"\n📌 Historique : {describe(historical[0])}")
+    
+    best = results[0]
+    if args.save:
+        config = ScoringConfig(best['weights'], best['threshold'], best['ambiguity_delta'])
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({'scoring': config.as_dict(),
+                       'evaluation': {key: value for key, value in best.items()
+                                      if key not in ('weights', 'threshold', 'ambiguity_delta')},
+                       'queries': len(labeled), 'database': args.database},
+                      f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Configuration: {args.save} (python js/diagnostic_engine.py ... --scoring {args.save})")
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"💾 Résultats: {args.output}")
+
+if __name__ == "__main__":
+    main()
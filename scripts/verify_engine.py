@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Vérification différentielle du moteur BotIA
+
+Compare les modes optimisés du moteur (index, top-k, lots, cache, snapshot
+compilé...) à une copie figée du scoring historique sur un large corpus de
+requêtes générées : classement, scores, mot-clé retenu, total et clarification.
+Chaque divergence est rapportée avec un diff ; le code de sortie est 1 s'il y en a.
+
+Usage:
+    python scripts/verify_engine.py --queries 5000
+    python scripts/verify_engine.py --modes top-k,batch --fuzzy-tolerance 0.05 --tolerance 0.006
+"""
+
+import sys
+import os
+import json
+import random
+import difflib
+import argparse
+import tempfile
+import unicodedata
+from difflib import SequenceMatcher
+from pathlib import Path
+
+# Ajouter le répertoire parent au path pour importer le moteur
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from js.diagnostic_engine import BotIADiagnosticEngine, ShardedDiagnosticEngine
+
+# Copie figée de la configuration historique : ne pas synchroniser avec le moteur
+REFERENCE_URGENCY_SCORE = {"critique": 9, "elevee": 7, "moyenne": 4, "faible": 1}
+MODES = ('fast', 'top-k', 'batch', 'cache', 'snapshot', 'sharded')
+
+class ReferenceScorer:
+    """
+    Scoring historique du moteur (version 3.0.0), figé : chaque diagnostic est
+    noté mot-clé par mot-clé avec SequenceMatcher. Ne doit jamais être optimisé.
+    """
+    
+    def __init__(self, data):
+        self.data = data
+    
+    def normalize_text(self, text):
+        text = text.lower()
+        text = unicodedata.normalize('NFD', text)
+        text = ''.join(ch for ch in text if unicodedata.category(ch) != 'Mn')
+        return text.strip()
+    
+    def compute_match_score(self, user_input, diagnostic):
+        input_norm = self.normalize_text(user_input)
+        input_tokens = set(input_norm.split())
+        
+        best_keyword = None
+        exact_match = 0
+        token_overlap = 0
+        fuzzy_best = 0
+        partial_matches = 0
+        
+        keywords = diagnostic.get('keywords', [])
+        
+        for keyword in keywords:
+            kw_norm = self.normalize_text(keyword)
+            kw_tokens = set(kw_norm.split())
+            
+            if kw_norm in input_norm:
+                exact_match = 1.0
+                best_keyword = keyword
+                break
+            
+            if any(kw_word in input_norm for kw_word in kw_tokens):
+                partial_matches += 1
+                if best_keyword is None:
+                    best_keyword = keyword
+            
+            intersection = input_tokens.intersection(kw_tokens)
+            union = input_tokens.union(kw_tokens)
+            
+            if union:
+                overlap_ratio = len(intersection) / len(union)
+                token_overlap = max(token_overlap, overlap_ratio)
+            
+            fuzzy_score = SequenceMatcher(None, input_norm, kw_norm).ratio()
+            if fuzzy_score > fuzzy_best:
+                fuzzy_best = fuzzy_score
+                if best_keyword is None and fuzzy_score > 0.6:
+                    best_keyword = keyword
+        
+        urgency_score = REFERENCE_URGENCY_SCORE.get(diagnostic.get('urgence', 'faible'), 1)
+        
+        score = (
+            0.4 * exact_match +
+            0.2 * min(partial_matches / len(keywords), 1.0) +
+            0.2 * token_overlap +
+            0.1 * (urgency_score / 10) +
+            0.1 * fuzzy_best
+        )
+        
+        return {
+            'score': round(score, 3),
+            'matched_keyword': best_keyword,
+            'exact_match': exact_match > 0,
+            'partial_matches': partial_matches,
+            'token_overlap': round(token_overlap, 3),
+            'fuzzy': round(fuzzy_best, 3)
+        }
+    
+    def diagnose(self, user_input):
+        """Classement complet (tous les résultats au-dessus du seuil) et clarification"""
+        results = []
+        for diag_id, diag_data in self.data['diagnostics'].items():
+            match_info = self.compute_match_score(user_input, diag_data)
+            if match_info['score'] > 0.1:
+                results.append({
+                    'id': diag_id,
+                    'titre': diag_data['titre'],
+                    'score': match_info['score'],
+                    'urgence': diag_data['urgence'],
+                    'urgence_score': REFERENCE_URGENCY_SCORE.get(diag_data['urgence'], 1),
+                    'matched_keyword': match_info['matched_keyword'],
+                    'details': match_info
+                })
+        
+        results.sort(key=lambda x: (x['score'], x['urgence_score']), reverse=True)
+        
+        clarification = None
+        if len(results) >= 2:
+            delta_score = results[0]['score'] - results[1]['score']
+            if delta_score < 0.15 and results[0]['score'] > 0.4:
+                clarification = (
+                    f"🤔 Symptômes ambigus entre '{results[0]['titre']}' et '{results[1]['titre']}'. "
+                    f"Pouvez-vous préciser : s'agit-il plutôt de {results[0]['titre'].lower()} "
+                    f"ou de {results[1]['titre'].lower()} ?"
+                )
+        
+        return {'total_matches': len(results), 'ranking': results, 'clarification': clarification}
+
+def generate_corpus(data, size=5000, seed=1234):
+    """
+    Corpus de requêtes déterministe : mots-clés exacts, casse et accents modifiés,
+    combinaisons, fautes de frappe, fragments, phrases avec mots parasites,
+    symptômes des diagnostics critiques, bruit et cas limites
+    """
+    rng = random.Random(seed)
+    diagnostics = data['diagnostics']
+    keywords = [keyword for diag in diagnostics.values() for keyword in diag['keywords']]
+    critical = [keyword for diag in diagnostics.values() if diag.get('urgence') == 'critique'
+                for keyword in diag['keywords']] or keywords
+    words = sorted({word for keyword in keywords for word in keyword.split()})
+    fillers = ["ma voiture", "depuis ce matin", "quand je freine", "au démarrage", "bizarre", "j'ai un"]
+    letters = "abcdefghijklmnopqrstuvwxyzéèàç"
+    
+    def typo(text):
+        if len(text) < 3:
+            return text
+        i = rng.randrange(len(text) - 1)
+        kind = rng.randrange(4)
+        if kind == 0:
+            return text[:i] + text[i + 1:]
+        if kind == 1:
+            return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+        if kind == 2:
+            return text[:i] + rng.choice(letters) + text[i + 1:]
+        return text[:i] + rng.choice(letters) + text[i:]
+    
+    generators = [
+        lambda: rng.choice(keywords),
+        lambda: rng.choice(keywords).upper(),
+        lambda: ''.join(ch for ch in unicodedata.normalize('NFD', rng.choice(keywords))
+                        if unicodedata.category(ch) != 'Mn'),
+        lambda: f"{rng.choice(keywords)} et {rng.choice(keywords)}",
+        lambda: typo(rng.choice(keywords)),
+        lambda: typo(typo(rng.choice(keywords))),
+        lambda: rng.choice(words)[:rng.randint(2, 6)],
+        lambda: f"{rng.choice(fillers)} {rng.choice(keywords)} {rng.choice(fillers)}",
+        lambda: f"{rng.choice(fillers)} {typo(rng.choice(critical))}",
+        lambda: " ".join(rng.choice(words) for _ in range(rng.randint(1, 6))),
+        lambda: "".join(rng.choice(letters) for _ in range(rng.randint(1, 12))),
+    ]
+    
+    corpus = ["", " ", "xyz", "voiture", "bruit", "voyant"]
+    while len(corpus) < size:
+        corpus.append(rng.choice(generators)())
+    return corpus[:size]
+
+def describe(results):
+    """Lignes comparables d'un classement (pour le diff)"""
+    return [f"{r['id']} score={r['score']} urgence={r['urgence']} mot-clé={r['matched_keyword']!r}"
+            for r in results]
+
+def compare_diagnoses(reference, candidate, top_n, tolerance=0.0):
+    """
+    Écarts entre le classement de référence et le résultat d'un mode optimisé.
+    Avec une tolérance, deux diagnostics peuvent s'échanger si leurs scores de
+    référence sont à moins de `tolerance` ; la clarification peut basculer si
+    elle est à moins de `tolerance` de ses seuils. Retourne une liste de messages.
+    """
+    problems = []
+    expected = reference['ranking'][:top_n]
+    reference_scores = {r['id']: r['score'] for r in reference['ranking']}
+    top = candidate['top_matches']
+    
+    # Diagnostics de référence qu'un écart de `tolerance` peut faire passer sous le seuil
+    borderline = sum(1 for r in reference['ranking'] if r['score'] <= 0.1 + tolerance) if tolerance else 0
+    total = candidate['total_matches']
+    if candidate.get('total_matches_approximate'):
+        if total > reference['total_matches']:
+            problems.append(f"total_matches minoré attendu: {total} > {reference['total_matches']}")
+    elif abs(total - reference['total_matches']) > borderline:
+        problems.append(f"total_matches: {reference['total_matches']} → {total}")
+    
+    if not len(expected) - borderline <= len(top) <= len(expected):
+        problems.append(f"nombre de résultats: {len(expected)} → {len(top)}")
+    
+    for rank, (ref, cand) in enumerate(zip(expected, top), 1):
+        if ref['id'] != cand['id']:
+            swap_score = reference_scores.get(cand['id'])
+            if tolerance == 0 or swap_score is None or abs(swap_score - ref['score']) > tolerance:
+                problems.append(f"rang {rank}: {ref['id']} → {cand['id']}")
+            continue
+        if abs(ref['score'] - cand['score']) > tolerance + 1e-9:
+            problems.append(f"rang {rank} {ref['id']}: score {ref['score']} → {cand['score']}")
+        if tolerance == 0 and ref['details'] != cand['details']:
+            problems.append(f"rang {rank} {ref['id']}: détails {ref['details']} → {cand['details']}")
+        elif ref['details']['exact_match'] != cand['details']['exact_match']:
+            problems.append(f"rang {rank} {ref['id']}: exact_match {ref['details']['exact_match']} → "
+                            f"{cand['details']['exact_match']}")
+    
+    # Un diagnostic critique peut céder sa place à un score à moins de `tolerance` du sien
+    floor = top[-1]['score'] if top else 0.1
+    missing_critical = {r['id'] for r in expected if r['urgence'] == 'critique'
+                        and r['score'] > floor + tolerance} - {r['id'] for r in top}
+    if missing_critical:
+        problems.append(f"🚨 diagnostic(s) critique(s) absent(s): {', '.join(sorted(missing_critical))}")
+    
+    if (reference['clarification'] is None) != (candidate['clarification'] is None) or \
+            (tolerance == 0 and reference['clarification'] != candidate['clarification']):
+        ranking = reference['ranking']
+        borderline = tolerance > 0 and len(ranking) >= 2 and (
+            abs(ranking[0]['score'] - ranking[1]['score'] - 0.15) <= 2 * tolerance or
+            abs(ranking[0]['score'] - 0.4) <= tolerance)
+        if not borderline:
+            problems.append(f"clarification: {reference['clarification']!r} → {candidate['clarification']!r}")
+    
+    return problems
+
+def build_modes(database_path, names, fuzzy_tolerance=0.0, workdir=None):
+    """
+    Modes optimisés à vérifier : nom -> fonction (requêtes, top_n) -> résultats.
+    Tous partagent la base database_path.
+    """
+    # Sans plafond des candidats fuzzy seuls (approximation documentée de find_candidates)
+    base = {'database_path': database_path, 'fuzzy_tolerance': fuzzy_tolerance, 'use_snapshot': False,
+            'fuzzy_candidates': 0}
+    modes = {}
+    for name in names:
+        if name == 'fast':
+            engine = BotIADiagnosticEngine(**base)
+            modes[name] = lambda queries, top_n, engine=engine: [engine.diagnose(q, top_n) for q in queries]
+        elif name == 'top-k':
+            engine = BotIADiagnosticEngine(**base, top_k=True)
+            modes[name] = lambda queries, top_n, engine=engine: [engine.diagnose(q, top_n) for q in queries]
+        elif name == 'batch':
+            engine = BotIADiagnosticEngine(**base)
+            modes[name] = lambda queries, top_n, engine=engine: engine.diagnose_many(queries, top_n)
+        elif name == 'cache':
+            engine = BotIADiagnosticEngine(**base, cache_size=256)
+            # Deuxième passe : les résultats viennent du cache
+            modes[name] = lambda queries, top_n, engine=engine: [
+                (engine.diagnose(q, top_n), engine.diagnose(q, top_n))[1] for q in queries]
+        elif name == 'snapshot':
+            snapshot_path = os.path.join(workdir or tempfile.mkdtemp(), "verify.snapshot")
+            BotIADiagnosticEngine(**base).compile_snapshot(snapshot_path)
+            engine = BotIADiagnosticEngine(**dict(base, use_snapshot=True), snapshot_path=snapshot_path)
+            modes[name] = lambda queries, top_n, engine=engine: [engine.diagnose(q, top_n) for q in queries]
+        elif name == 'sharded':
+            engine = ShardedDiagnosticEngine(shards=3, **base)
+            modes[name] = lambda queries, top_n, engine=engine: [engine.diagnose(q, top_n) for q in queries]
+        else:
+            raise ValueError(f"❌ Mode inconnu: {name} (attendu: {', '.join(MODES)})")
+    return modes
+
+def verify(modes, reference, corpus, top_values=(1, 3, 5), tolerance=0.0):
+    """Compare chaque mode à la référence sur tout le corpus ; retourne la liste des divergences"""
+    expected = [reference.diagnose(query) for query in corpus]
+    divergences = []
+    for name, run in modes.items():
+        for top_n in top_values:
+            for query, ref, cand in zip(corpus, expected, run(corpus, top_n)):
+                problems = compare_diagnoses(ref, cand, top_n, tolerance)
+                if problems:
+                    diff = list(difflib.unified_diff(describe(ref['ranking'][:top_n]), describe(cand['top_matches']),
+                                                     'référence', name, lineterm=''))
+                    divergences.append({'mode': name, 'query': query, 'top_n': top_n,
+                                        'problems': problems, 'diff': diff})
+    return divergences
+
+def main():
+    """Fonction principale de vérification"""
+    
+    parser = argparse.ArgumentParser(description='Vérification différentielle du moteur BotIA')
+    parser.add_argument('--database', '-d', default='data/diagnostics.json', help='Base de données JSON')
+    parser.add_argument('--queries', '-n', type=int, default=5000, help='Taille du corpus généré (défaut: 5000)')
+    parser.add_argument('--seed', type=int, default=1234, help='Graine du corpus')
+    parser.add_argument('--modes', default=",".join(MODES), help=f"Modes vérifiés (défaut: {','.join(MODES)})")
+    parser.add_argument('--top', default="1,3,5", help='Valeurs de top_n vérifiées (défaut: 1,3,5)')
+    parser.add_argument('--fuzzy-tolerance', type=float, default=0.0, help='fuzzy_tolerance des moteurs vérifiés')
+    parser.add_argument('--tolerance', type=float, default=0.0, help='Écart de score accepté (défaut: 0)')
+    parser.add_argument('--report', help='Rapport JSON des divergences')
+    parser.add_argument('--max-print', type=int, default=20, help='Divergences affichées (défaut: 20)')
+    args = parser.parse_args()
+    
+    print("🔬 BotIA - Vérification différentielle")
+    print("=" * 50)
+    
+    try:
+        with open(args.database, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        corpus = generate_corpus(data, args.queries, args.seed)
+        with tempfile.TemporaryDirectory() as workdir:
+            modes = build_modes(args.database, [m.strip() for m in args.modes.split(",") if m.strip()],
+                                args.fuzzy_tolerance, workdir)
+            top_values = [int(top_n) for top_n in args.top.split(",")]
+            divergences = verify(modes, ReferenceScorer(data), corpus, top_values, args.tolerance)
+    except Exception as e:
+        print(f"❌ Erreur: {e}")
+        sys.exit(1)
+    
+    for divergence in divergences[:args.max_print]:
+        print(f"\n❌ [{divergence['mode']}] top {divergence['top_n']} : {divergence['query']!r}")
+        for problem in divergence['problems']:
+            print(f"   - {problem}")
+        for line in divergence['diff']:
+            print(f"   {line}")
+    
+    print(f"\n📊 {len(corpus)} requêtes × {len(top_values)} valeurs de top_n × {len(modes)} modes")
+    for name in modes:
+        count = sum(1 for d in divergences if d['mode'] == name)
+        print(f"  {'✅' if count == 0 else '❌'} {name}: {count} divergence(s)")
+    
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({'queries': len(corpus), 'modes': list(modes), 'tolerance': args.tolerance,
+                       'divergences': divergences}, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Rapport: {args.report}")
+    
+    sys.exit(1 if divergences else 0)
+
+if __name__ == "__main__":
+    main()